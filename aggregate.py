@@ -0,0 +1,449 @@
+"""
+按工况点分段求取统计量
+"""
+
+import numpy as np
+import pandas as pd
+
+
+STATS = ('mean', 'std', 'min', 'max', 'count')
+# 稳态的判断条件: 滑动窗口内的标准差不大于 rel_tol * |窗口均值| + abs_tol * 该变量绝对值的最大值
+STEADY_REL_TOL = 0.01
+STEADY_ABS_TOL = 0.002
+
+
+def steady_state_mask(values, codes, length, rel_tol=STEADY_REL_TOL, abs_tol=STEADY_ABS_TOL):
+    """
+    找出每组中最长的稳态区间
+
+    由累加和求出以每一行结尾、长度为 length 的滑动窗口的均值和方差, 所有变量都满足稳态条件的窗口为稳态窗口,
+    被稳态窗口覆盖的行组成稳态区间, 每组只保留最长的一段, 没有稳态窗口的组保留全部数据
+
+    :param values[ndarray]: 二维数组， 每列为一个判断稳态的变量， 行已按组排列
+    :param codes[ndarray]: 每一行的组号， 从 0 开始连续递增
+    :param length[int]: 滑动窗口的长度
+    :param rel_tol, abs_tol: 稳态判断的相对容差及绝对容差
+
+    :return bool 数组， True 表示该行位于所在组的最长稳态区间内
+    """
+    n_rows = len(codes)
+    sizes = np.bincount(codes)
+    starts = np.cumsum(sizes) - sizes
+    row = np.arange(n_rows)
+    position = row - starts[codes]
+    ends = starts[codes] + sizes[codes]
+    # 窗口 [first, row] 完全位于组内时才参与判断
+    settled = position >= length - 1
+    first = np.maximum(row + 1 - length, 0)
+    for value in np.asarray(values, dtype=np.float64).T:
+        nan = np.isnan(value)
+        value = np.where(nan, 0, value)
+        scale = np.max(np.abs(value), initial=0)
+        # 减去组内均值后再累加， 减小累加和的舍入误差
+        with np.errstate(invalid='ignore'):
+            offset = (np.bincount(codes, value, len(sizes)) /
+                      np.bincount(codes, ~nan, len(sizes)))[codes]
+        value = np.where(nan, 0, value - offset)
+        nan_sum = np.r_[0, np.cumsum(nan)]
+        value_sum = np.r_[0, np.cumsum(value)]
+        square_sum = np.r_[0, np.cumsum(value ** 2)]
+        mean = (value_sum[row + 1] - value_sum[first]) / length
+        var = np.maximum((square_sum[row + 1] - square_sum[first]) / length - mean ** 2, 0)
+        with np.errstate(invalid='ignore'):
+            settled &= ((nan_sum[row + 1] == nan_sum[first]) &
+                        (np.sqrt(var) <= rel_tol * np.abs(mean + offset) + abs_tol * scale))
+
+    # * 被任意一个稳态窗口覆盖的行
+    settled_sum = np.r_[0, np.cumsum(settled)]
+    covered = settled_sum[np.minimum(row + length, ends)] > settled_sum[row]
+    # * 找出每组中最长的连续区间， 长度相同时取靠前的一段
+    new_run = covered & ((position == 0) | ~np.r_[False, covered[:-1]])
+    run_starts = np.flatnonzero(new_run)
+    best_run = np.full(len(sizes), -1)
+    if len(run_starts):
+        run_id = np.cumsum(new_run) - 1
+        run_length = np.bincount(run_id[covered], minlength=len(run_starts))
+        run_group = codes[run_starts]
+        order = np.lexsort((run_starts, -run_length, run_group))
+        best = order[np.r_[True, run_group[order][1:] != run_group[order][:-1]]]
+        best_run[run_group[best]] = best
+        mask = covered & (run_id == best_run[codes])
+    else:
+        mask = np.zeros(n_rows, dtype=bool)
+    return mask | (best_run[codes] < 0)
+
+
+def _channel_values(data, channel, rows):
+    """
+    获取判断稳态的变量， channel 为多个变量名组成的元组时取其乘积， 如转速与转矩的乘积即为功率
+    """
+    if isinstance(channel, tuple):
+        value = np.ones(len(rows))
+        for column in channel:
+            value = value * data[column].to_numpy(dtype=np.float64)[rows]
+        return value
+    return data[channel].to_numpy(dtype=np.float64)[rows]
+
+
+def segment_rows(data, keys, window=None, row_mask=None):
+    """
+    按 keys 对 data 分组， 并选出每组中参与统计的行
+
+    :param data[DataFrame]: 待处理的数据
+    :param keys[list]: 分组的变量名， 变量值为 nan 的行不参与统计
+    :param window[tuple]: 每组中参与统计的行
+        None: 所有行
+        ('head', n): 前 n 行
+        ('tail', n): 后 n 行
+        ('center', n): 中间的 n 行
+        ('time', column, duration): column 的值与该组第一行相差小于 duration 的行
+        ('steady', length, channels[, rel_tol, abs_tol]): channels 中的变量都处于稳态的最长区间,
+            见 steady_state_mask, channels 中的元组表示其中变量的乘积
+    :param row_mask[ndarray]: 按 window 选出后再剔除的行， False 表示剔除
+
+    :return rows[ndarray]: 参与统计的行号， 按组排列， 组内保持原有顺序
+            bounds[ndarray]: 各组在 rows 中的起始位置
+    """
+    # 分组变量为 nan 的行， 其组号为 -1 (新版 pandas) 或 nan (旧版 pandas)
+    codes = data.groupby(keys, sort=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    valid = np.flatnonzero(codes >= 0)
+    order = valid[np.argsort(codes[valid], kind='stable')]
+    codes = codes[order]
+    sizes = np.bincount(codes)
+    starts = np.cumsum(sizes) - sizes
+    # 每一行在组内的位置及其所在组的大小
+    position = np.arange(len(order)) - starts[codes]
+    size = sizes[codes]
+
+    if window is None:
+        selected = np.ones(len(order), dtype=bool)
+    elif window[0] == 'head':
+        selected = position < window[1]
+    elif window[0] == 'tail':
+        selected = position >= size - window[1]
+    elif window[0] == 'center':
+        first = np.maximum((size - window[1]) // 2, 0)
+        selected = (position >= first) & (position < first + window[1])
+    elif window[0] == 'time':
+        time = data[window[1]].to_numpy(dtype=np.float64)[order]
+        selected = time - time[starts][codes] < window[2]
+    elif window[0] == 'steady':
+        values = np.column_stack([_channel_values(data, channel, order) for channel in window[2]])
+        selected = steady_state_mask(values, codes, window[1], *window[3:])
+    else:
+        raise ValueError("Unknown window {}".format(window))
+    if row_mask is not None:
+        selected &= np.asarray(row_mask)[order]
+
+    rows = order[selected]
+    codes = codes[selected]
+    bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(rows) else np.array([], int)
+    return rows, bounds
+
+
+def reduce_segments(values, bounds, stats=('mean',)):
+    """
+    对按组排列的数据一次性求取多个统计量， nan 不参与统计
+
+    :param values[ndarray]: 二维数组， 每列为一个变量
+    :param bounds[ndarray]: 各组的起始行
+    :param stats: STATS 中的统计量， std 与 pandas 相同使用 n-1 作为分母;
+                  分块累计时还可使用 'sum' 及 'm2' (与组内均值之差的平方和)
+
+    :return dict, 统计量与结果的对应关系， 结果的每一行为一组
+    """
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype(np.int64), bounds, axis=0)
+    result = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = np.add.reduceat(np.where(valid, values, 0), bounds, axis=0)
+        mean = total / count
+        for stat in stats:
+            if stat == 'mean':
+                result[stat] = mean
+            elif stat in ('std', 'm2'):
+                lengths = np.diff(np.r_[bounds, len(values)])
+                deviation = np.where(valid, values - np.repeat(mean, lengths, axis=0), 0)
+                m2 = np.add.reduceat(deviation ** 2, bounds, axis=0)
+                result[stat] = np.sqrt(m2 / (count - 1)) if stat == 'std' else m2
+            elif stat == 'sum':
+                result[stat] = total
+            elif stat == 'min':
+                result[stat] = np.fmin.reduceat(values, bounds, axis=0)
+            elif stat == 'max':
+                result[stat] = np.fmax.reduceat(values, bounds, axis=0)
+            elif stat == 'count':
+                result[stat] = count
+            else:
+                raise ValueError("Unknown statistic {}".format(stat))
+    return result
+
+
+def segment_reduce(data, keys, window=None, stats=('mean',), row_mask=None):
+    """
+    按 keys 分组， 对每组中 window 选定的行一次性求取多个统计量
+
+    分组变量只排序一次， 各个统计量在排序后的各组边界上向量化计算,
+    结果与 data.groupby(keys).head(n).groupby(keys).agg(stats) 相同
+
+    :param data[DataFrame]: 待处理的数据， 非数值的变量不参与统计
+    :param keys[list]: 分组的变量名
+    :param window[tuple]: 每组中参与统计的行， 见 segment_rows
+    :param stats: STATS 中的统计量
+    :param row_mask[ndarray]: 按 window 选出后再剔除的行， False 表示剔除
+
+    :return DataFrame, 以 keys 为索引; 只有一个统计量时列名与 data 相同,
+            否则列名为 (变量名, 统计量)
+    """
+    columns = [column for column in data.select_dtypes(include=['number', 'bool']).columns
+               if column not in keys]
+    rows, bounds = segment_rows(data, keys, window, row_mask)
+    values = np.column_stack([data[column].to_numpy(dtype=np.float64)[rows]
+                              for column in columns]) if columns else np.empty((len(rows), 0))
+    result = reduce_segments(values, bounds, stats) if len(rows) else \
+        {stat: np.empty((0, len(columns))) for stat in stats}
+
+    return _result_frame(result, stats, columns,
+                         data[keys].iloc[rows[bounds]].reset_index(drop=True))
+
+
+def _result_frame(result, stats, columns, first_rows):
+    """
+    将各组的统计量整理为 DataFrame, 以各组第一行的分组变量为索引
+    """
+    keys = list(first_rows.columns)
+    if len(keys) == 1:
+        index = pd.Index(first_rows[keys[0]], name=keys[0])
+    else:
+        index = pd.MultiIndex.from_frame(first_rows)
+    if len(stats) == 1:
+        return pd.DataFrame(result[stats[0]], index=index, columns=columns)
+    return pd.DataFrame({(column, stat): result[stat][:, j]
+                         for j, column in enumerate(columns) for stat in stats},
+                        index=index)
+
+
+class ChunkedAggregator:
+    """
+    分块累计各组的统计量， 用于无法一次读入内存的数据， 结果与对所有数据调用 segment_reduce 相同
+
+    不选取窗口时每组只保留非 nan 值的个数、和、与均值之差的平方和、最小值及最大值,
+    和为减去该组首次出现时的均值后的和， 以减小舍入误差;
+    ('head', n) 及 ('tail', n) 窗口每组只缓存最靠前或最靠后的 n 行， 读取完成后再求取统计量
+    """
+    def __init__(self, keys, window=None, stats=('mean',), dtype=np.float64):
+        """
+        :param keys[list]: 分组的变量名
+        :param window[tuple]: None, ('head', n) 或 ('tail', n), 其余窗口需要整组数据， 不能分块累计
+        :param stats: STATS 中的统计量
+        :param dtype: 缓存数据的类型， 使用 float32 可减少内存占用， 累计量始终为 float64
+        """
+        if window is not None and window[0] not in ('head', 'tail'):
+            raise ValueError("Window {} needs whole segments and can not be "
+                             "aggregated by chunks".format(window))
+        self.keys = list(keys)
+        self.window = window
+        self.stats = tuple(stats)
+        self.dtype = np.dtype(dtype)
+        self.columns = None
+        self.key_dtypes = None
+        # 分组变量的取值与组号的对应关系， 组号按首次出现的先后分配
+        self._groups = {}
+        # 已累计的行数， 用于确定行的先后顺序
+        self._rows = 0
+        # 所有行中各变量的和及非 nan 值的个数
+        self._total_sum = None
+        self._total_count = None
+        # 不选取窗口时各组的累计量， 每一行为一组
+        self._partials = {}
+        # 选取窗口时缓存的行: 组号、排序键、读入顺序、数据及 row_mask
+        self._buffer = None
+
+    def add(self, data, order=None, row_mask=None):
+        """
+        累计一块数据
+
+        :param data[DataFrame]: 一块数据， 与 pd.concat 相同， 各块中变量的并集参与统计,
+                                块中没有的变量视为 nan
+        :param order[ndarray]: 各行的 int64 排序键， 窗口按排序键选取行， 键值相同时按读入的先后排列;
+                               None 表示按读入的先后排列
+        :param row_mask[ndarray]: 按窗口选出后再剔除的行， False 表示剔除
+        """
+        if self.columns is None:
+            self.columns = []
+            self.key_dtypes = data[self.keys].dtypes.to_dict()
+            self._total_sum = np.zeros(0)
+            self._total_count = np.zeros(0, dtype=np.int64)
+        new_columns = [column for column in data.select_dtypes(include=['number', 'bool']).columns
+                       if column not in self.keys and column not in self.columns]
+        if new_columns:
+            self._add_columns(new_columns)
+        values = np.full((len(data), len(self.columns)), np.nan, dtype=self.dtype)
+        for j, column in enumerate(self.columns):
+            if column in data:
+                values[:, j] = data[column].to_numpy(dtype=self.dtype)
+        valid = ~np.isnan(values)
+        self._total_sum += np.where(valid, values, 0).sum(axis=0, dtype=np.float64)
+        self._total_count += valid.sum(axis=0)
+
+        # 加 0.0 使 -0.0 与 0.0 属于同一组， 分组变量为 nan 的行不参与统计
+        key_values = np.column_stack([data[key].to_numpy(dtype=np.float64)
+                                      for key in self.keys]) + 0.0
+        inside = ~np.isnan(key_values).any(axis=1)
+        seq = self._rows + np.flatnonzero(inside)
+        self._rows += len(data)
+        selected = inside if row_mask is None or self.window is not None else \
+            inside & np.asarray(row_mask, dtype=bool)
+        if not selected.any():
+            return
+        unique, inverse = np.unique(key_values[selected], axis=0, return_inverse=True)
+        ids = np.array([self._groups.setdefault(key, len(self._groups))
+                        for key in map(tuple, unique.tolist())], dtype=np.int64)
+        codes = ids[inverse.ravel()]
+        if self.window is None:
+            self._accumulate(codes, values[selected])
+        else:
+            mask = np.ones(len(codes), dtype=bool) if row_mask is None else \
+                np.asarray(row_mask, dtype=bool)[inside]
+            self._append(codes, None if order is None else np.asarray(order)[inside],
+                         seq, values[inside], mask)
+
+    def _add_columns(self, columns):
+        """
+        增加参与统计的变量， 已累计的数据中这些变量视为 nan
+        """
+        def widen(value, fill):
+            return np.concatenate([value, np.full(value.shape[:-1] + (len(columns),), fill,
+                                                  dtype=value.dtype)], axis=-1)
+
+        self.columns = self.columns + list(columns)
+        self._total_sum = widen(self._total_sum, 0)
+        self._total_count = widen(self._total_count, 0)
+        fills = {'count': 0, 'shift': np.nan, 'sum': 0, 'm2': 0, 'min': np.nan, 'max': np.nan}
+        self._partials = {name: widen(value, fills[name]) for name, value in self._partials.items()}
+        if self._buffer is not None:
+            self._buffer['values'] = widen(self._buffer['values'], np.nan)
+
+    def _accumulate(self, codes, values):
+        """
+        将一块数据的统计量与已有的累计量合并, 平方和按两部分均值之差合并
+        """
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        values = values[order].astype(np.float64)
+        bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        ids = codes[bounds]
+        n_groups = len(self._groups)
+        n_columns = len(self.columns)
+        partials = self._partials
+        if not partials or len(partials['count']) < n_groups:
+            grown = {'count': np.zeros((n_groups, n_columns), dtype=np.int64),
+                     'shift': np.full((n_groups, n_columns), np.nan),
+                     'sum': np.zeros((n_groups, n_columns)),
+                     'm2': np.zeros((n_groups, n_columns)),
+                     'min': np.full((n_groups, n_columns), np.nan),
+                     'max': np.full((n_groups, n_columns), np.nan)}
+            for name, value in partials.items():
+                grown[name][:len(value)] = value
+            partials = self._partials = grown
+        chunk = reduce_segments(values, bounds, ('count', 'mean', 'min', 'max'))
+        # 尚无有效值的组以本块的均值作为偏移量
+        shift = partials['shift'][ids]
+        shift = partials['shift'][ids] = np.where(np.isnan(shift), chunk['mean'], shift)
+        lengths = np.diff(np.r_[bounds, len(values)])
+        chunk.update(reduce_segments(values - np.repeat(np.nan_to_num(shift), lengths, axis=0),
+                                     bounds, ('sum', 'm2')))
+        count_a, sum_a = partials['count'][ids], partials['sum'][ids]
+        count_b, sum_b = chunk['count'], chunk['sum']
+        count = count_a + count_b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = sum_b / count_b - sum_a / count_a
+            extra = np.where((count_a > 0) & (count_b > 0),
+                             delta ** 2 * count_a * count_b / count, 0)
+        partials['m2'][ids] += chunk['m2'] + extra
+        partials['count'][ids] = count
+        partials['sum'][ids] = sum_a + sum_b
+        partials['min'][ids] = np.fmin(partials['min'][ids], chunk['min'])
+        partials['max'][ids] = np.fmax(partials['max'][ids], chunk['max'])
+
+    def _append(self, codes, order, seq, values, mask):
+        """
+        将一块数据加入缓存， 每组只保留窗口内的行
+        """
+        chunk = {'codes': codes, 'order': order, 'seq': seq, 'values': values, 'mask': mask}
+        if self._buffer is not None:
+            chunk = {name: None if value is None else np.concatenate([self._buffer[name], value])
+                     for name, value in chunk.items()}
+        sort_keys = [chunk['seq']] + ([] if chunk['order'] is None else [chunk['order']])
+        sort_order = np.lexsort(sort_keys + [chunk['codes']])
+        codes = chunk['codes'][sort_order]
+        sizes = np.bincount(codes, minlength=len(self._groups))
+        starts = np.cumsum(sizes) - sizes
+        position = np.arange(len(codes)) - starts[codes]
+        if self.window[0] == 'head':
+            kept = sort_order[position < self.window[1]]
+        else:
+            kept = sort_order[position >= sizes[codes] - self.window[1]]
+        self._buffer = {name: None if value is None else value[kept]
+                        for name, value in chunk.items()}
+
+    def result(self):
+        """
+        求取各组的统计量
+
+        :return DataFrame, 与 segment_reduce 的结果相同
+        """
+        columns = self.columns or []
+        groups = np.array(list(self._groups), dtype=np.float64).reshape(-1, len(self.keys))
+        # 组号按分组变量的大小重新排列， 与 groupby 的顺序相同
+        rank = np.empty(len(groups), dtype=np.int64)
+        rank[np.lexsort(groups.T[::-1])] = np.arange(len(groups))
+        if self.window is None:
+            if self._partials:
+                present = np.argsort(rank)
+                partials = {name: value[present] for name, value in self._partials.items()}
+            else:
+                present = np.array([], dtype=np.int64)
+                partials = {name: np.empty((0, len(columns)))
+                            for name in ('count', 'shift', 'sum', 'm2', 'min', 'max')}
+            result = {}
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for stat in self.stats:
+                    if stat == 'mean':
+                        result[stat] = partials['shift'] + partials['sum'] / partials['count']
+                    elif stat == 'std':
+                        result[stat] = np.sqrt(partials['m2'] / (partials['count'] - 1))
+                    elif stat in ('min', 'max', 'count'):
+                        result[stat] = partials[stat]
+                    else:
+                        raise ValueError("Unknown statistic {}".format(stat))
+        else:
+            buffer = self._buffer
+            if buffer is None:
+                codes = np.array([], dtype=np.int64)
+                values = np.empty((0, len(columns)))
+            else:
+                # 缓存已按组号及行的先后排列， 按分组变量的大小重新排列后剔除 row_mask 为 False 的行
+                sort_order = np.argsort(rank[buffer['codes']], kind='stable')
+                sort_order = sort_order[buffer['mask'][sort_order]]
+                codes = buffer['codes'][sort_order]
+                values = buffer['values'][sort_order].astype(np.float64)
+            bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else \
+                np.array([], dtype=np.int64)
+            present = codes[bounds]
+            result = reduce_segments(values, bounds, self.stats) if len(codes) else \
+                {stat: np.empty((0, len(columns))) for stat in self.stats}
+        first_rows = pd.DataFrame(groups[present], columns=self.keys)
+        if self.key_dtypes is not None:
+            first_rows = first_rows.astype(self.key_dtypes)
+        return _result_frame(result, self.stats, columns, first_rows)
+
+    def column_means(self):
+        """
+        所有行中各变量的均值， 包括分组变量为 nan 的行
+
+        :return Series, 以变量名为索引
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.Series(self._total_sum / self._total_count, index=self.columns or [],
+                             dtype=np.float64)
@@ -0,0 +1,196 @@
+"""
+批量处理整个试验目录下的所有工况
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import fnmatch
+import json
+import os
+import time
+import traceback
+
+from handle_single_working import FILE_TYPES, HandleSingleWorking
+
+
+# 文件夹名称的匹配模式与试验工况的对应关系
+DEFAULT_PATTERNS = {'*open_circuit*': 'open_circuit',
+                    '*ASC*': 'ASC',
+                    '*Eff*': 'efficiency'}
+MANIFEST_NAME = 'batch_manifest.json'
+
+
+def match_test_condition(rel_path, patterns):
+    """
+    根据相对路径中的各级文件夹名称确定试验工况
+
+    :param rel_path[str]: 相对于试验目录的路径
+    :param patterns[dict]: 文件夹名称的匹配模式与试验工况的对应关系,
+                           按顺序匹配，不区分大小写
+
+    :return 匹配到的试验工况，没有匹配时返回 None
+    """
+    parts = [part.lower() for part in rel_path.split(os.sep)]
+    for pattern, test_condition in patterns.items():
+        if any(fnmatch.fnmatchcase(part, pattern.lower()) for part in parts):
+            return test_condition
+    return None
+
+
+def detect_file_type(path):
+    """
+    根据文件夹下已有的文件确定原始文件的格式
+
+    :return FILE_TYPES 中的格式名称，没有原始文件时返回 None
+    """
+    names = os.listdir(path)
+    for file_type, (suffix, _) in FILE_TYPES.items():
+        if any(os.path.splitext(name)[-1].lower() == suffix for name in names):
+            return file_type
+    return None
+
+
+def find_leaf_folders(root, patterns=None):
+    """
+    找出 root 下所有需要处理的最底层文件夹
+
+    result 文件夹和隐藏文件夹不参与遍历
+
+    :return [(文件夹路径, 试验工况)]
+    """
+    patterns = DEFAULT_PATTERNS if patterns is None else patterns
+    folders = []
+    for current, dirs, _ in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d != 'result' and not d.startswith('.'))
+        if dirs or current == root:
+            continue
+        test_condition = match_test_condition(os.path.relpath(current, root), patterns)
+        if test_condition is not None:
+            folders.append((current, test_condition))
+    return folders
+
+
+def _init_worker():
+    """
+    子进程中使用无界面的绘图后端
+    """
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def run_single(path, test_condition, file_type=None, force=False, draft=False):
+    """
+    处理单个工况, 捕获所有异常
+
+    :param file_type[str]: FILE_TYPES 中的格式名称, None 表示自动识别
+    :param force[bool]: True 则忽略上一次的结果，重新运行所有步骤
+    :param draft[bool]: True 则以草稿模式绘图
+
+    :return 记录处理状态及耗时的字典
+    """
+    record = {'path': path, 'test_condition': test_condition,
+              'file_type': file_type, 'status': 'ok', 'error': None}
+    start = time.perf_counter()
+    try:
+        if file_type is None:
+            file_type = record['file_type'] = detect_file_type(path)
+        if file_type is None:
+            record['status'] = 'skipped'
+            record['error'] = "There is no data file in the given path"
+        else:
+            HandleSingleWorking(path, test_condition, FILE_TYPES[file_type][1],
+                                draft=draft).run(force)
+    except Exception:
+        record['status'] = 'failed'
+        record['error'] = traceback.format_exc()
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_campaign(root, patterns=None, file_type=None, workers=None, manifest=None,
+                 force=False, draft=False):
+    """
+    使用进程池处理 root 下所有工况, 并将处理结果写入 manifest 文件
+
+    :param root[str]: 试验目录
+    :param patterns[dict]: 文件夹名称的匹配模式与试验工况的对应关系
+    :param file_type[str]: 原始文件的格式, None 表示按文件夹自动识别
+    :param workers[int]: 进程数，None 表示使用所有 CPU
+    :param manifest[str]: 结果清单的全路径，默认为 root 下的 batch_manifest.json
+    :param force[bool]: True 则忽略上一次的结果，重新处理所有工况
+    :param draft[bool]: True 则以草稿模式绘图
+
+    :return 各个工况的处理记录列表
+    """
+    folders = find_leaf_folders(root, patterns)
+    records = [None] * len(folders)
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = [executor.submit(run_single, path, test_condition, file_type, force, draft)
+                       for path, test_condition in folders]
+            for index, future in enumerate(futures):
+                try:
+                    records[index] = future.result()
+                except Exception:
+                    # 子进程异常退出时进程池不可用， 其余未完成的工况都会抛出 BrokenProcessPool
+                    records[index] = _failed_record(folders[index], file_type,
+                                                    traceback.format_exc())
+    finally:
+        # 中断时未完成的工况也记为失败， 已完成的结果总是写入 manifest
+        for index, record in enumerate(records):
+            if record is None:
+                records[index] = _failed_record(folders[index], file_type, "Interrupted")
+        summary = {'root': os.path.abspath(root),
+                   'seconds': round(time.perf_counter() - start, 3),
+                   'total': len(records),
+                   'failed': sum(record['status'] == 'failed' for record in records),
+                   'folders': records}
+        if manifest is None:
+            manifest = os.path.join(root, MANIFEST_NAME)
+        with open(manifest, 'w', encoding='utf8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return records
+
+
+def _failed_record(folder, file_type, error):
+    """
+    没有得到 run_single 返回结果的工况的记录
+    """
+    path, test_condition = folder
+    return {'path': path, 'test_condition': test_condition, 'file_type': file_type,
+            'status': 'failed', 'error': error, 'seconds': None}
+
+
+def _parse_pattern(text):
+    """
+    解析命令行中 "模式=工况" 格式的参数
+    """
+    pattern, sep, test_condition = text.rpartition('=')
+    if not sep or not pattern:
+        raise argparse.ArgumentTypeError("pattern must be given as PATTERN=TEST_CONDITION")
+    return pattern, test_condition
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量处理试验目录下的所有工况")
+    parser.add_argument('root', help="试验目录")
+    parser.add_argument('-p', '--pattern', action='append', type=_parse_pattern,
+                        metavar='PATTERN=TEST_CONDITION',
+                        help="文件夹名称的匹配模式与试验工况，可多次指定，"
+                             "默认为 {}".format(DEFAULT_PATTERNS))
+    parser.add_argument('-t', '--file-type', choices=list(FILE_TYPES),
+                        help="原始文件格式，默认按文件夹自动识别")
+    parser.add_argument('-j', '--workers', type=int, help="进程数，默认为 CPU 个数")
+    parser.add_argument('-m', '--manifest', help="结果清单的路径")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="忽略上一次的结果，重新处理所有工况")
+    parser.add_argument('-d', '--draft', action='store_true',
+                        help="草稿模式，以较低的分辨率绘图并省略表格和等高线标注")
+    args = parser.parse_args()
+    records = run_campaign(args.root, dict(args.pattern) if args.pattern else None,
+                           args.file_type, args.workers, args.manifest, args.force,
+                           args.draft)
+    for record in records:
+        seconds = '' if record['seconds'] is None else "{:.1f}s".format(record['seconds'])
+        print("{:8} {:>9}  {}".format(record['status'], seconds, record['path']))
@@ -0,0 +1,319 @@
+"""
+使用合成数据测试整个处理流程各个步骤的性能
+
+生成与试验台架格式相同的 erg / csv 文件， 依次测试文件读取、合并排序、求均值、插值、
+求取边界及绘图的耗时、吞吐量和内存占用， 结果可保存为基准文件并与之对比
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource 模块
+    resource = None
+
+
+# 处理流程用到的变量， (变量名, 单位)
+CORE_CHANNELS = [('speed_step', ''), ('SO_N_HM', '1/min'), ('N_HM', '1/min'),
+                 ('SO_M_VM', 'Nm'), ('M_HMmess', 'Nm'),
+                 ('PA1_URMS_1_gMW', 'V'), ('PA1_URMS_2_gMW', 'V'), ('PA1_URMS_3_gMW', 'V'),
+                 ('PA1_IRMS_1', 'A'), ('PA1_IRMS_2', 'A'), ('PA1_IRMS_3', 'A'),
+                 ('PA1_P_1', 'W'), ('PA1_P_2', 'W'), ('PA1_P_4', 'W'), ('PA1_PM', 'W'),
+                 ('Eff_Sys_WT', '%'), ('Eff_Motor_PA', '%'), ('Eff_DCtoAC_WT', '%'),
+                 ('LEW_SO_T_P1', '°C'), ('LEW_SO_Q_P1', 'l/min'),
+                 ('T_MOTOR', '°C'), ('T_Rotor', '°C'),
+                 ('PST_UH_Jahr', 'Unit_Yea'), ('PST_UH_Monat', 'Unit_Mon'),
+                 ('PST_UH_Tag', 'Unit_Day'), ('PST_UH_Stunde', 'Unit_Hou'),
+                 ('PST_UH_Minute', 'Unit_Min'), ('PST_UH_Sekunde', 'Unit_Sec')]
+# 采样周期 [s]
+SAMPLE_PERIOD = 0.1
+BASELINE_NAME = 'benchmark_baseline.json'
+# 记录已生成数据的参数， 参数相同时不再重新生成
+DATASET_NAME = 'benchmark_dataset.json'
+
+
+def channel_names(channels):
+    """
+    生成变量名列表， 与 FileOperator.read_erg_header 的格式相同
+
+    :param channels[int]: 变量总数， 超出 CORE_CHANNELS 的部分为无关的变量
+    """
+    paras = CORE_CHANNELS + [('EXTRA_{}'.format(index), 'x')
+                             for index in range(max(channels - len(CORE_CHANNELS), 0))]
+    return paras
+
+
+def operating_points(speed_points, torque_points, max_speed=12000, max_torque=300, base_speed=4000):
+    """
+    生成效率试验的工况点， 转矩在基速以上按恒功率限制
+
+    :return speed, torque[ndarray]: 各个工况点的转速和转矩设定值
+    """
+    speeds = np.linspace(max_speed / speed_points, max_speed, speed_points)
+    levels = np.linspace(-1, 1, torque_points)
+    levels = levels[levels != 0]
+    limit = max_torque * np.minimum(1, base_speed / speeds)
+    speed = np.repeat(speeds, len(levels))
+    torque = np.round((limit[:, None] * levels[None, :]).ravel())
+    return speed, torque
+
+
+def synthetic_data(rows, channels, speed_points, torque_points, seed=0, start_time=0):
+    """
+    生成合成的台架数据， 各个工况点的数据行数相同
+
+    :return DataFrame, 列名为 "变量名 [单位]"
+    """
+    rng = np.random.default_rng(seed)
+    speed, torque = operating_points(speed_points, torque_points)
+    step = np.arange(rows) * len(speed) // max(rows, 1)
+    speed, torque = speed[step], torque[step]
+    speed_real = speed + rng.normal(0, 1, rows)
+    torque_real = torque + rng.normal(0, 0.2, rows)
+    power_M = speed_real * torque_real / 9.55
+    # 简单的效率模型： 低转矩和低转速时效率下降
+    motor_eff = 0.97 - 0.15 * np.exp(-np.abs(torque) / 20) - 0.05 * np.exp(-speed / 1500)
+    peu_eff = 0.985 - 0.05 * np.exp(-np.abs(torque) / 30)
+    power_AC = np.where(torque > 0, power_M / motor_eff, power_M * motor_eff)
+    power_DC = np.where(torque > 0, power_AC / peu_eff, power_AC * peu_eff)
+    seconds = start_time + np.arange(rows) * SAMPLE_PERIOD
+    values = {'speed_step': step, 'SO_N_HM': speed, 'N_HM': speed_real,
+              'SO_M_VM': torque, 'M_HMmess': torque_real,
+              'PA1_P_1': power_AC / 2, 'PA1_P_2': power_AC / 2,
+              'PA1_P_4': power_DC, 'PA1_PM': power_M,
+              'PST_UH_Jahr': np.full(rows, 2021), 'PST_UH_Monat': np.full(rows, 6),
+              'PST_UH_Tag': 1 + seconds // 86400, 'PST_UH_Stunde': seconds // 3600 % 24,
+              'PST_UH_Minute': seconds // 60 % 60, 'PST_UH_Sekunde': np.round(seconds % 60, 3)}
+    data = {}
+    for name, unit in channel_names(channels):
+        column = "{} [{}]".format(name, unit) if unit else name
+        data[column] = values[name] if name in values else rng.normal(100, 1, rows)
+    return pd.DataFrame(data)
+
+
+def write_erg(file_name, data, paras):
+    """
+    按试验台架的 erg 格式写入数据: 第 1 行为数据开始的行号， 第 4 行为变量个数,
+    之后每行为 "变量名;单位;", 数据以 ; 分隔
+    """
+    start_row = 4 + len(paras)
+    with open(file_name, 'w', encoding='ISO-8859-1', newline='\n') as f:
+        f.write("{}\nsynthetic data\nbenchmark\n{}\n".format(start_row, len(paras)))
+        for name, unit in paras:
+            f.write("{};{};\n".format(name, unit))
+        # np.savetxt 比 DataFrame.to_csv 快数倍
+        np.savetxt(f, data.to_numpy(dtype=np.float64), fmt='%.6g', delimiter=';')
+
+
+def generate_dataset(folder, file_format='erg', rows=1000000, channels=40, files=4,
+                     speed_points=24, torque_points=21, seed=0):
+    """
+    在 folder 下生成合成的原始数据文件， 数据按时间顺序分布在各个文件中
+
+    folder 下已有参数相同的数据时不再重新生成
+
+    :param file_format[str]: 'erg' 或 'csv'
+    :return 生成的文件列表
+    """
+    params = {'file_format': file_format, 'rows': rows, 'channels': channels, 'files': files,
+              'speed_points': speed_points, 'torque_points': torque_points, 'seed': seed}
+    manifest = os.path.join(folder, DATASET_NAME)
+    try:
+        with open(manifest, encoding='utf8') as f:
+            dataset = json.load(f)
+        if dataset['params'] == params and all(map(os.path.exists, dataset['files'])):
+            return dataset['files']
+    except (OSError, ValueError, KeyError):
+        pass
+    os.makedirs(folder, exist_ok=True)
+    data = synthetic_data(rows, channels, speed_points, torque_points, seed)
+    paras = channel_names(channels)
+    file_names = []
+    for index, part in enumerate(np.array_split(np.arange(rows), files)):
+        file_name = os.path.join(folder, 'bench_{:03d}.{}'.format(index, file_format))
+        chunk = data.iloc[part]
+        if file_format == 'erg':
+            write_erg(file_name, chunk, paras)
+        else:
+            with open(file_name, 'w', encoding='utf-8-sig', newline='\n') as f:
+                f.write(",".join(data.columns) + "\n")
+                np.savetxt(f, chunk.to_numpy(dtype=np.float64), fmt='%.6g', delimiter=',')
+        file_names.append(file_name)
+    with open(manifest, 'w', encoding='utf8') as f:
+        json.dump({'params': params, 'files': file_names}, f, ensure_ascii=False, indent=2)
+    return file_names
+
+
+def _max_rss_mb():
+    """
+    当前进程的内存占用峰值 [MB], 无法获取时返回 None
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位为字节， Linux 为 KB
+    return rss / 1024 ** 2 if platform.system() == 'Darwin' else rss / 1024
+
+
+def measure(records, stage, func, rows=None, maps=None, trace_memory=False):
+    """
+    测试一个步骤的耗时及内存， 结果追加到 records 中
+
+    :param rows[int], maps[int]: 处理的数据行数或 map 图个数， 用于计算吞吐量
+    :return func 的返回值
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    record = {'stage': stage, 'seconds': round(seconds, 4)}
+    if rows is not None:
+        record['rows_per_s'] = round(rows / seconds)
+    if maps is not None:
+        record['maps_per_s'] = round(maps / seconds, 3)
+    if trace_memory:
+        record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+        tracemalloc.stop()
+    record['max_rss_mb'] = _max_rss_mb()
+    records.append(record)
+    return result
+
+
+def run_benchmark(folder=None, file_format='erg', rows=1000000, channels=40, files=4,
+                  speed_points=24, torque_points=21, trace_memory=False, seed=0):
+    """
+    生成合成数据并测试各个处理步骤
+
+    :param folder[str]: 生成数据的文件夹， None 表示使用临时文件夹并在测试后删除
+    :param trace_memory[bool]: True 则用 tracemalloc 记录各步骤的内存峰值， 会使耗时增加
+
+    :return dict, 测试参数及各个步骤的结果
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from data_process import EffProcess, sort_by_time
+    from file_operator import FileOperator
+    from get_boundary import get_boundary_path
+    from interpolation import InterpolationContext
+
+    params = {'file_format': file_format, 'rows': rows, 'channels': channels, 'files': files,
+              'speed_points': speed_points, 'torque_points': torque_points}
+    temporary = folder is None
+    folder = tempfile.mkdtemp(prefix='motor_benchmark_') if temporary else folder
+    records = []
+    try:
+        file_names = measure(records, 'generate', lambda: generate_dataset(
+            folder, file_format, rows, channels, files, speed_points, torque_points, seed),
+            rows=rows)
+        file_operator = FileOperator(folder, os.path.join(folder, 'result'))
+        process = EffProcess(file_operator, 2 if file_format == 'erg' else 0)
+        columns = list(process.vars.values())
+        if file_format == 'erg':
+            measure(records, 'read_erg', lambda: FileOperator.read_erg(file_names[0], columns),
+                    rows=rows // files, trace_memory=trace_memory)
+            original = measure(records, 'handle_ergs',
+                               lambda: file_operator.handle_ergs(merge=True, columns=columns),
+                               rows=rows, trace_memory=trace_memory)
+        else:
+            original = measure(records, 'splice_csvs', file_operator.splice_csvs,
+                               rows=rows, trace_memory=trace_memory)
+        shuffled = original.sample(frac=1, random_state=seed)
+        measure(records, 'sort_by_time', lambda: sort_by_time(shuffled),
+                rows=rows, trace_memory=trace_memory)
+        del shuffled
+
+        process.original_data = original
+        measure(records, 'handle_used_data',
+                lambda: (process.get_used_data(), process.handle_used_data()),
+                rows=rows, trace_memory=trace_memory)
+        measure(records, 'get_plot_data', process.get_plot_data,
+                rows=len(process.used_data), trace_memory=trace_memory)
+
+        plot_data = process.plot_data
+        x = plot_data[process.vars['speed']].values
+        y = plot_data[process.vars['torque_real']].values
+        maps = len(process.map_names)
+        measure(records, 'interpolation', lambda: InterpolationContext(
+            x, y, **process.plot_paras['grid']).interpolate(
+                [plot_data[process.vars[eff]].values for eff in process.map_names]),
+            maps=maps, trace_memory=trace_memory)
+        measure(records, 'get_boundary_path', lambda: get_boundary_path(x, y),
+                trace_memory=trace_memory)
+        measure(records, 'plot_eff_map', process.plot, maps=maps, trace_memory=trace_memory)
+    finally:
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+    return {'params': params, 'python': platform.python_version(),
+            'machine': platform.machine(), 'stages': records}
+
+
+def compare(result, baseline):
+    """
+    与基准结果对比各个步骤的耗时
+
+    :return [(步骤, 当前耗时, 基准耗时, 比值)], 比值大于 1 表示变慢
+    """
+    base = {record['stage']: record['seconds'] for record in baseline['stages']}
+    rows = []
+    for record in result['stages']:
+        if record['stage'] in base and base[record['stage']] > 0:
+            rows.append((record['stage'], record['seconds'], base[record['stage']],
+                         record['seconds'] / base[record['stage']]))
+    return rows
+
+
+def print_result(result):
+    """
+    以表格形式输出测试结果
+    """
+    print("{:<18}{:>10}{:>14}{:>11}{:>10}{:>10}".format(
+        'stage', 'seconds', 'rows/s', 'maps/s', 'peak MB', 'RSS MB'))
+    for record in result['stages']:
+        print("{:<18}{:>10.3f}{:>14}{:>11}{:>10}{:>10}".format(
+            record['stage'], record['seconds'], record.get('rows_per_s', ''),
+            record.get('maps_per_s', ''), record.get('peak_mb', ''),
+            '' if record['max_rss_mb'] is None else round(record['max_rss_mb'])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用合成数据测试处理流程的性能")
+    parser.add_argument('-r', '--rows', type=int, default=1000000, help="数据总行数")
+    parser.add_argument('-c', '--channels', type=int, default=40, help="每个文件的变量个数")
+    parser.add_argument('-n', '--files', type=int, default=4, help="文件个数")
+    parser.add_argument('--speed-points', type=int, default=24, help="转速工况点个数")
+    parser.add_argument('--torque-points', type=int, default=21, help="转矩工况点个数, 包括正负转矩")
+    parser.add_argument('-f', '--format', choices=['erg', 'csv'], default='erg', help="文件格式")
+    parser.add_argument('-o', '--output',
+                        help="生成数据的文件夹， 参数相同时重复使用， 默认使用临时文件夹并在测试后删除")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="用 tracemalloc 记录各步骤的内存峰值， 会使耗时增加")
+    parser.add_argument('--save-baseline', nargs='?', const=BASELINE_NAME, metavar='FILE',
+                        help="将结果保存为基准文件， 默认为 {}".format(BASELINE_NAME))
+    parser.add_argument('--compare', nargs='?', const=BASELINE_NAME, metavar='FILE',
+                        help="与基准文件对比， 默认为 {}".format(BASELINE_NAME))
+    args = parser.parse_args()
+    result = run_benchmark(args.output, args.format, args.rows, args.channels, args.files,
+                           args.speed_points, args.torque_points, args.trace_memory)
+    print_result(result)
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            baseline = json.load(f)
+        if baseline['params'] != result['params']:
+            print("\n注意： 基准文件的测试参数不同 {}".format(baseline['params']))
+        print("\n{:<18}{:>10}{:>10}{:>8}".format('stage', 'current', 'baseline', 'ratio'))
+        for stage, current, base, ratio in compare(result, baseline):
+            print("{:<18}{:>10.3f}{:>10.3f}{:>8.2f}".format(stage, current, base, ratio))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
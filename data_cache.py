@@ -0,0 +1,183 @@
+"""
+原始数据文件的本地缓存
+
+每个原始文件解析后的 DataFrame 按列保存为 .npy 文件，
+以文件的路径、大小和修改时间作为键值，文件未变化时直接以内存映射的方式读取
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+CACHE_DIR_NAME = '.cache'
+# 缓存文件夹的默认大小上限
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+META_NAME = 'meta.json'
+
+
+def file_fingerprint(file_name):
+    """
+    获取文件的指纹信息：绝对路径、大小和修改时间
+    """
+    stat = os.stat(file_name)
+    return {'path': os.path.abspath(file_name),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns}
+
+
+class DataCache:
+    """
+    按列储存的原始数据缓存，超出 max_size 时删除最久未使用的数据
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _entry_dir(self, file_name, tag):
+        """
+        根据文件指纹及读取方式获取缓存所在的文件夹
+        """
+        key = json.dumps([file_fingerprint(file_name), tag], sort_keys=True)
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key.encode('utf8')).hexdigest())
+
+    @staticmethod
+    def _read_meta(entry_dir):
+        with open(os.path.join(entry_dir, META_NAME), encoding='utf8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_meta(entry_dir, meta):
+        with open(os.path.join(entry_dir, META_NAME), 'w', encoding='utf8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def load(self, file_name, tag=None):
+        """
+        读取缓存数据
+
+        :param tag[str]: 读取文件的方式， 同一文件不同的读取方式分别缓存
+
+        :return 缓存的 DataFrame, 没有缓存时返回 None
+        """
+        # numpy 和 pandas 在使用缓存时才导入， 使只需要常量的模块能够快速启动
+        import numpy as np
+        import pandas as pd
+        entry_dir = self._entry_dir(file_name, tag)
+        try:
+            meta = self._read_meta(entry_dir)
+        except (OSError, ValueError):
+            return None
+        data = {}
+        for index, column in enumerate(meta['columns']):
+            values = np.load(os.path.join(entry_dir, '{}.npy'.format(index)),
+                             mmap_mode='r')
+            if column['na'] is not None:
+                # 字符串列，还原为 object 类型并恢复缺失值
+                values = values.astype(object)
+                values[np.load(os.path.join(entry_dir, column['na']))] = np.nan
+            data[index] = values
+        df = pd.DataFrame(data)
+        df.columns = [column['name'] for column in meta['columns']]
+        # 记录最近一次使用的时间，用于 LRU 清理
+        meta['last_used'] = time.time()
+        self._write_meta(entry_dir, meta)
+        return df
+
+    def save(self, file_name, df, tag=None):
+        """
+        将 df 按列写入缓存， 写入完成后清理超出大小上限的缓存
+        """
+        import numpy as np
+        import pandas as pd
+        entry_dir = self._entry_dir(file_name, tag)
+        # 先写入临时文件夹再重命名，避免读取到未写完的缓存
+        tmp_dir = os.path.join(self.cache_dir, 'tmp_' + uuid.uuid4().hex)
+        os.makedirs(tmp_dir)
+        columns = []
+        size = 0
+        for index, name in enumerate(df.columns):
+            values = df.iloc[:, index].to_numpy()
+            na = None
+            if values.dtype == object:
+                # 字符串列不使用 pickle 保存，单独记录缺失值的位置
+                na = '{}_na.npy'.format(index)
+                is_na = pd.isna(values)
+                np.save(os.path.join(tmp_dir, na), is_na)
+                values = np.where(is_na, '', values).astype(str)
+                size += is_na.nbytes
+            np.save(os.path.join(tmp_dir, '{}.npy'.format(index)), values)
+            size += values.nbytes
+            columns.append({'name': name, 'na': na})
+        self._write_meta(tmp_dir, {'file': os.path.abspath(file_name), 'tag': tag,
+                                   'columns': columns, 'size': size,
+                                   'last_used': time.time()})
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # 其它进程已写入相同的缓存
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """
+        获取所有缓存的信息
+
+        :return [(缓存文件夹, meta 信息)], 按最近使用时间由新到旧排序
+        """
+        result = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('tmp_'):
+                continue
+            entry_dir = os.path.join(self.cache_dir, name)
+            try:
+                result.append((entry_dir, self._read_meta(entry_dir)))
+            except (OSError, ValueError):
+                continue
+        result.sort(key=lambda item: item[1]['last_used'], reverse=True)
+        return result
+
+    def evict(self):
+        """
+        删除最久未使用的缓存，直到缓存总大小不超过 self.max_size
+        """
+        total = 0
+        for entry_dir, meta in self.entries():
+            total += meta['size']
+            if total > self.max_size:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def invalidate(self, file_name=None):
+        """
+        删除缓存
+
+        :param file_name[str]: 只删除该文件的缓存, 为 None 则删除所有缓存
+        """
+        if file_name is None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            return
+        file_name = os.path.abspath(file_name)
+        for entry_dir, meta in self.entries():
+            if meta['file'] == file_name:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="管理 result 文件夹下的原始数据缓存")
+    parser.add_argument('result_dir', help="结果文件夹的路径")
+    parser.add_argument('--clear', action='store_true',
+                        help="删除所有缓存， 下次运行时重新生成")
+    args = parser.parse_args()
+    cache = DataCache(os.path.join(args.result_dir, CACHE_DIR_NAME))
+    if args.clear:
+        cache.invalidate()
+    else:
+        for entry_dir, meta in cache.entries():
+            print("{:>10.1f} MB  {}".format(meta['size'] / 1024 ** 2, meta['file']))
@@ -6,19 +6,30 @@ import math
 import os
 import textwrap
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.interpolate import griddata
 import pandas as pd
 
-from figure_plot import plot_double_y, plot_eff_map
-from get_boundary import get_boundary_path
+from aggregate import ChunkedAggregator, segment_reduce
+from instrument import NULL_TRACER
+from result_bundle import BUNDLE_NAME, frame_arrays, pivot_arrays, record, save_bundle
+from sanitize import evaluate_rules, sanitize
 
 
+# 记录时间的变量， 由高位到低位依次为年、月、日、时、分、秒
+TIME_COLUMNS = ['PST_UH_Jahr [Unit_Yea]', 'PST_UH_Monat [Unit_Mon]',
+                'PST_UH_Tag [Unit_Day]', 'PST_UH_Stunde [Unit_Hou]',
+                'PST_UH_Minute [Unit_Min]', 'PST_UH_Sekunde [Unit_Sec]']
+
 class DataProcessMixin():
     """
     数据处理类混入类
     """
+    # 各个处理步骤运行前需要先运行的步骤，用于增量运行
+    stage_depends = {'data_process': [],
+                     'plot': ['data_process'],
+                     'generator_markdown': ['plot'],
+                     'save_data': ['data_process']}
+
     def __init__(self, file_operator, file_type):
         self.file_type = file_type
         self.file_operator = file_operator
@@ -26,42 +37,198 @@ class DataProcessMixin():
         self.used_data = None
         self.plot_data = None
         self.mat_data = dict()
+        # 影响数据处理结果及绘图结果的参数
+        # average_window: 各个工况点参与求取均值的数据， 见 aggregate.segment_rows,
+        #                 ('steady', length) 表示按实测转速、转矩及功率选取稳态区间
+        # out_of_core: 不为 None 时分块读取原始数据， 见 get_plot_data_out_of_core,
+        #              如 {'memory_budget': 256 * 1024 ** 2, 'dtype': 'float32'}
+        self.data_paras = {'average_window': ('head', 200), 'out_of_core': None}
+        self.plot_paras = {'draft': False}
+        # 剔除异常数据的规则， 见 sanitize.evaluate_rules
+        self.sanitize_rules = []
+        self.sanitize_report = None
+        # 分块读取时各块的剔除统计， 读取完成后合并
+        self._chunk_reports = None
+        # 分块读取时不保留 used_data, 各变量在所有数据中的均值
+        self.channel_means = None
+        # 绘图的进程数, None 表示在当前进程中绘图
+        self.render_workers = None
+        # 记录各个步骤耗时的 instrument.Tracer
+        self.tracer = NULL_TRACER
+
+    def stage_paras(self, stage):
+        """
+        获取影响某个处理步骤结果的参数，参数不变且结果文件存在时该步骤可以跳过
+        """
+        if stage == 'data_process':
+            return {'class': type(self).__name__, 'vars': self.vars,
+                    'file_type': self.file_type, 'sanitize_rules': self.sanitize_rules,
+                    **self.data_paras}
+        if stage == 'plot':
+            return self.plot_paras
+        return {}
 
     def get_original_data(self):
         """
         获取原始数据
         """
-        if self.file_type == 0:
-            self.original_data = self.file_operator.splice_csvs()
-        elif self.file_type == 1:
-            self.original_data = self.file_operator.splice_excels()
-        elif self.file_type == 2:
-            self.original_data = self.file_operator.handle_ergs(merge=True)
+        with self.tracer.stage('get_original_data') as record:
+            if self.file_type == 0:
+                self.original_data = self.file_operator.splice_csvs()
+            elif self.file_type == 1:
+                self.original_data = self.file_operator.splice_excels(
+                    columns=list(self.vars.values()))
+            elif self.file_type == 2:
+                # 只读取 self.vars 中需要的变量
+                self.original_data = self.file_operator.handle_ergs(
+                    merge=True, columns=list(self.vars.values()))
+            elif self.file_type == 3:
+                self.original_data = self.file_operator.handle_dats(
+                    columns=list(self.vars.values()))
+            record['rows_out'] = len(self.original_data)
 
     def get_used_data(self):
         """
         根据 self.vars 中的值来获取需要的变量
         """
-        self.used_data = self.original_data.\
-            reindex(columns=list(self.vars.values())).astype('float64')
+        with self.tracer.stage('get_used_data', len(self.original_data)) as record:
+            self.used_data = self.original_data.\
+                reindex(columns=list(self.vars.values())).astype('float64')
+            record['rows_out'] = len(self.used_data)
+
+    def sanitize_used_data(self):
+        """
+        按 self.sanitize_rules 剔除 used_data 中的异常数据， 并保存各条规则剔除的行数
+        """
+        with self.tracer.stage('sanitize', len(self.used_data)) as record:
+            self.used_data, report = sanitize(self.used_data, self.sanitize_rules)
+            record['rows_out'] = len(self.used_data)
+        if self._chunk_reports is not None:
+            self._chunk_reports.append(report)
+        else:
+            self.save_sanitize_report(report)
+
+    def save_sanitize_report(self, report):
+        """
+        保存各条规则剔除及换算的行数
+        """
+        self.sanitize_report = report
+        self.file_operator.save_to_csv(os.path.join(self.file_operator.result_dir,
+                                                    'sanitize_report.csv'), report)
+
+    def average_window(self):
+        """
+        获取各个工况点参与求取均值的数据范围
+        """
+        window = self.data_paras['average_window']
+        if window[0] == 'steady' and len(window) == 2:
+            speed = self.vars.get('speed_real', self.vars['speed'])
+            torque = self.vars['torque_real']
+            window = ('steady', window[1], [speed, torque, (speed, torque)])
+        return window
+
+    def load_plot_data(self):
+        """
+        读取原始数据并按工况点求取均值
+        """
+        if self.data_paras['out_of_core'] is None:
+            self.get_original_data()
+            self.get_used_data()
+            self.handle_used_data()
+            self.get_plot_data()
+        else:
+            self.get_plot_data_out_of_core()
 
     def get_plot_data(self):
         """
         主要对相关变量按照 counter 求取均值
         """
-        # 默认取前 200 个点
-        self.plot_data = self.used_data.groupby([self.vars['speed'], self.vars['torque_set']]).head(200)
-        self.plot_data = self.plot_data.groupby([self.vars['speed'], self.vars['torque_set']]).mean()
-        self.plot_data.reset_index(level=[self.vars['speed'], self.vars['torque_set']], inplace=True)
+        with self.tracer.stage('get_plot_data', len(self.used_data)) as record:
+            # 默认取前 200 个点
+            self._set_plot_data(segment_reduce(self.used_data,
+                                               [self.vars['speed'], self.vars['torque_set']],
+                                               window=self.average_window()))
+            record['rows_out'] = len(self.plot_data)
+
+    def get_plot_data_out_of_core(self):
+        """
+        分块读取原始数据， 逐块进行 get_used_data 及 handle_used_data 的处理后累计各工况点的统计量,
+        结果与 get_original_data, get_used_data, handle_used_data 及 get_plot_data 依次运行相同,
+        内存占用由 data_paras['out_of_core'] 中的 memory_budget 确定, 不保留 original_data 及 used_data
+
+        data_paras['out_of_core'] 中的 dtype 为 'float32' 时以单精度读取及缓存数据， 累计量仍为双精度;
+        average_window 只能为 None, ('head', n) 或 ('tail', n)
+        """
+        from file_operator import DEFAULT_MEMORY_BUDGET
+
+        paras = self.data_paras['out_of_core']
+        dtype = np.dtype(paras.get('dtype', 'float64'))
+        columns = list(self.vars.values())
+        # erg 文件按记录时间合并， 需要读取时间变量作为各行的排序键
+        read_columns = columns + [column for column in TIME_COLUMNS if column not in columns] \
+            if self.file_type == 2 else columns
+        aggregator = ChunkedAggregator([self.vars['speed'], self.vars['torque_set']],
+                                       self.average_window(), dtype=dtype)
+        self._chunk_reports = []
+        try:
+            with self.tracer.stage('get_plot_data_out_of_core') as record:
+                rows_in = 0
+                for _, chunk in self.file_operator.iter_data(
+                        self.file_type, read_columns,
+                        paras.get('memory_budget', DEFAULT_MEMORY_BUDGET), dtype):
+                    chunk.reset_index(drop=True, inplace=True)
+                    rows_in += len(chunk)
+                    order = time_key(chunk) if self.file_type == 2 else None
+                    self.used_data = chunk.reindex(columns=columns).astype(dtype)
+                    del chunk
+                    self.handle_used_data()
+                    if order is not None:
+                        order = order[self.used_data.index.to_numpy()]
+                    aggregator.add(self.used_data, order)
+                    self.used_data = None
+                record['rows_in'] = rows_in
+                self._set_plot_data(aggregator.result())
+                record['rows_out'] = len(self.plot_data)
+            reports = pd.concat(self._chunk_reports, ignore_index=True)
+        finally:
+            self._chunk_reports = None
+        self.save_sanitize_report(reports.groupby(['channel', 'rule'], sort=False)[
+            ['dropped', 'rescaled']].sum().reset_index())
+        self.channel_means = aggregator.column_means()
+
+    def _set_plot_data(self, averaged):
+        """
+        以求取均值后的数据作为绘图数据
+        """
+        self.plot_data = averaged
+        self.plot_data.reset_index(inplace=True)
         # 按转速设定值进行排序
         self.plot_data.sort_values(self.vars['speed'], inplace=True)
 
+    def channel_mean(self, name):
+        """
+        变量在所有数据中的均值， 分块读取时由累计的和求出
+
+        :param name[str]: self.vars 中的键
+        """
+        if self.used_data is not None:
+            return self.used_data[self.vars[name]].mean()
+        return self.channel_means[self.vars[name]]
+
     def save_data(self):
         """
         保存数据处理结果至 /result 中
         """
         self.file_operator.save_to_csv(os.path.join(self.file_operator.result_dir, 
                                                     'result.csv'), self.plot_data)
+        self.save_bundle()
+
+    def save_bundle(self, **arrays):
+        """
+        将绘图数据及 arrays 中的数组保存为 /result 中的二进制文件， 见 result_bundle
+        """
+        save_bundle(os.path.join(self.file_operator.result_dir, BUNDLE_NAME),
+                    dict(frame_arrays('plot_data', self.plot_data), **arrays))
 
 
 class OCProcess(DataProcessMixin):
@@ -79,13 +246,14 @@ class OCProcess(DataProcessMixin):
                      'stator_temperatrue': 'T_MOTOR [°C]',
                      'rotor_temperature': 'T_Rotor [°C]'}
         super().__init__(file_operator, file_type)
+        # 功率分析仪的无效值为 1e30 以上
+        self.sanitize_rules = [
+            {'channels': [self.vars[name] for name in ['voltage_UW', 'voltage_VW', 'voltage_UV']],
+             'max': 1e30}]
 
     def data_process(self):
         """进行数据处理"""
-        self.get_original_data()
-        self.get_used_data()
-        self.handle_used_data()
-        self.get_plot_data()
+        self.load_plot_data()
         # * 求取电压均值
         self.plot_data['average_voltage'] = self.plot_data[
             [self.vars['voltage_UW'], self.vars['voltage_VW'],
@@ -95,35 +263,36 @@ class OCProcess(DataProcessMixin):
         """
         ASC 工况绘图
         """
-        x = self.plot_data[self.vars['speed']]
-        y1 = [{'data': [x, self.plot_data[self.vars['voltage_UW']]],
+        # 只在绘图时导入 matplotlib
+        from figure_plot import FigureRenderer, plot_double_y
+        x = self.plot_data[self.vars['speed']].values
+        y1 = [{'data': [x, self.plot_data[self.vars['voltage_UW']].values],
                'style': {'linestyle': '-', 'marker': 'v', 'label': '$U_{UW}$'}},
-              {'data': [x, self.plot_data[self.vars['voltage_VW']]],
+              {'data': [x, self.plot_data[self.vars['voltage_VW']].values],
               'style': {'linestyle': '-', 'marker': '^', 'label': '$U_{VW}$'}},
-              {'data': [x, self.plot_data[self.vars['voltage_UV']]],
+              {'data': [x, self.plot_data[self.vars['voltage_UV']].values],
               'style': {'linestyle': '-', 'marker': '<', 'label': '$U_{UV}$'}}]
-        y2 = [{'data': [x, self.plot_data[self.vars['torque_real']]],
+        y2 = [{'data': [x, self.plot_data[self.vars['torque_real']].values],
               'style': {'linestyle': '-', 'marker': 's', 'label': '$t_e$'}}]
-        lew_tem = self.used_data[self.vars['lew_motor_temperatrue']].mean()
-        lew_flow = self.used_data[self.vars['lew_motor_flow']].mean()
+        lew_tem = self.channel_mean('lew_motor_temperatrue')
+        lew_flow = self.channel_mean('lew_motor_flow')
         paras = {'x_label': "Speed [rpm]",
                  'y1_label': "Three-phase line voltage RMS [V]",
                  'y2_label': "Torque [Nm]",
                  'title': self.file_operator.operator_name + ' open circuit' +
                  '\nGlycol : {:.1f}°C , {:.1f}L/min'
-                 .format(lew_tem, lew_flow)}
-        fig = plot_double_y(y1, y2, paras)
-        self.png_name = self.file_operator.save_to_png(fig, 'OC.png')
-        plt.close(fig)
+                 .format(lew_tem, lew_flow),
+                 'draft': self.plot_paras['draft']}
+        renderer = FigureRenderer(tracer=self.tracer)
+        self.png_name = renderer.add(plot_double_y, self.file_operator.png_path('OC.png'),
+                                     y1, y2, paras)
+        renderer.run()
 
     def handle_used_data(self):
         """
         对 used_data 进行处理， 筛选掉功率分析仪中的异常点
         """
-        voltage_names = ['voltage_UW', 'voltage_VW', 'voltage_UV']
-        for voltage_name in voltage_names:
-            self.used_data = self.used_data[
-                self.used_data[self.vars[voltage_name]] < 1e30]
+        self.sanitize_used_data()
 
     def generator_markdown(self):
         """
@@ -161,15 +330,16 @@ class ASCProcess(DataProcessMixin):
                      'stator_temperatrue': 'T_MOTOR [°C]',
                      'rotor_temperature': 'T_Rotor [°C]'}
         super().__init__(file_operator, file_type)
+        current_names = [self.vars[name] for name in ['current_u', 'current_v', 'current_w']]
+        # 大于 600 A 的电流以 mA 为单位， 逐行除以系数 1e3，如果储存数据时已做处理，此规则不起作用
+        self.sanitize_rules = [{'channels': current_names, 'max': 1e30},
+                               {'channels': current_names, 'rescale': {'above': 600, 'factor': 1e-3}}]
 
     def data_process(self):
         """
         进行数据处理
         """
-        self.get_original_data()
-        self.get_used_data()
-        self.handle_used_data()
-        self.get_plot_data()
+        self.load_plot_data()
         # * 求取电流均值
         self.plot_data['average_current'] = self.plot_data[
             [self.vars['current_u'], self.vars['current_v'],
@@ -179,39 +349,36 @@ class ASCProcess(DataProcessMixin):
         """
         ASC 工况绘图
         """
-        x = self.plot_data[self.vars['speed']]
-        y1 = [{'data': [x, self.plot_data[self.vars['current_u']]],
+        # 只在绘图时导入 matplotlib
+        from figure_plot import FigureRenderer, plot_double_y
+        x = self.plot_data[self.vars['speed']].values
+        y1 = [{'data': [x, self.plot_data[self.vars['current_u']].values],
                'style': {'linestyle': '-', 'marker': 'v', 'label': '$I_U$'}},
-              {'data': [x, self.plot_data[self.vars['current_v']]],
+              {'data': [x, self.plot_data[self.vars['current_v']].values],
               'style': {'linestyle': '-', 'marker': '^', 'label': '$I_V$'}},
-              {'data': [x, self.plot_data[self.vars['current_w']]],
+              {'data': [x, self.plot_data[self.vars['current_w']].values],
               'style': {'linestyle': '-', 'marker': '<', 'label': '$I_W$'}}]
-        y2 = [{'data': [x, self.plot_data[self.vars['torque_real']]],
+        y2 = [{'data': [x, self.plot_data[self.vars['torque_real']].values],
               'style': {'linestyle': '-', 'marker': 's', 'label': '$t_e$'}}]
-        lew_tem = self.used_data[self.vars['lew_motor_temperatrue']].mean()
-        lew_flow = self.used_data[self.vars['lew_motor_flow']].mean()
+        lew_tem = self.channel_mean('lew_motor_temperatrue')
+        lew_flow = self.channel_mean('lew_motor_flow')
         paras = {'x_label': "Speed [rpm]",
                  'y1_label': "Three-phase current RMS [A]",
                  'y2_label': "Torque [Nm]",
                  'title': self.file_operator.operator_name + ' ASC' +
                  '\nGlycol : {:.1f}°C , {:.1f}L/min'
-                 .format(lew_tem, lew_flow)}
-        fig = plot_double_y(y1, y2, paras)
-        self.png_name = self.file_operator.save_to_png(fig, 'ASC.png')
-        plt.close(fig)
+                 .format(lew_tem, lew_flow),
+                 'draft': self.plot_paras['draft']}
+        renderer = FigureRenderer(tracer=self.tracer)
+        self.png_name = renderer.add(plot_double_y, self.file_operator.png_path('ASC.png'),
+                                     y1, y2, paras)
+        renderer.run()
 
     def handle_used_data(self):
         """
         对 used_data 进行处理
         """
-        current_names = ['current_u', 'current_v', 'current_w']
-        for current_name in current_names:
-            self.used_data = self.used_data[
-                self.used_data[self.vars[current_name]] < 1e30]
-            # 大于 600 A 的电流除以系数 1e3，如果储存数据时已做处理，此处即可不再做操作
-            foo = self.used_data[self.vars[current_name]] > 600
-            if foo.sum() != 0:
-                self.used_data[self.vars[current_name]] /= 1e3
+        self.sanitize_used_data()
 
     def generator_markdown(self):
         """
@@ -236,6 +403,10 @@ class EffProcess(DataProcessMixin):
     """
     效率数据处理与画图
     """
+    # 效率区间数据在绘图时计算，保存结果前需要先绘图
+    stage_depends = dict(DataProcessMixin.stage_depends,
+                         save_data=['data_process', 'plot'])
+
     def __init__(self, file_operator, file_type):
         self.vars = {'counter': 'speed_step',
                      'speed': 'SO_N_HM [1/min]',
@@ -254,141 +425,122 @@ class EffProcess(DataProcessMixin):
                      'rotor_temperature': 'T_Rotor [°C]'
         }
         super().__init__(file_operator, file_type)
+        # 需要绘制 map 图的变量
+        self.map_names = ['motor_eff', 'peu_eff', 'sys_eff']
+        self.sanitize_rules = [{'channels': [self.vars['power_M']], 'max': 1e10}]
+        # 计算功率及效率时使用的数据类型， 数据量很大时可使用 'float32' 减少内存占用
+        self.data_paras['efficiency_dtype'] = 'float64'
+        # 插值网格的转速、转矩间隔及内存的上限， 见 InterpolationContext,
+        # 还可以加入 max_cells 修改网格点数的上限
+        self.plot_paras['grid'] = {'step_x': 50, 'step_y': 1, 'memory_budget': None}
         self.figs = {}
         self.pivots = {}
+        self.pivot_tables = {}
+        # 插值结果及各个效率区间的面积占比， 保存在二进制结果中
+        self.grids = {}
+        self.area_fractions = {}
         self.paras_dict = {}  # 最后写入 csv 中的相关参数列表
 
     def data_process(self):
         """
         进行数据处理
         """
-        self.get_original_data()
-        self.get_used_data()
-        self.handle_used_data()
-        self.get_plot_data()
+        self.load_plot_data()
         self.get_pivoted_data()
 
     def plot(self):
         """
         绘制 motor, peu, sys 效率 map 图
         """
+        # 只在绘图时导入 matplotlib 和 scipy
+        from figure_plot import FigureRenderer
+        from interpolation import InterpolationContext
         x = self.plot_data[self.vars['speed']].values
         y = self.plot_data[self.vars['torque_real']].values
-        for eff in ['motor_eff', 'peu_eff', 'sys_eff']:
-            z = self.plot_data[self.vars[eff]].values
-            stator_temperatrue = self.used_data[self.vars['stator_temperature']].mean()
-            temperature_operator = "stator temperature: {:.1f}°C"\
-                .format(stator_temperatrue)
+        # * 三个效率共用同一个三角剖分和边界， 一次完成插值
+        with self.tracer.stage('triangulation', len(x)) as record:
+            self.interp_context = InterpolationContext(x, y, **self.plot_paras['grid'])
+            record['rows_out'] = int(self.interp_context.in_boundary.sum())
+        with self.tracer.stage('interpolation', len(x)):
+            grids = self.interp_context.interpolate(
+                [self.plot_data[self.vars[eff]].values for eff in self.map_names])
+        self.grids = dict(zip(self.map_names, grids))
+        stator_temperatrue = self.channel_mean('stator_temperature')
+        temperature_operator = "stator temperature: {:.1f}°C"\
+            .format(stator_temperatrue)
+        # * 三个 map 图在进程池中并行绘制
+        renderer = FigureRenderer(self.render_workers, self.tracer)
+        for eff, grid_z in zip(self.map_names, grids):
             paras = {'title': self.file_operator.operator_name + " " + eff +
                      "\n" + temperature_operator}
             paras['name'] = eff
-            fig = self._plot(x, y, z, paras)
-            self.figs[eff] = self.file_operator.save_to_png(fig, self.file_operator
-                                           .operator_name + eff + '.png')
-            self.figs[eff] = os.path.split(self.figs[eff])[-1].replace(' ', '%20')
+            paras['draft'] = self.plot_paras['draft']
+            # * 效率区间数据在三角剖分上精确计算， 与插值网格无关
+            with self.tracer.stage('area_statistics:' + eff):
+                self._get_eff_table_data(self.plot_data[self.vars[eff]].values, paras)
+            self._plot(renderer, self.interp_context.grid_x, self.interp_context.grid_y,
+                       grid_z, paras)
+        with self.tracer.stage('render'):
+            png_names = renderer.run()
+        for eff, png_name in zip(self.map_names, png_names):
+            self.figs[eff] = os.path.split(png_name)[-1].replace(' ', '%20')
     
-    def _plot(self, x, y, z, paras):
-        """
-        对绘图点进行处理， 并调用绘图函数
-        """
-        grid_x, grid_y = np.mgrid[x.min(): x.max():50, y.min(): y.max():1]
-        grid_z = griddata((x, y), z, (grid_x, grid_y), method='linear')
-        # 按照边界点进行截取
-        bbpath = get_boundary_path(x, y)
-        origin_shape = grid_x.shape
-        grid_x.shape = 1, -1
-        grid_y.shape = 1, -1
-        grid_z.shape = 1, -1
-        points = np.vstack([grid_x, grid_y]).T
-        in_boundary = bbpath.contains_points(points)
-        in_boundary.shape = 1, -1
-        grid_z[in_boundary == False] = np.nan
-        
-        grid_x.shape = origin_shape
-        grid_y.shape = origin_shape
-        grid_z.shape = origin_shape 
-        
+    def _plot(self, renderer, grid_x, grid_y, grid_z, paras):
+        """
+        添加 map 图的绘图任务
+        """
+        from figure_plot import plot_eff_map
+        png_name = self.file_operator.png_path(self.file_operator.operator_name +
+                                               paras['name'] + '.png')
         # * 调用 map 图画图程序
-        self._get_eff_table_data(grid_x, grid_y, grid_z, paras)
-        return plot_eff_map(grid_x, grid_y, grid_z, paras)
+        return renderer.add(plot_eff_map, png_name, grid_x, grid_y, grid_z, paras)
 
     def get_pivoted_data(self):
-        for eff in ['motor_eff', 'peu_eff', 'sys_eff']:
+        for eff in self.map_names:
             pivoted = self.plot_data.pivot(self.vars['torque_set'], self.vars['speed'], self.vars[eff])
+            self.pivot_tables[eff] = pivoted
             name = eff + "_pivot.csv"
             pivoted.to_csv(os.path.join(self.file_operator.result_dir, name))
             self.pivots[eff + "_pivot"] = name.replace(' ', '%20')
     
-    def _get_eff_table_data(self, x, y, z, paras):
+    def _get_eff_table_data(self, values, paras):
         """
         效率区间数据的提取
-        """
-        # * 筛选出正负效率点
-        positive = z[y > 0]
-        positive = positive[~np.isnan(positive)]  # 去除 nan 点
-        positive = positive[np.logical_and(positive <= 100, positive >= 0)]
 
-        negative = z[y < 0]
-        negative = negative[~np.isnan(negative)]
-        negative = negative[np.logical_and(negative <= 100, negative >= 0)]
-        # * 自动生成效率区间
+        :param values[ndarray]: 各个工况点的效率
+        """
+        # * 效率区间， 统计效率不低于各区间下限的面积占比
         bins = [0, 50 ,60 ,70, 80, 90, 95, 97, 100]
-        # * 统计各个效率点所占的百分比
-        positive_histogram = np.histogram(positive, bins=bins, density=True)
-        negative_histogram = np.histogram(negative, bins=bins, density=True)
+        levels = list(reversed(bins[:-1]))
+        positive, negative = self.interp_context.area_fractions(values, levels)
+        self.area_fractions[paras['name']] = (levels, positive, negative)
         # * 生成绘制 matplotlib 表格能够实别的数据格式
-        positive_percentages = list()
-        negative_percentages = list()
-        motor_interval = []
-        motor_interval_value = []
-        generator_interval = []
-        generator_interval_value = []
-        ge_80  = 0
-        sum_value = 0
-        for index, value in enumerate(reversed(positive_histogram[0] * np.diff(bins) * 100)):
-            sum_value += value
-            positive_percentages.append(["{:d}%-100%".format(list(reversed(positive_histogram[1]))[index + 1]),
-                                        '{:.2f}%'.format(sum_value)])
-            motor_interval.append(positive_percentages[-1][0])
-            motor_interval_value.append(positive_percentages[-1][1])
-            if positive_histogram[1][index] >= 80:
-                ge_80 += value
-        self.paras_dict[paras['name'] + '_motor_ge_80%'] = ge_80
-        ge_80 = 0
-        sum_value = 0
-        for index, value in enumerate(reversed(negative_histogram[0] * np.diff(bins) * 100)):
-            sum_value += value
-            negative_percentages.append(["{:d}%-100%".format(list(reversed(negative_histogram[1]))[index + 1]),
-                                        '{:.2f}%'.format(sum_value)])
-            generator_interval.append(negative_percentages[-1][0])
-            generator_interval_value.append(negative_percentages[-1][1])
-            if negative_histogram[1][index] >= 80:
-                ge_80 += value
-        
-        self.paras_dict[paras['name'] + '_generator_eff_ge_80%'] = ge_80
+        positive_percentages = [["{:d}%-100%".format(level), '{:.2f}%'.format(value)]
+                                for level, value in zip(levels, positive)]
+        negative_percentages = [["{:d}%-100%".format(level), '{:.2f}%'.format(value)]
+                                for level, value in zip(levels, negative)]
+        self.paras_dict[paras['name'] + '_motor_ge_80%'] = positive[levels.index(80)]
+        self.paras_dict[paras['name'] + '_generator_eff_ge_80%'] = negative[levels.index(80)]
         paras['positive_percentages'] = positive_percentages
         paras['negative_percentages'] = negative_percentages
         # *将相关的区间数据存入到最后要写入到 csv 中字典中
-        self.paras_dict[paras['name'] + "_motor_eff_interval"] = motor_interval
-        self.paras_dict[paras['name'] + "_motor_eff_interval_value"] = motor_interval_value
-        self.paras_dict[paras['name'] + "_generator_eff_interval"] = generator_interval
-        self.paras_dict[paras['name'] + "_generator_eff_interval_value"] = generator_interval_value
+        self.paras_dict[paras['name'] + "_motor_eff_interval"] = [item[0] for item in positive_percentages]
+        self.paras_dict[paras['name'] + "_motor_eff_interval_value"] = [item[1] for item in positive_percentages]
+        self.paras_dict[paras['name'] + "_generator_eff_interval"] = [item[0] for item in negative_percentages]
+        self.paras_dict[paras['name'] + "_generator_eff_interval_value"] = [item[1] for item in negative_percentages]
 
     def handle_used_data(self):
         """
         对 used_data 进行处理
         """
-        self.used_data = self.used_data[self.used_data[self.vars['power_M']] < 1e10]
-        # # * 根据相关的值计算效率
-        self.used_data[self.vars['power_M']] = 1 / 9.55 * self.used_data[self.vars['speed_real']] * self.used_data[self.vars['torque_real']]
-        sign = (self.used_data[self.vars['torque_set']] > 0) * 2 - 1
-        self.used_data[self.vars['motor_eff']] = ( self.used_data[self.vars['power_M']]  / ( self.used_data[self.vars['power_AC1']] + self.used_data[self.vars['power_AC2']]) ) ** sign * 100
-        self.used_data[self.vars['peu_eff']] = ( ( self.used_data[self.vars['power_AC1']] + self.used_data[self.vars['power_AC2']]) / self.used_data[self.vars['power_DC']] ) ** sign * 100
-        self.used_data[self.vars['sys_eff']] = (self.used_data[self.vars['power_M']] / self.used_data[self.vars['power_DC']]) ** sign * 100
-        for eff in ['motor_eff', 'peu_eff', 'sys_eff']:
-            self.used_data[self.vars[eff]][np.isinf(self.used_data[self.vars[eff]])] = 0
-            self.used_data[self.vars[eff]][np.logical_or(self.used_data[self.vars[eff]] < 0,  \
-                self.used_data[self.vars[eff]] > 100) ] = 0
+        self.sanitize_used_data()
+        # * 根据相关的值计算机械功率及效率
+        results = compute_efficiency(
+            *(self.used_data[self.vars[name]].to_numpy() for name in
+              ['speed_real', 'torque_real', 'torque_set', 'power_AC1', 'power_AC2', 'power_DC']),
+            dtype=self.data_paras['efficiency_dtype'])
+        for name, values in zip(['power_M', 'motor_eff', 'peu_eff', 'sys_eff'], results):
+            self.used_data[self.vars[name]] = values
     
     def save_data(self):
         """
@@ -437,6 +589,38 @@ class EffProcess(DataProcessMixin):
         
         self.file_operator.save_to_csv(os.path.join(self.file_operator.result_dir, 
                                                 'result.csv'), res)
+        self.save_bundle(**self._bundle_arrays(motor_eff, motor_eff_max_index,
+                                               generator_eff, generator_eff_max_index))
+
+    def _bundle_arrays(self, motor_eff, motor_eff_max_index, generator_eff, generator_eff_max_index):
+        """
+        二维表、插值网格及主要指标的数组， 指标保存为结构化数组 kpis 中带类型的字段
+        """
+        arrays = {}
+        for eff in self.map_names:
+            arrays.update(pivot_arrays(eff + '_pivot', self.pivot_tables[eff]))
+            arrays[eff + '_grid'] = self.grids[eff]
+        arrays['grid_speed'] = self.interp_context.grid_x[:, 0]
+        arrays['grid_torque'] = self.interp_context.grid_y[0]
+        arrays['in_boundary'] = self.interp_context.in_boundary
+        kpis = {}
+        for state, data, index in [('motor', motor_eff, motor_eff_max_index),
+                                   ('generator', generator_eff, generator_eff_max_index)]:
+            kpis[state + '_max_eff'] = data[self.vars['motor_eff']].iloc[index]
+            kpis[state + '_max_eff_speed'] = data[self.vars['speed']].iloc[index]
+            kpis[state + '_max_eff_torque'] = data[self.vars['torque_set']].iloc[index]
+            kpis[state + '_loss_max'] = self.paras_dict['motor_{}_loss_max [kW]'.format(state)]
+        for eff in self.map_names:
+            levels, positive, negative = self.area_fractions[eff]
+            kpis[eff + '_motor_ge_80'] = self.paras_dict[eff + '_motor_ge_80%']
+            kpis[eff + '_generator_ge_80'] = self.paras_dict[eff + '_generator_eff_ge_80%']
+            # 各效率区间的面积占比， 区间下限见 area_levels
+            kpis[eff + '_motor_area'] = positive
+            kpis[eff + '_generator_area'] = negative
+            arrays['area_levels'] = np.asarray(levels, dtype=np.int64)
+        arrays['kpis'] = record({name: np.asarray(value, dtype=np.float64)
+                                 for name, value in kpis.items()})
+        return arrays
         
     def generator_markdown(self):
         """
@@ -472,6 +656,72 @@ class EffProcess(DataProcessMixin):
         self.file_operator.save_to_md(markdown_text, name='效率测试.md')
 
 
+def compute_efficiency(speed, torque, torque_set, power_AC1, power_AC2, power_DC, dtype=np.float64):
+    """
+    在预先分配的数组中计算机械功率及电机、控制器和系统效率
+
+    驱动状态 (转矩设定值大于 0) 的效率为输出功率与输入功率之比， 发电状态取其倒数,
+    无穷大及不在 0-100% 范围内的效率置为 0， nan 保持不变
+
+    :param speed, torque[ndarray]: 实测转速及转矩
+    :param torque_set[ndarray]: 转矩设定值， 用于区分驱动及发电状态
+    :param power_AC1, power_AC2, power_DC[ndarray]: 功率分析仪测得的交流及直流功率
+    :param dtype: 计算及结果的数据类型
+
+    :return power_M, motor_eff, peu_eff, sys_eff[ndarray]: 机械功率及三个效率 [%]
+    """
+    n = len(speed)
+    power_M = np.empty(n, dtype)
+    power_AC = np.empty(n, dtype)
+    effs = np.empty((3, n), dtype)
+    generator = np.empty(n, bool)
+    invalid = np.empty(n, bool)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.multiply(speed, 1 / 9.55, out=power_M)
+        np.multiply(power_M, torque, out=power_M)
+        np.add(power_AC1, power_AC2, out=power_AC)
+        np.divide(power_M, power_AC, out=effs[0])
+        np.divide(power_AC, power_DC, out=effs[1])
+        np.divide(power_M, power_DC, out=effs[2])
+        np.greater(torque_set, 0, out=generator)
+        np.logical_not(generator, out=generator)
+        for eff in effs:
+            np.divide(1, eff, out=eff, where=generator)
+            np.multiply(eff, 100, out=eff)
+            # 正负无穷大也在 0-100% 的范围之外
+            np.less(eff, 0, out=invalid)
+            invalid |= eff > 100
+            np.copyto(eff, 0, where=invalid)
+    return power_M, effs[0], effs[1], effs[2]
+
+
+def time_key(data):
+    """
+    根据 TIME_COLUMNS 计算每一行的时间键值
+
+    键值为 int64, 按十进制位依次拼接年、月、日、时、分、毫秒, 大小顺序与记录时间一致
+
+    Args:
+        data[DataFrame]: 包含 TIME_COLUMNS 的 DataFrame
+    Returns:
+        key[ndarray]: 时间键值，时间缺失的行为 int64 的最大值
+    """
+    values = [data[column].to_numpy(dtype=np.float64) for column in TIME_COLUMNS]
+    missing = np.zeros(len(data), dtype=bool)
+    for value in values:
+        missing |= np.isnan(value)
+    # ! 键值约为 2e16, 超出 float64 能精确表示的整数范围， 各部分先转换为 int64 再拼接
+    year, month, day, hour, minute = (np.where(missing, 0, value).astype(np.int64)
+                                      for value in values[:-1])
+    millisecond = np.rint(np.where(missing, 0, values[-1]) * 1000).astype(np.int64)
+    key = year
+    for value in (month, day, hour, minute):
+        key = key * 100 + value
+    key = key * 100000 + millisecond
+    key[missing] = np.iinfo(np.int64).max
+    return key
+
+
 def sort_by_time(data):
     """ 
     根据实验数据的记录日期对记录数据进行排序
@@ -482,16 +732,48 @@ def sort_by_time(data):
         None
     """
     # ! 必须选择稳定的排序算法，默认的是 quicksort
-    data.sort_values('PST_UH_Sekunde [Unit_Sec]', inplace=True, kind='mergesort')  # second
-    data.sort_values('PST_UH_Minute [Unit_Min]', inplace=True, kind='mergesort')  # minute
-    data.sort_values('PST_UH_Stunde [Unit_Hou]', inplace=True, kind='mergesort')  # hour
-    data.sort_values('PST_UH_Tag [Unit_Day]', inplace=True, kind='mergesort')  # day
-    data.sort_values('PST_UH_Monat [Unit_Mon]', inplace=True, kind='mergesort')  # month
-    data.sort_values('PST_UH_Jahr [Unit_Yea]', inplace=True, kind='mergesort')  # year
+    data['_time_key'] = time_key(data)
+    data.sort_values('_time_key', inplace=True, kind='mergesort')
+    data.drop(columns='_time_key', inplace=True)
+
+
+def merge_by_time(dfs):
+    """
+    根据实验数据的记录日期合并多个 DataFrame
+
+    各个 DataFrame 内部已按时间排序时不进行全局排序:
+        时间区间互不重叠时按起始时间直接拼接,
+        否则对各段有序的数据进行归并
+    存在内部无序的 DataFrame 时, 合并后调用 sort_by_time 排序
+
+    Args:
+        dfs[list]: 待合并的 DataFrame 列表, 时间相同的行保持其在列表中的先后顺序
+    Returns:
+        result_data[DataFrame]: 合并并排序后的 DataFrame
+    """
+    dfs = [df for df in dfs if len(df)] or dfs
+    keys = [time_key(df) for df in dfs]
+    if not all(np.all(key[1:] >= key[:-1]) for key in keys):
+        result_data = pd.concat(dfs)
+        sort_by_time(result_data)
+        return result_data
+
+    order = sorted(range(len(dfs)), key=lambda i: keys[i][0] if len(keys[i]) else 0)
+    overlapped = False
+    for prev, nxt in zip(order[:-1], order[1:]):
+        if keys[prev][-1] > keys[nxt][0] or (keys[prev][-1] == keys[nxt][0] and prev > nxt):
+            overlapped = True
+            break
+    if not overlapped:
+        return pd.concat([dfs[i] for i in order])
+
+    # * 对 int64 的稳定排序使用 timsort, 会识别出各段已有序的数据并逐段归并
+    result_data = pd.concat(dfs)
+    return result_data.take(np.argsort(np.concatenate(keys), kind='stable'))
 
 
 def get_average(file_operator, flags=None, file_type='csv', save_to_file = True, file_name=None, head=True, line_count=None,  
-                filter_flag=False, PA_signals=None):
+                filter_flag=False, PA_signals=None, stats=('mean',), window=None, out_of_core=None):
     """
     针对一个文件夹的所有文件或者某个特定的文件，按工况点求取平均值
 
@@ -508,31 +790,55 @@ def get_average(file_operator, flags=None, file_type='csv', save_to_file = True,
                 如果 head 为 False, 则取尾 line_count 个点,
         :param filter_flag[list]: True 表示过滤异常数据，False 表示不过滤异常数据
         :param PA_signals[list]: filter_flag 为 True 时，则按照此列表中的数据过滤相关信号值，要求信号的绝对值小于 1e10
+        :param stats[tuple]: 需要求取的统计量， 可选 'mean', 'std', 'min', 'max', 'count',
+                             多于一个时结果的列名为 (变量名, 统计量)
+        :param window[tuple]: 不为 None 时代替 head 和 line_count 选取各工况点的数据, 见 aggregate.segment_rows,
+                              如 ('steady', 50, ['N', 'M', ('N', 'M')]) 表示取转速、转矩及功率都处于稳态的最长区间
+        :param out_of_core[dict]: 不为 None 时分块读取文件并累计统计量， 不将所有数据读入内存,
+                                  如 {'memory_budget': 256 * 1024 ** 2, 'dtype': 'float32'},
+                                  window 只能为 None, ('head', n) 或 ('tail', n)
 
         :return average_data[DataFrame]: 求完平均值后的结果
     """
     if flags is None:
         flags = ['speed_step']
     file_operator.make_result_dir()
-    if file_type == 'csv':
-        origin_data = file_operator.splice_csvs()
-    elif file_type == 'erg':
-        origin_data = file_operator.handle_ergs(merge=True)
-    if line_count is not None:
-        if head:
-            used_data = origin_data.groupby(flags).head(line_count)
-        else:
-            used_data = origin_data.grooupby(flags).tail(line_count)
+    if window is None and line_count is not None:
+        window = ('head' if head else 'tail', line_count)
+    rules = [{'channels': PA_signals, 'abs_max': 1e10}] if filter_flag and PA_signals is not None else []
+    if out_of_core is not None:
+        average_data = _average_out_of_core(file_operator, flags, file_type, window, stats,
+                                            rules, out_of_core)
     else:
-        used_data = origin_data
-    if filter_flag:   # 剔除掉功率分析仪的异常值
-        if PA_signals is not None:
-            for PA_signal in PA_signals:
-                used_data = used_data[abs(used_data[PA_signal]) < 1e10]
-    average_data = used_data.groupby(flags).mean()
+        if file_type == 'csv':
+            origin_data = file_operator.splice_csvs()
+        elif file_type == 'erg':
+            origin_data = file_operator.handle_ergs(merge=True)
+        row_mask = None
+        if rules:   # 剔除掉功率分析仪的异常值
+            row_mask, _, _ = evaluate_rules(origin_data, rules)
+        average_data = segment_reduce(origin_data, flags, window, stats, row_mask)
     if save_to_file:
         if file_name is None:
             file_name = os.path.join(file_operator.path,
                                      os.path.split(file_operator.path)[-1] +  "_average_data.csv") 
         file_operator.save_to_csv(file_name, average_data, index=1)
     return average_data
+
+
+def _average_out_of_core(file_operator, flags, file_type, window, stats, rules, out_of_core):
+    """
+    分块读取文件并按工况点累计统计量， 结果与 get_average 读入所有数据时相同
+    """
+    from file_operator import DEFAULT_MEMORY_BUDGET
+
+    dtype = np.dtype(out_of_core.get('dtype', 'float64'))
+    aggregator = ChunkedAggregator(flags, window, stats, dtype)
+    for _, chunk in file_operator.iter_data({'csv': 0, 'erg': 2}[file_type], None,
+                                            out_of_core.get('memory_budget', DEFAULT_MEMORY_BUDGET),
+                                            dtype):
+        # erg 文件按记录时间合并， 以时间键值作为各行的排序键
+        order = time_key(chunk) if file_type == 'erg' else None
+        row_mask = evaluate_rules(chunk, rules)[0] if rules else None
+        aggregator.add(chunk, order, row_mask)
+    return aggregator.result()
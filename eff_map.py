@@ -0,0 +1,210 @@
+"""
+效率 map 图的查表及工况循环的能耗计算
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import Delaunay
+
+from get_boundary import alpha_simplices
+from interpolation import locate
+
+
+# 象限编号: 1 正转驱动, 2 反转发电, 3 反转驱动, 4 正转发电
+QUADRANTS = [1, 2, 3, 4]
+# 计算工况循环时每次处理的点数
+CYCLE_CHUNKSIZE = 1 << 18
+
+
+def axis_position(axis, values):
+    """
+    找出各个值在单调递增的网格坐标中所在的区间
+
+    网格等间隔时直接计算区间编号， 否则使用二分查找
+
+    :return index[ndarray]: 区间左端点的编号， 范围为 0 ~ len(axis) - 2
+            fraction[ndarray]: 在区间中的相对位置， 超出网格范围时小于 0 或大于 1
+    """
+    step = np.diff(axis)
+    if np.allclose(step, step[0], rtol=1e-9, atol=0):
+        position = (values - axis[0]) / step[0]
+        index = np.clip(np.floor(position), 0, len(axis) - 2).astype(np.intp)
+        return index, position - index
+    index = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+    return index, (values - axis[index]) / step[index]
+
+
+def bilinear(axis_x, axis_y, table, x, y):
+    """
+    规则网格上的双线性插值
+
+    :param axis_x, axis_y[ndarray]: 单调递增的网格坐标， 各至少两个点
+    :param table[ndarray]: 网格上的值， shape (len(axis_x), len(axis_y)), 可以包含 nan
+    :param x, y[ndarray]: 需要插值的点
+    :return ndarray, 网格范围外及相邻网格点中有 nan 的点为 nan
+    """
+    ix, tx = axis_position(axis_x, np.asarray(x, dtype=np.float64))
+    iy, ty = axis_position(axis_y, np.asarray(y, dtype=np.float64))
+    flat = table.ravel()
+    index = ix * len(axis_y) + iy
+    z = np.take(flat, index) * (1 - ty)
+    z += np.take(flat, index + 1) * ty
+    z *= 1 - tx
+    index += len(axis_y)
+    upper = np.take(flat, index) * (1 - ty)
+    upper += np.take(flat, index + 1) * ty
+    upper *= tx
+    z += upper
+    # 浮点误差可能使网格边界上的点略微超出 [0, 1]
+    eps = 1e-9
+    z[(tx < -eps) | (tx > 1 + eps) | (ty < -eps) | (ty > 1 + eps)] = np.nan
+    return z
+
+
+class EfficiencyMap:
+    """
+    效率 map, 只需建立一次查表结构， 之后可批量查询任意数量的工况点
+    """
+    def __init__(self, lookup):
+        """
+        :param lookup: 输入转速和转矩数组， 返回效率 [%] 数组的函数， map 范围外为 nan
+        """
+        self._lookup = lookup
+
+    @classmethod
+    def from_grid(cls, speed, torque, eff):
+        """
+        由规则网格上的效率建立 map
+
+        :param speed, torque[ndarray]: 网格的转速和转矩
+        :param eff[ndarray]: shape (len(speed), len(torque)), 未测量的点为 nan
+        """
+        speed = np.asarray(speed, dtype=np.float64)
+        torque = np.asarray(torque, dtype=np.float64)
+        eff = np.asarray(eff, dtype=np.float64)
+        order_x, order_y = np.argsort(speed), np.argsort(torque)
+        speed, torque = speed[order_x], torque[order_y]
+        eff = np.ascontiguousarray(eff[order_x][:, order_y])
+        return cls(lambda x, y: bilinear(speed, torque, eff, x, y))
+
+    @classmethod
+    def from_pivot_csv(cls, file_name):
+        """
+        由 EffProcess 保存的 *_pivot.csv 建立 map, 行为转矩， 列为转速
+        """
+        pivoted = pd.read_csv(file_name, index_col=0, encoding='utf-8-sig')
+        return cls.from_grid(pivoted.columns.astype(np.float64), pivoted.index.values,
+                             pivoted.values.T)
+
+    @classmethod
+    def from_points(cls, speed, torque, eff, alpha=1000):
+        """
+        由散点工况的效率建立 map, 在 alpha shape 内线性插值， 与 map 图的插值方式相同
+
+        :param speed, torque, eff[ndarray]: 各个工况点的转速、转矩及效率
+        """
+        points = np.vstack([speed, torque]).T.astype(np.float64)
+        eff = np.asarray(eff, dtype=np.float64)
+        tri = Delaunay(points)
+        mask = alpha_simplices(points, tri, alpha)
+
+        def lookup(x, y):
+            query = np.vstack([x, y]).T.astype(np.float64)
+            result = np.full(len(query), np.nan)
+            inside, vertices, weights = locate(tri, query, mask)
+            result[inside] = np.einsum('ij,ij->i', weights, eff[vertices])
+            return result
+        return cls(lookup)
+
+    def __call__(self, speed, torque):
+        """
+        查询工况点的效率
+
+        :return 效率 [%], map 范围外为 nan
+        """
+        return self._lookup(np.ravel(speed), np.ravel(torque))
+
+
+def _cycle_sums(eff_map, speed, torque, dt, symmetric):
+    """
+    计算一段工况循环的能量之和
+
+    :return sums[ndarray]: shape (3, 4), 各象限的机械能量、电能量及损耗 [kWh]
+            totals[ndarray]: 驱动电能、驱动机械能、发电机械能、发电电能 [kWh], 均为正值
+            out_of_map[int]: 超出 map 的点数
+    """
+    reverse = speed < 0
+    if symmetric:
+        eff = eff_map(np.abs(speed), np.where(reverse, -torque, torque))
+    else:
+        eff = eff_map(speed, torque)
+    valid = eff > 0
+    eff = np.where(valid, eff, 100)
+    eff /= 100
+    # 机械能量 [kWh], 驱动为正， 发电为负
+    mechanical = speed * torque
+    mechanical *= dt / (9.55 * 3.6e6)
+    mechanical[~valid] = 0
+    motoring = mechanical > 0
+    electrical = np.where(motoring, mechanical / eff, mechanical * eff)
+    loss = np.abs(electrical - mechanical)
+    # 编号 0-3 依次为正转正转矩、正转负转矩、反转正转矩、反转负转矩， 即第 1、4、2、3 象限
+    code = reverse * 2 + (torque < 0)
+    sums = np.array([np.bincount(code, values, 4)[[0, 2, 3, 1]]
+                     for values in (mechanical, electrical, loss)])
+    # 下标 0 为发电， 1 为驱动
+    electrical = np.bincount(motoring, electrical, 2)
+    mechanical = np.bincount(motoring, mechanical, 2)
+    totals = np.array([electrical[1], mechanical[1], -mechanical[0], -electrical[0]])
+    return sums, totals, len(valid) - int(np.count_nonzero(valid))
+
+
+def evaluate_cycle(eff_map, speed, torque, time=None, dt=None, symmetric=True,
+                   chunksize=CYCLE_CHUNKSIZE):
+    """
+    按效率 map 计算工况循环的能量及损耗
+
+    驱动状态下电功率 = 机械功率 / 效率, 发电状态下电功率 = 机械功率 * 效率,
+    效率为 nan 或不大于 0 的点视为超出 map 的范围， 不参与能量的计算
+
+    :param eff_map[EfficiencyMap]: 效率 map
+    :param speed, torque[ndarray]: 工况循环的转速 [rpm] 及转矩 [Nm]
+    :param time[ndarray]: 各点的时间 [s], 每个点的持续时间为到下一点的时间差， 最后一点与前一点相同
+    :param dt[float]: time 为 None 时各点的持续时间 [s]
+    :param symmetric[bool]: True 则反转工况按 (|转速|, 转矩 * 转向) 查询正转的 map
+    :param chunksize[int]: 分块计算的点数， 使中间结果能够留在 CPU 缓存中
+
+    :return dict, 各象限的机械能量、电能量及损耗 [kWh], 驱动、发电及整个循环的效率 [%], 超出 map 的点数
+    """
+    speed = np.asarray(speed, dtype=np.float64)
+    torque = np.asarray(torque, dtype=np.float64)
+    if time is not None:
+        dt = np.diff(np.asarray(time, dtype=np.float64))
+        dt = np.append(dt, dt[-1] if len(dt) else 0)
+    elif dt is None:
+        raise ValueError("Either time or dt must be given")
+    dt = np.broadcast_to(dt, speed.shape)
+
+    sums = np.zeros((3, len(QUADRANTS)))
+    totals = np.zeros(4)
+    out_of_map = 0
+    for start in range(0, len(speed), chunksize):
+        chunk = slice(start, start + chunksize)
+        chunk_sums, chunk_totals, chunk_out = _cycle_sums(
+            eff_map, speed[chunk], torque[chunk], dt[chunk], symmetric)
+        sums += chunk_sums
+        totals += chunk_totals
+        out_of_map += chunk_out
+
+    motor_in, motor_out, generator_in, generator_out = totals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = {'mechanical [kWh]': dict(zip(QUADRANTS, sums[0].tolist())),
+                  'electrical [kWh]': dict(zip(QUADRANTS, sums[1].tolist())),
+                  'loss [kWh]': dict(zip(QUADRANTS, sums[2].tolist())),
+                  'motor_eff [%]': float(motor_out / motor_in * 100),
+                  'generator_eff [%]': float(generator_out / generator_in * 100),
+                  'cycle_eff [%]': float((motor_out + generator_out) /
+                                         (motor_in + generator_in) * 100),
+                  'out_of_map': out_of_map,
+                  'samples': len(speed)}
+    return result
@@ -0,0 +1,220 @@
+"""
+效率 map 的查询服务
+
+索引试验目录下所有 result 文件夹中的 *_pivot.csv, 按需建立插值结构并缓存在内存中,
+可作为库调用， 也可作为本地 HTTP 服务运行
+"""
+
+import argparse
+from collections import OrderedDict
+from concurrent.futures import Future
+import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from data_cache import file_fingerprint
+from eff_map import EfficiencyMap
+
+
+PIVOT_SUFFIX = '_pivot.csv'
+# 默认缓存的插值结构个数
+DEFAULT_MAP_CACHE_SIZE = 32
+# 从文件夹名称中解析电压， 如 Eff_350V
+VOLTAGE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*V(?![a-z])', re.IGNORECASE)
+
+
+def parse_voltage(rel_path):
+    """
+    从相对路径中解析直流电压， 靠近文件的文件夹优先
+
+    :return 电压 [V], 没有时返回 None
+    """
+    for part in reversed(rel_path.split(os.sep)):
+        match = VOLTAGE_PATTERN.search(part)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class EfficiencyMapIndex:
+    """
+    试验目录下所有效率 map 的索引， 插值结构按最近最少使用的顺序淘汰
+
+    多个线程同时请求同一个未缓存的 map 时只由一个线程建立插值结构， 其余线程等待其结果
+    """
+    def __init__(self, root, cache_size=DEFAULT_MAP_CACHE_SIZE):
+        """
+        :param root[str]: 试验目录
+        :param cache_size[int]: 内存中最多保留的插值结构个数
+        """
+        self.root = os.path.abspath(root)
+        self.cache_size = cache_size
+        self.entries = []
+        self._cache = OrderedDict()
+        # 正在建立的插值结构， key 与 _cache 相同， 值为 Future
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """
+        重新扫描试验目录， 建立索引
+
+        每个索引项包含 folder (工况文件夹相对于 root 的路径), name (如 motor_eff),
+        voltage (由文件夹名称解析的电压) 和 file (pivot 文件的全路径)
+        """
+        entries = []
+        for current, dirs, files in os.walk(self.root):
+            dirs.sort()
+            if os.path.basename(current) != 'result':
+                continue
+            folder = os.path.relpath(os.path.dirname(current), self.root)
+            for name in sorted(files):
+                if name.endswith(PIVOT_SUFFIX):
+                    entries.append({'folder': folder,
+                                    'name': name[:-len(PIVOT_SUFFIX)],
+                                    'voltage': parse_voltage(folder),
+                                    'file': os.path.join(current, name)})
+        self.entries = entries
+
+    def get_map(self, file_name):
+        """
+        获取 pivot 文件的插值结构， 文件修改后重新建立
+        """
+        fingerprint = file_fingerprint(file_name)
+        key = (fingerprint['path'], fingerprint['mtime'])
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            future = self._loading.get(key)
+            loading = future is None
+            if loading:
+                future = self._loading[key] = Future()
+        if not loading:
+            return future.result()
+
+        # * 在锁外建立插值结构， 不阻塞对其他 map 的请求
+        try:
+            eff_map = EfficiencyMap.from_pivot_csv(file_name)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._cache[key] = eff_map
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            del self._loading[key]
+        future.set_result(eff_map)
+        return eff_map
+
+    def find(self, name, folder=None):
+        """
+        查找索引项
+
+        :param name[str]: map 名称， 如 motor_eff
+        :param folder[str]: 工况文件夹的匹配模式， None 表示所有文件夹
+        """
+        return [entry for entry in self.entries if entry['name'] == name and
+                (folder is None or fnmatch.fnmatch(entry['folder'], folder))]
+
+    def query(self, name, speed, torque, voltage=None, folder=None):
+        """
+        批量查询效率
+
+        指定 voltage 时在电压最接近的两个 map 之间线性插值， 超出已测电压范围的结果为 nan;
+        否则使用匹配到的第一个 map
+
+        :param name[str]: map 名称， 如 motor_eff, peu_eff, sys_eff
+        :param speed, torque: 转速 [rpm] 及转矩 [Nm], 数值或数组
+        :param voltage[float]: 直流电压 [V]
+        :param folder[str]: 工况文件夹的匹配模式
+
+        :return 效率 [%] 数组， map 范围外为 nan
+        """
+        entries = self.find(name, folder)
+        if voltage is not None:
+            entries = [entry for entry in entries if entry['voltage'] is not None]
+        if not entries:
+            raise KeyError("No efficiency map named {!r} in {}".format(name, self.root))
+        if voltage is None:
+            return self.get_map(entries[0]['file'])(speed, torque)
+
+        # * 同一电压有多个 map 时使用排序靠前的一个
+        by_voltage = {}
+        for entry in entries:
+            by_voltage.setdefault(entry['voltage'], entry)
+        voltages = sorted(by_voltage)
+        if voltage < voltages[0] or voltage > voltages[-1]:
+            return np.full(np.size(speed), np.nan)
+        upper = int(np.searchsorted(voltages, voltage))
+        if voltages[upper] == voltage:
+            return self.get_map(by_voltage[voltage]['file'])(speed, torque)
+        low, high = voltages[upper - 1], voltages[upper]
+        weight = (voltage - low) / (high - low)
+        return (self.get_map(by_voltage[low]['file'])(speed, torque) * (1 - weight) +
+                self.get_map(by_voltage[high]['file'])(speed, torque) * weight)
+
+
+def make_handler(index):
+    """
+    生成处理 HTTP 请求的类
+
+    GET /maps 返回索引;
+    POST /query 的请求体为 {"map": "motor_eff", "speed": [...], "torque": [...],
+    "voltage": 350, "folder": "*Eff*"}, voltage 及 folder 可省略, 返回 {"eff": [...]}
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/maps':
+                self._send(200, [{key: value for key, value in entry.items() if key != 'file'}
+                                 for entry in index.entries])
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/query':
+                self._send(404, {'error': 'not found'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                eff = index.query(request['map'], np.asarray(request['speed'], dtype=np.float64),
+                                  np.asarray(request['torque'], dtype=np.float64),
+                                  request.get('voltage'), request.get('folder'))
+            except (KeyError, ValueError, TypeError) as e:
+                self._send(400, {'error': str(e)})
+                return
+            # json 不支持 nan, 以 null 表示超出 map 范围
+            self._send(200, {'eff': [None if np.isnan(value) else value for value in eff.tolist()]})
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="效率 map 的本地查询服务")
+    parser.add_argument('root', help="试验目录")
+    parser.add_argument('--host', default='127.0.0.1', help="监听的地址")
+    parser.add_argument('--port', type=int, default=8765, help="监听的端口")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAP_CACHE_SIZE,
+                        help="内存中最多保留的插值结构个数")
+    args = parser.parse_args()
+    index = EfficiencyMapIndex(args.root, args.cache_size)
+    print("已索引 {} 个效率 map, 服务地址: http://{}:{}".format(len(index.entries), args.host, args.port))
+    ThreadingHTTPServer((args.host, args.port), make_handler(index)).serve_forever()
@@ -2,17 +2,31 @@
 实现图形绘制功能
 """
 
+from concurrent.futures import ProcessPoolExecutor
 import math
+import os
 
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 
+from instrument import NULL_TRACER
+
+
+# 图片的分辨率， 草稿模式下使用较低的分辨率并省略表格及等高线标注
+DPI = 300
+DRAFT_DPI = 100
+
+
+def _get_dpi(paras):
+    return DRAFT_DPI if paras.get('draft') else DPI
+
 
 def base_plot(y, paras):
     """
     基础的 x, y 坐标轴绘图
     """
-    fig = plt.figure(figsize=(8, 6), dpi=300)
+    fig = plt.figure(figsize=(8, 6), dpi=_get_dpi(paras))
     lns = list()
 
     ax = fig.add_subplot(1, 1, 1)
@@ -32,7 +46,7 @@ def plot_double_y(y1, y2, paras):
     """
     绘制双 y 坐标轴
     """
-    fig = plt.figure(figsize=(8, 6), dpi=300)
+    fig = plt.figure(figsize=(8, 6), dpi=_get_dpi(paras))
     lns = list()
 
     ax1 = fig.add_subplot(111)
@@ -57,7 +71,7 @@ def plot_eff_map(x, y, z, paras):
     """
     绘制效率图
     """
-    fig = plt.figure(facecolor='lightgray', figsize=(8, 8), dpi=300)
+    fig = plt.figure(facecolor='lightgray', figsize=(8, 8), dpi=_get_dpi(paras))
 
     plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
     plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
@@ -73,10 +87,14 @@ def plot_eff_map(x, y, z, paras):
               '#FF3800', '#FF1C00', '#FF0000', '#FF1000']
     cntr = plt.contour(x, y, z, legend_point, colors='black',
                        linewidths=0.5)  # 绘制等高线
-    plt.clabel(cntr, fmt='%.1f', fontsize=8,
-               manual=False)  # 设置等高线数值的显示格式
+    if not paras.get('draft'):
+        plt.clabel(cntr, fmt='%.1f', fontsize=8,
+                   manual=False)  # 设置等高线数值的显示格式
     plt.contourf(x, y, z, legend_point, colors=colors)  # 绘制填充色
     plt.colorbar()
+    if paras.get('draft'):
+        # 草稿模式下不绘制效率区间表格
+        return fig
     # ** 在图形上加入效率区间表格
     positive_percentages = paras['positive_percentages']
     negative_percentages = paras['negative_percentages']
@@ -89,6 +107,74 @@ def plot_eff_map(x, y, z, paras):
     return fig
 
 
+def _init_render_worker():
+    """
+    子进程中使用无界面的 Agg 后端
+    """
+    matplotlib.use('Agg', force=True)
+
+
+def render_figure(plot_func, args, png_name, tracer=NULL_TRACER):
+    """
+    调用 plot_func 绘图， 保存为 png_name 后关闭图片
+
+    :param tracer: 记录绘图及保存耗时的 instrument.Tracer
+    :return png_name
+    """
+    with tracer.stage('draw'):
+        fig = plot_func(*args)
+    with tracer.stage('savefig'):
+        fig.savefig(png_name)
+    plt.close(fig)
+    return png_name
+
+
+class FigureRenderer:
+    """
+    收集绘图任务， 统一绘制并保存
+
+    workers 大于 1 时在进程池中并行绘制, 任务的参数应为数组、列表和字典等可以被 pickle 的数据
+    """
+    def __init__(self, workers=None, tracer=NULL_TRACER):
+        """
+        :param workers[int]: 绘图的进程数, None 或 1 表示在当前进程中依次绘制,
+                             0 表示使用所有 CPU
+        :param tracer: instrument.Tracer, 在当前进程中绘制时记录每张图片的绘图及保存耗时
+        """
+        self.workers = os.cpu_count() if workers == 0 else workers
+        self.tracer = tracer
+        self.jobs = []
+
+    def add(self, plot_func, png_name, *args):
+        """
+        添加绘图任务
+
+        :param plot_func: 本模块中的绘图函数， 如 plot_eff_map
+        :param png_name[str]: 图片的全路径
+        :param args: 传给 plot_func 的参数
+        :return png_name
+        """
+        self.jobs.append((plot_func, args, png_name))
+        return png_name
+
+    def run(self):
+        """
+        执行所有绘图任务
+
+        :return 各个图片的全路径, 顺序与添加任务的顺序相同
+        """
+        jobs, self.jobs = self.jobs, []
+        if self.workers is None or self.workers <= 1 or len(jobs) <= 1:
+            png_names = []
+            for plot_func, args, png_name in jobs:
+                with self.tracer.stage(os.path.basename(png_name)):
+                    png_names.append(render_figure(plot_func, args, png_name, self.tracer))
+            return png_names
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs)),
+                                 initializer=_init_render_worker) as executor:
+            return list(executor.map(render_figure, *zip(*jobs)))
+
+
 def _get_eff_table_data(x, y, z):
     """
     效率区间表格数据提取
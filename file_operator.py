@@ -2,14 +2,179 @@
 实现数据处理功能
 """
 
+import codecs
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import glob
+import itertools
+import json
 import os
-from subprocess import call
-import locale
+import re
 
+import numpy as np
 import pandas as pd
 
-from data_process import sort_by_time
+from data_cache import DataCache, CACHE_DIR_NAME, file_fingerprint
+from data_process import merge_by_time, TIME_COLUMNS
+
+
+# 分块读取 erg 文件时每一块的行数
+ERG_CHUNKSIZE = 200000
+# 逐行读取 excel 文件时，每读取该行数即转换为数组
+EXCEL_CHUNKSIZE = 65536
+# 判断 csv 文件编码时读取的字节数
+ENCODING_SAMPLE_SIZE = 1024 ** 2
+# 记录 result 文件夹对应的各个 csv 文件编码的文件
+ENCODING_SIDECAR_NAME = '.encodings.json'
+# 分块读取时每一块数据的默认内存上限
+DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+# 分块读取时一块数据实际占用的内存与其数值所占内存之比的估计值， 包括解析及后续处理中的副本
+CHUNK_MEMORY_FACTOR = 4
+
+# DIAdem .DAT 文件的通道信息
+DatChannel = namedtuple('DatChannel', 'name, channel_type, file_name, method, '
+                                      'data_type, nums, start_index, block_offset, '
+                                      'start_value, step')
+# DIAdem 二进制数据类型与 numpy 数据类型的对应关系
+DAT_DATA_TYPES = {'REAL32': '<f4', 'REAL64': '<f8', 'INT16': '<i2', 'INT32': '<i4'}
+
+
+def detect_encoding(file_name, sample_size=ENCODING_SAMPLE_SIZE):
+    """
+    根据 BOM 和文件开头 sample_size 个字节判断 csv 文件的编码
+
+    :return 'utf-8-sig', 'utf-16' 或 'gbk'
+    """
+    with open(file_name, 'rb') as f:
+        head = f.read(sample_size)
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # 截断处可能是不完整的多字节字符
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'gbk'
+    return 'utf-8-sig'
+
+
+def read_csv(csv_file, encoding=None):
+    """
+    读取 csv 文件， 所用的编码记录在返回结果的 attrs['encoding'] 中
+
+    :param encoding[str]: 文件的编码， 为 None 时根据文件开头的字节判断
+    """
+    if encoding is None:
+        encoding = detect_encoding(csv_file)
+    try:
+        df = pd.read_csv(csv_file, encoding=encoding, low_memory=False)
+    except UnicodeDecodeError:
+        #! 文件开头均为 ASCII 字符时无法区分编码， 出错后改用 gbk
+        encoding = 'gbk'
+        df = pd.read_csv(csv_file, encoding=encoding, low_memory=False)
+    df.attrs['encoding'] = encoding
+    return df
+
+
+def budget_rows(memory_budget, n_columns, dtype=np.float64):
+    """
+    根据内存上限计算分块读取时每一块的行数
+
+    :param memory_budget[int]: 每一块数据的内存上限(字节)
+    :param n_columns[int]: 读取的变量个数
+    """
+    row_bytes = CHUNK_MEMORY_FACTOR * max(n_columns, 1) * np.dtype(dtype).itemsize
+    return max(int(memory_budget // row_bytes), 1)
+
+
+def iter_csv(csv_file, columns=None, memory_budget=DEFAULT_MEMORY_BUDGET, encoding=None):
+    """
+    分块读取 csv 文件
+
+    :param columns[list]: 需要读取的变量名，为 None 时读取所有变量， 文件中不存在的变量会被忽略
+    :param memory_budget[int]: 每一块数据的内存上限(字节)
+    :param encoding[str]: 文件的编码， 为 None 时根据文件开头的字节判断
+
+    :return 生成器，依次返回各块数据的 DataFrame
+    """
+    if encoding is None:
+        encoding = detect_encoding(csv_file)
+    try:
+        header = pd.read_csv(csv_file, encoding=encoding, nrows=0).columns
+    except UnicodeDecodeError:
+        encoding = 'gbk'
+        header = pd.read_csv(csv_file, encoding=encoding, nrows=0).columns
+    usecols = None if columns is None else [column for column in header if column in columns]
+    chunksize = budget_rows(memory_budget, len(header if usecols is None else usecols))
+    yield from pd.read_csv(csv_file, encoding=encoding, usecols=usecols,
+                           chunksize=chunksize, low_memory=False)
+
+
+def _to_array(values):
+    """
+    将一列数据转换为数组，能转换为浮点数时使用 float64, 否则使用 object
+    """
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array(values, dtype=object)
+
+
+def iter_excel(excel_file, columns=None, sheet=0, chunksize=EXCEL_CHUNKSIZE, memory_budget=None):
+    """
+    以只读模式逐行读取 excel 文件， 每 chunksize 行转换为一块数据
+
+    :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+    :param sheet[int]: 工作表的序号
+    :param memory_budget[int]: 不为 None 时由每一块数据的内存上限(字节)确定 chunksize
+
+    :return 生成器，依次返回各块数据的 DataFrame, 至少返回一块
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[sheet].iter_rows(values_only=True)
+        header = next(rows, ())
+        names = [name if name is not None else "Unnamed: {}".format(index)
+                 for index, name in enumerate(header)]
+        indexes = [index for index, name in enumerate(names)
+                   if columns is None or name in columns]
+        if memory_budget is not None:
+            chunksize = budget_rows(memory_budget, len(indexes))
+        values = [[] for _ in indexes]
+        yielded = False
+        for row in rows:
+            for column, index in zip(values, indexes):
+                column.append(row[index] if index < len(row) else None)
+            if values and len(values[0]) >= chunksize:
+                yield pd.DataFrame({names[index]: _to_array(column)
+                                    for column, index in zip(values, indexes)})
+                values = [[] for _ in indexes]
+                yielded = True
+    finally:
+        workbook.close()
+    if not yielded or (values and values[0]):
+        yield pd.DataFrame({names[index]: _to_array(column)
+                            for column, index in zip(values, indexes)})
+
+
+def read_excel(excel_file, columns=None, sheet=0):
+    """
+    以只读模式逐行读取 excel 文件，不经过中间的 csv 文件
+
+    读取的数据每 EXCEL_CHUNKSIZE 行转换为一次数组， 内存占用与文件大小无关
+
+    :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+    :param sheet[int]: 工作表的序号
+    """
+    chunks = list(iter_excel(excel_file, columns, sheet))
+    if len(chunks) == 1:
+        return chunks[0]
+    # 某一块中不能转换为浮点数的列， 合并后为 object
+    return pd.concat(chunks, ignore_index=True)
 
 
 class GetInformationOfPath:
@@ -24,7 +189,7 @@ class GetInformationOfPath:
         else:
             raise FileNotFoundError("[Errno 2] No such file or directory")
 
-    def _get_spcified_suffix(self, suffix_name, attr_name):
+    def _get_spcified_suffix(self, suffix_name, attr_name, ignore_case=False):
         """
         获取指定后缀的文件名
 
@@ -32,13 +197,22 @@ class GetInformationOfPath:
         如果输入的是文件名，则判断当前的文件的后缀是否符合相应的需求
 
         获取的文件列表放在 self 的 attr_name 属性中
+
+        :param ignore_case[bool]: True 则后缀不区分大小写
         """
         if  not hasattr(self, attr_name):
             # 输入的是文件夹
-            if self.file_name is None:  
+            if self.file_name is None and ignore_case:
+                setattr(self, attr_name,
+                        [os.path.join(self.path, name) for name in sorted(os.listdir(self.path))
+                         if os.path.splitext(name)[-1].lower() == suffix_name.lower() and
+                         os.path.isfile(os.path.join(self.path, name))])
+            elif self.file_name is None:
                 setattr(self, attr_name,
                         glob.glob(os.path.join(self.path, "*{}".format(suffix_name))))
             # 输入的是文件
+            elif ignore_case and os.path.splitext(self.file_name)[-1].lower() == suffix_name.lower():
+                setattr(self, attr_name, [os.path.join(self.path, self.file_name)])
             elif os.path.splitext(self.file_name)[-1] == suffix_name:
                 setattr(self, attr_name, [os.path.join(self.path, self.file_name)])
             else:
@@ -51,23 +225,30 @@ class GetInformationOfPath:
     @property
     def excel_files(self):
         """
-        获取给定路径下所有后缀为 xlsx 的文件
+        获取给定路径下所有后缀为 xlsx 的文件， 后缀不区分大小写
         """
-        return self._get_spcified_suffix('.xlsx', '_excel_files')
+        return self._get_spcified_suffix('.xlsx', '_excel_files', ignore_case=True)
 
     @property
     def erg_files(self):
         """
-        获取给定路径下所有后缀为 erg 的文件
+        获取给定路径下所有后缀为 erg 的文件， 后缀不区分大小写
         """
-        return self._get_spcified_suffix('.erg', '_erg_files')
+        return self._get_spcified_suffix('.erg', '_erg_files', ignore_case=True)
 
     @property
     def csv_files(self):
         """
-        获取给定路径下所有后缀为 csv 的文件
+        获取给定路径下所有后缀为 csv 的文件， 后缀不区分大小写
+        """
+        return self._get_spcified_suffix('.csv', '_csv_files', ignore_case=True)
+
+    @property
+    def dat_files(self):
+        """
+        获取给定路径下所有后缀为 DAT 的文件， 后缀不区分大小写
         """
-        return self._get_spcified_suffix('.csv', '_csv_files')
+        return self._get_spcified_suffix('.dat', '_dat_files', ignore_case=True)
 
     def get_subfolder(self):
         """
@@ -86,9 +267,14 @@ class FileOperator(GetInformationOfPath):
     """
     文件读写操作
     """
-    def __init__(self, path, result_dir = None):
+    def __init__(self, path, result_dir = None, workers=None, cache_size=None):
         """
         初始化相关参数
+
+        :param workers[int]: 并行读取多个文件时所用的进程数,
+                             None 或 1 表示依次读取, 0 表示使用所有 CPU
+        :param cache_size[int]: 原始数据缓存的大小上限(字节), 缓存在 result_dir 下,
+                                None 表示不使用缓存
         """
         # 判断输入的路径是文件还是文件名， 不合法则抛出异常
         # 获取最底层目录的名称，作为工况名称
@@ -103,6 +289,12 @@ class FileOperator(GetInformationOfPath):
         self.make_result_dir()
         # 目录下的子文件夹
         self.sub_folders = None
+        self.workers = workers
+        if cache_size is None:
+            self.cache = None
+        else:
+            self.cache = DataCache(os.path.join(self.result_dir, CACHE_DIR_NAME),
+                                   cache_size)
 
     def make_result_dir(self):
         """创建结果文件夹"""
@@ -111,50 +303,314 @@ class FileOperator(GetInformationOfPath):
         except FileExistsError:
             pass
 
+    def load_files(self, loader, files, args=None):
+        """
+        使用 loader 读取 files 中的所有文件
+
+        使用缓存时，未变化的文件直接从缓存中读取
+        self.workers 不为 None 或 1 时，每个文件在进程池中单独读取,
+        loader 必须是可以被 pickle 的模块级函数
+
+        :param args[list]: 与 files 一一对应， 作为 loader 的第二个参数传入,
+                           为 None 时只传入文件名
+
+        :return 各个文件的读取结果，顺序与 files 相同
+        """
+        tag = self._loader_tag(loader)
+        results = [None] * len(files)
+        if self.cache is not None:
+            results = [self.cache.load(file, tag) for file in files]
+        missing = [index for index, result in enumerate(results) if result is None]
+        missing_args = [[files[index] for index in missing]]
+        if args is not None:
+            missing_args.append([args[index] for index in missing])
+
+        workers = os.cpu_count() if self.workers == 0 else self.workers
+        if workers is None or workers <= 1 or len(missing) <= 1:
+            loaded = list(map(loader, *missing_args))
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+                loaded = list(executor.map(loader, *missing_args))
+
+        for index, df in zip(missing, loaded):
+            results[index] = df
+            if self.cache is not None:
+                self.cache.save(files[index], df, tag)
+        return results
+
+    @staticmethod
+    def _loader_tag(loader):
+        """
+        根据读取函数及其参数生成缓存的标识
+        """
+        if isinstance(loader, functools.partial):
+            return "{}.{}{}".format(loader.func.__module__, loader.func.__qualname__,
+                                    sorted(loader.keywords.items()))
+        return "{}.{}".format(loader.__module__, loader.__qualname__)
+
+    def clear_cache(self):
+        """
+        删除 result_dir 下的原始数据缓存
+        """
+        DataCache(os.path.join(self.result_dir, CACHE_DIR_NAME)).invalidate()
+
     def excel2csv(self):
         """
         将 self.path 路径下的所有 excel 文件转换为同名的 csv 文件
         """
         for excel_file in self.excel_files:
             csv_file = os.path.splitext(excel_file)[0] + ".csv"
-            call(['cscript.exe', 'ExcelToCsv.vbs', excel_file, csv_file])
             # csv 的编码格式统一为 utf-8-sig
-            df = pd.read_csv(csv_file, encoding=locale.getdefaultlocale()[1])
-            df.to_csv(csv_file, index=0, encoding="utf-8-sig")
+            read_excel(excel_file).to_csv(csv_file, index=0, encoding="utf-8-sig")
 
     @staticmethod
-    def read_erg(file_name):
+    def read_erg_header(file_name):
         """
-        读取 erg 文件
-        
+        只读取 erg 文件的表头部分，不读取数据部分
+
         Returns:
-            result_data[DataFrame]: 处理完成后的 erg 的 DataFrame 数据格式
+            start_row[int]: 数据部分开始的行号
+            paras[list]: 各列数据的变量名，有单位时为 "变量名 [单位]"
         """
         paras = []
         with open(file_name, 'r', encoding="ISO-8859-1") as f:
-            lines = f.readlines()
-            start_row = int(lines[0])
-            para_nums = int(lines[3])
-        for line in lines[4:4+para_nums]:
-            if line.split(";")[1]:
-                # 有单位情况的处理
-                paras.append("{} [{}]".format(line.split(";")[0],
-                                                line.split(";")[1]))
+            head = list(itertools.islice(f, 4))
+            start_row = int(head[0])
+            para_nums = int(head[3])
+            for line in itertools.islice(f, para_nums):
+                if line.split(";")[1]:
+                    # 有单位情况的处理
+                    paras.append("{} [{}]".format(line.split(";")[0],
+                                                    line.split(";")[1]))
+                else:
+                    # 无单位情况的处理
+                    paras.append("{}".format(line.split(";")[0]))
+        return start_row, paras
+
+    @staticmethod
+    def iter_erg(file_name, columns=None, chunksize=ERG_CHUNKSIZE, dtype=np.float64):
+        """
+        分块读取 erg 文件
+
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量,
+                              文件中不存在的变量会被忽略
+        :param chunksize[int]: 每一块的行数
+        :param dtype: 指定 columns 时各列的数据类型
+
+        :return 生成器，依次返回各块数据的 DataFrame
+        """
+        start_row, paras = FileOperator.read_erg_header(file_name)
+        if columns is None:
+            usecols, names, dtypes = None, paras, None
+        else:
+            # 将变量名映射为列号，只解析需要的列
+            index_of = {}
+            for index, para in enumerate(paras):
+                index_of.setdefault(para, index)
+            usecols = sorted({index_of[column] for column in columns
+                              if column in index_of})
+            names = [paras[index] for index in usecols]
+            dtypes = {index: dtype for index in usecols}
+        reader = pd.read_csv(file_name, skiprows=start_row, header=None,
+                             delimiter=";", encoding="ISO-8859-1",
+                             usecols=usecols, dtype=dtypes,
+                             chunksize=chunksize)
+        for chunk in reader:
+            if usecols is None:
+                chunk.rename(columns=dict(zip(chunk.columns, names)), inplace=True)
             else:
-                # 无单位情况的处理
-                paras.append("{}".format(line.split(";")[0]))
-        result_data = pd.read_csv(file_name, skiprows=start_row,
-                                   header=None, delimiter=";")
-        result_data.rename(columns=dict(zip(result_data.columns, paras)),
-                           inplace=True)
-        
-        return result_data
+                chunk.columns = names
+            yield chunk
+
+    @staticmethod
+    def read_erg(file_name, columns=None, chunksize=ERG_CHUNKSIZE, dtype=np.float64):
+        """
+        读取 erg 文件
+
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+        :param chunksize[int]: 分块读取时每一块的行数
+        :param dtype: 指定 columns 时各列的数据类型
+
+        Returns:
+            result_data[DataFrame]: 处理完成后的 erg 的 DataFrame 数据格式
+        """
+        chunks = list(FileOperator.iter_erg(file_name, columns, chunksize, dtype))
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True)
+
+    @staticmethod
+    def read_dat_header(file_name):
+        """
+        读取 DIAdem .DAT 文件中的所有通道信息
+
+        Returns:
+            channels[list]: DatChannel 列表
+        """
+        pattern = r"#BEGINCHANNELHEADER\n(.+?)#ENDCHANNELHEADER\n"
+        channel_contents = []
+        for encoding in ('cp1258', 'utf16'):
+            try:
+                with open(file_name, encoding=encoding) as f:
+                    channel_contents = re.findall(pattern, f.read(), re.DOTALL)
+            except UnicodeError:
+                continue
+            if channel_contents:
+                break
+        channels = []
+        for channel_content in channel_contents:
+            dic = {}
+            for content in channel_content.split('\n'):
+                items = content.split(',', 1)
+                if len(items) == 2:
+                    dic[int(items[0])] = items[1].strip()
+            name = "{} [{}]".format(dic[200], dic[202]) if dic.get(202) else dic[200]
+            channels.append(DatChannel(
+                name, dic.get(210), dic.get(211), dic.get(213), dic.get(214),
+                int(dic[220]), int(dic.get(221, 1)),
+                int(dic[222]) if dic.get(213) == 'BLOCK' else None,
+                float(dic.get(240, 0)), float(dic.get(241, 1))))
+        return channels
+
+    @staticmethod
+    def open_dat(file_name, columns=None):
+        """
+        以内存映射的方式打开 DIAdem .DAT 文件对应的二进制数据文件, 不复制数据
+
+        :param columns[list]: 需要的变量名，为 None 时返回所有变量
+
+        Returns:
+            channel_datas[dict]: 变量名与数据的对应关系， 数据为 np.memmap 的视图
+        """
+        path = os.path.split(file_name)[0]
+        memmaps = {}
+        channel_datas = {}
+        for channel in FileOperator.read_dat_header(file_name):
+            if columns is not None and channel.name not in columns:
+                continue
+            if channel.channel_type == 'IMPLICIT':
+                # 等间隔的通道，如时间，由起始值和步长生成
+                channel_datas[channel.name] = (channel.start_value +
+                                               channel.step * np.arange(channel.nums))
+                continue
+            if channel.channel_type != 'EXPLICIT':
+                raise Exception("Channel type {} is not supported".format(channel.channel_type))
+            if channel.data_type not in DAT_DATA_TYPES:
+                raise TypeError("Data Type {} is not supported in this version.".format(channel.data_type))
+            dtype = DAT_DATA_TYPES[channel.data_type]
+            if (channel.file_name, dtype) not in memmaps:
+                memmaps[(channel.file_name, dtype)] = np.memmap(
+                    os.path.join(path, channel.file_name), dtype=dtype, mode='r')
+            data = memmaps[(channel.file_name, dtype)]
+            start = channel.start_index - 1
+            if channel.method == 'BLOCK':
+                # 多个通道交错储存，每隔 block_offset 个值取一个
+                view = data[start::channel.block_offset][:channel.nums]
+            else:
+                view = data[start:start + channel.nums]
+            channel_datas[channel.name] = view
+        return channel_datas
+
+    @staticmethod
+    def read_dat(file_name, columns=None):
+        """
+        读取 DIAdem .DAT 文件， 只将 columns 中的变量读入内存
+
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+
+        Returns:
+            result_data[DataFrame]: .DAT 文件的 DataFrame 数据格式
+        """
+        channel_datas = FileOperator.open_dat(file_name, columns)
+        if len({len(data) for data in channel_datas.values()}) > 1:
+            # 各通道长度不同时，较短的通道用 nan 补齐
+            return pd.DataFrame({name: pd.Series(data) for name, data in channel_datas.items()})
+        return pd.DataFrame({name: np.array(data) for name, data in channel_datas.items()})
 
-    def handle_ergs(self, merge=True,file_name=None, save_to_file=False):
+    @staticmethod
+    def iter_dat(file_name, columns=None, memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64):
+        """
+        分块读取 DIAdem .DAT 文件， 每一块只从内存映射中复制需要的行
+
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+        :param memory_budget[int]: 每一块数据的内存上限(字节)
+        :param dtype: 各列的数据类型
+
+        :return 生成器，依次返回各块数据的 DataFrame, 较短的通道用 nan 补齐
+        """
+        channel_datas = FileOperator.open_dat(file_name, columns)
+        n_rows = max((len(data) for data in channel_datas.values()), default=0)
+        chunksize = budget_rows(memory_budget, len(channel_datas), dtype)
+        for start in range(0, max(n_rows, 1), chunksize):
+            stop = min(start + chunksize, n_rows)
+            chunk = {}
+            for name, data in channel_datas.items():
+                values = np.full(stop - start, np.nan, dtype=dtype)
+                part = data[start:stop]
+                values[:len(part)] = part
+                chunk[name] = values
+            yield pd.DataFrame(chunk, index=pd.RangeIndex(start, stop))
+
+    def iter_data(self, file_type, columns=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                  dtype=np.float64):
+        """
+        分块读取当前文件夹下的所有原始文件， 不使用缓存及进程池， 用于无法一次读入内存的数据
+
+        :param file_type[int]: 0 为 csv, 1 为 excel, 2 为 erg, 3 为 dat, 与 HandleSingleWorking 相同
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+        :param memory_budget[int]: 每一块数据的内存上限(字节), 见 budget_rows
+        :param dtype: erg 及 dat 文件中各列的数据类型， 只在指定 columns 时对 erg 文件起作用
+
+        :return 生成器，依次返回 (文件序号, 该块数据的 DataFrame), 文件按 *_files 中的顺序读取
+        """
+        if file_type == 0:
+            sidecar = self._load_encodings()
+            for index, csv_file in enumerate(self.csv_files):
+                record = sidecar.get(os.path.abspath(csv_file))
+                encoding = None
+                if record is not None and record['fingerprint'] == file_fingerprint(csv_file):
+                    encoding = record['encoding']
+                for chunk in iter_csv(csv_file, columns, memory_budget, encoding):
+                    yield index, chunk
+        elif file_type == 1:
+            for index, excel_file in enumerate(self.excel_files):
+                for chunk in iter_excel(excel_file, columns, memory_budget=memory_budget):
+                    yield index, chunk
+        elif file_type == 2:
+            for index, erg_file in enumerate(self.erg_files):
+                paras = FileOperator.read_erg_header(erg_file)[1]
+                n_columns = len(paras) if columns is None else \
+                    len([para for para in paras if para in columns])
+                for chunk in FileOperator.iter_erg(erg_file, columns,
+                                                   budget_rows(memory_budget, n_columns, dtype),
+                                                   dtype):
+                    yield index, chunk
+        elif file_type == 3:
+            for index, dat_file in enumerate(self.dat_files):
+                for chunk in FileOperator.iter_dat(dat_file, columns, memory_budget, dtype):
+                    yield index, chunk
+        else:
+            raise ValueError("Unsupported file type {}".format(file_type))
+
+    def handle_dats(self, columns=None):
+        """
+        读取并合并当前文件夹下的所有 DIAdem .DAT 文件
+
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+
+        :returns 合并后的 DataFrame数据
+        """
+        dfs = self.load_files(functools.partial(FileOperator.read_dat, columns=columns),
+                              self.dat_files)
+        return pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+
+    def handle_ergs(self, merge=True,file_name=None, save_to_file=False, columns=None):
         """
         处理合并当前文件夹下的所有 erg 文件，可选保存为 csv 文件
         
         :param file_name[str]: 合并后的文件的全路径
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量,
+                              merge 为 True 时会自动加上排序所需的时间变量
         :param merge[boolen]: True 合并当前文件夹下的 erg,
                            False 将当前文件夹下的 erg 转换为单独的 erg
         :param save_to_file: True 保存结果到文件,
@@ -162,14 +618,14 @@ class FileOperator(GetInformationOfPath):
         
         :return  merge 为 True 则返回合并后的 dataFrame, merge 为 False, 则返回由各个 erg 文件组成的列表
         """
-        dfs = []
-        file_names = []
-        for erg_file in self.erg_files:
-            dfs.append(self.read_erg(erg_file))
-            file_names.append(os.path.splitext(erg_file)[0] + ".csv")
+        if columns is not None and merge:
+            columns = list(columns) + [c for c in TIME_COLUMNS if c not in columns]
+        dfs = self.load_files(functools.partial(FileOperator.read_erg, columns=columns),
+                              self.erg_files)
+        file_names = [os.path.splitext(erg_file)[0] + ".csv"
+                      for erg_file in self.erg_files]
         if merge == True:
-            result_data = pd.concat(dfs)
-            sort_by_time(result_data)
+            result_data = merge_by_time(dfs)
             if save_to_file:
                 if file_name is None:
                     file_name = os.path.join(self.path, os.path.split(self.path)[-1] + "_merge_ergs.csv")
@@ -187,28 +643,53 @@ class FileOperator(GetInformationOfPath):
 
         :returns 合并后的 DataFrame数据
         """
-        dfs = []
+        sidecar = self._load_encodings()
+        encodings = []
         for csv_file in self.csv_files:
-            #!  依次尝试可能的编码格式
-            try:
-                dfs.append(pd.read_csv(csv_file, encoding='utf-8-sig',
-                                       low_memory=False))
-            except UnicodeDecodeError:
-                dfs.append(pd.read_csv(csv_file, encoding='gbk',
-                                       low_memory=False))
+            record = sidecar.get(os.path.abspath(csv_file))
+            if record is not None and record['fingerprint'] == file_fingerprint(csv_file):
+                encodings.append(record['encoding'])
+            else:
+                encodings.append(None)
+        dfs = self.load_files(read_csv, self.csv_files, encodings)
+        # 记录实际使用的编码， 下次读取时不再判断
+        updated = False
+        for csv_file, encoding, df in zip(self.csv_files, encodings, dfs):
+            if df.attrs.get('encoding', encoding) != encoding:
+                sidecar[os.path.abspath(csv_file)] = {'fingerprint': file_fingerprint(csv_file),
+                                                      'encoding': df.attrs['encoding']}
+                updated = True
+        if updated:
+            self._save_encodings(sidecar)
         #* 假设表头完全相同，则可直接合并多个数据
         return pd.concat(dfs, sort=False) if len(dfs) > 1 else dfs[0]
 
-    def splice_excels(self):
+    def _load_encodings(self):
+        """
+        读取 result 文件夹下记录的各个 csv 文件的编码
+        """
+        try:
+            with open(os.path.join(self.result_dir, ENCODING_SIDECAR_NAME),
+                      encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_encodings(self, encodings):
+        with open(os.path.join(self.result_dir, ENCODING_SIDECAR_NAME), 'w',
+                  encoding='utf8') as f:
+            json.dump(encodings, f, ensure_ascii=False, indent=2)
+
+    def splice_excels(self, columns=None):
         """
         合并 self.path 文件夹下的 excel 文件， 需保证表头完全相同
 
+        :param columns[list]: 需要读取的变量名，为 None 时读取所有变量
+
         :returns 合并后的 DataFrame数据
         """
-        dfs = []
-        for excel_file in self.excel_files:
-            #!  依次尝试可能的编码格式
-                dfs.append(pd.read_excel(excel_file, encoding='utf-8-sig'))
+        dfs = self.load_files(functools.partial(read_excel, columns=columns),
+                              self.excel_files)
         #* 假设表头完全相同，则可直接合并多个数据
         return pd.concat(dfs, sort=False) if len(dfs) > 1 else dfs[0]
 
@@ -219,10 +700,18 @@ class FileOperator(GetInformationOfPath):
             csv_name (str): csv 文件的全路径
             df (DataFrame): 要写入的 DataFrame
         """
-        try:
-            df.to_csv(csv_name, index=index, encoding="utf-8-sig")
-        except:
-            df.to_csv(csv_name, index=index, encoding="gbk")
+        # utf-8 可以表示所有字符， 只写入一次
+        df.to_csv(csv_name, index=index, encoding="utf-8-sig")
+
+    def png_path(self, name):
+        """
+        获取保存在 result 文件夹下的图片的全路径
+
+        Arguments:
+            name: 图片名
+        """
+        png_name = '_'.join([self.operator_name, name])
+        return os.path.join(self.result_dir, png_name)
 
     def save_to_png(self, fig, name):
         """
@@ -232,8 +721,7 @@ class FileOperator(GetInformationOfPath):
             fig: Matplotlib 返回的图片对象
             name: 图片名
         """
-        png_name = '_'.join([self.operator_name, name])
-        png_name = os.path.join(self.result_dir, png_name)
+        png_name = self.png_path(name)
         fig.savefig(png_name)
         return png_name
 
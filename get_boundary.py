@@ -2,102 +2,141 @@
 找出 map 图的边界
 """
 
+from collections import defaultdict
+
 from scipy.spatial import Delaunay
 import numpy as np
 import matplotlib.path as mplPath
 
 
-def alpha_shape(points, alpha, only_outer=True):
+def alpha_simplices(points, tri, alpha):
+    """
+    一次性计算所有三角形外接圆的半径，筛选出 alpha shape 中的三角形
+    :param points: np.array of shape (n,2) points.
+    :param tri: points 的 Delaunay 三角剖分
+    :param alpha: alpha value.
+    :return: bool 数组， 与 tri.simplices 一一对应， True 表示外接圆半径小于 alpha
+    """
+    pa = points[tri.simplices[:, 0]]
+    pb = points[tri.simplices[:, 1]]
+    pc = points[tri.simplices[:, 2]]
+    # Computing radius of triangle circumcircle
+    # www.mathalino.com/reviewer/derivation-of-formulas/derivation-of-formula-for-radius-of-circumcircle
+    a = np.hypot(pa[:, 0] - pb[:, 0], pa[:, 1] - pb[:, 1])
+    b = np.hypot(pb[:, 0] - pc[:, 0], pb[:, 1] - pc[:, 1])
+    c = np.hypot(pc[:, 0] - pa[:, 0], pc[:, 1] - pa[:, 1])
+    s = (a + b + c) / 2.0
+    # 退化的三角形面积为 0 或 nan, 外接圆半径不小于 alpha
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area = np.sqrt(s * (s - a) * (s - b) * (s - c))
+        circum_r = a * b * c / (4.0 * area)
+    return circum_r < alpha
+
+
+def alpha_shape(points, alpha, only_outer=True, tri=None):
     """
     Compute the alpha shape (concave hull) of a set of points.
     :param points: np.array of shape (n,2) points.
     :param alpha: alpha value.
     :param only_outer: boolean value to specify if we keep only the outer border
     or also inner edges.
+    :param tri: 已有的 points 的 Delaunay 三角剖分， 为 None 时重新计算
     :return: set of (i,j) pairs representing edges of the alpha-shape. (i,j) are
     the indices in the points array.
     """
     assert points.shape[0] > 3, "Need at least four points"
-
-    def add_edge(edges, i, j):
-        """
-        Add an edge between the i-th and j-th points,
-        if not in the list already
-        """
-        if (i, j) in edges or (j, i) in edges:
-            # already added
-            assert (j, i) in edges, "Can't go twice over same directed edge right?"
-            if only_outer:
-                # if both neighboring triangles are in shape, it's not a boundary edge
-                edges.remove((j, i))
-            return
-        edges.add((i, j))
-
-    tri = Delaunay(points)
-    edges = set()
-    # Loop over triangles:
-    # ia, ib, ic = indices of corner points of the triangle
-    for ia, ib, ic in tri.vertices:
-        pa = points[ia]
-        pb = points[ib]
-        pc = points[ic]
-        # Computing radius of triangle circumcircle
-        # www.mathalino.com/reviewer/derivation-of-formulas/derivation-of-formula-for-radius-of-circumcircle
-        a = np.sqrt((pa[0] - pb[0]) ** 2 + (pa[1] - pb[1]) ** 2)
-        b = np.sqrt((pb[0] - pc[0]) ** 2 + (pb[1] - pc[1]) ** 2)
-        c = np.sqrt((pc[0] - pa[0]) ** 2 + (pc[1] - pa[1]) ** 2)
-        s = (a + b + c) / 2.0
-        area = np.sqrt(s * (s - a) * (s - b) * (s - c))
-        circum_r = a * b * c / (4.0 * area)
-        if circum_r < alpha:
-            add_edge(edges, ia, ib)
-            add_edge(edges, ib, ic)
-            add_edge(edges, ic, ia)
-    return edges
-
-
-def find_edges_with(i, edge_set):
-    i_first = [j for (x,j) in edge_set if x==i]
-    i_second = [j for (j,x) in edge_set if x==i]
-    return i_first,i_second
+    if tri is None:
+        tri = Delaunay(points)
+    simplices = tri.simplices[alpha_simplices(points, tri, alpha)]
+    edges = np.concatenate([simplices[:, [0, 1]], simplices[:, [1, 2]],
+                            simplices[:, [2, 0]]])
+    # 不区分方向， 将每条边编码为一个整数
+    key = np.sort(edges, axis=1)
+    key = key[:, 0].astype(np.int64) * points.shape[0] + key[:, 1]
+    _, first, inverse, counts = np.unique(key, return_index=True,
+                                          return_inverse=True, return_counts=True)
+    if only_outer:
+        # 只属于一个三角形的边才是边界
+        edges = edges[counts[inverse.ravel()] == 1]
+    else:
+        edges = edges[first]
+    return set(map(tuple, edges.tolist()))
 
 
 def stitch_boundaries(edges):
-    edge_set = edges.copy()
+    """
+    将边界上的边首尾相连，组成闭合的边界
+
+    :param edges: alpha_shape 返回的边的集合
+    :return: 所有边界组成的列表， 每个边界为首尾相连的 (i,j) 列表
+    """
+    neighbors = defaultdict(list)
+    for i, j in edges:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    used = set()
     boundary_lst = []
-    while len(edge_set) > 0:
-        boundary = []
-        edge0 = edge_set.pop()
-        boundary.append(edge0)
+    for edge0 in edges:
+        if (min(edge0), max(edge0)) in used:
+            continue
+        used.add((min(edge0), max(edge0)))
+        boundary = [edge0]
         last_edge = edge0
-        while len(edge_set) > 0:
-            i,j = last_edge
-            j_first, j_second = find_edges_with(j, edge_set)
-            if j_first:
-                edge_set.remove((j, j_first[0]))
-                edge_with_j = (j, j_first[0])
-                boundary.append(edge_with_j)
-                last_edge = edge_with_j
-            elif j_second:
-                edge_set.remove((j_second[0], j))
-                edge_with_j = (j, j_second[0])  # flip edge rep
-                boundary.append(edge_with_j)
-                last_edge = edge_with_j
-
-            if edge0[0] == last_edge[1]:
+        while last_edge[1] != edge0[0]:
+            j = last_edge[1]
+            # 取与 j 相连且尚未使用的边
+            for k in neighbors[j]:
+                if (min(j, k), max(j, k)) not in used:
+                    break
+            else:
                 break
-
+            used.add((min(j, k), max(j, k)))
+            last_edge = (j, k)
+            boundary.append(last_edge)
         boundary_lst.append(boundary)
     return boundary_lst
 
 
-def get_boundary_path(x, y):
+def get_boundary_rings(x, y, alpha=1000, tri=None):
+    """
+    获取散点的所有边界， 包含外边界和内部的孔洞
+
+    :param tri: 已有的散点的 Delaunay 三角剖分， 为 None 时重新计算
+    :return: 边界列表， 每个边界为依次相连的顶点组成的 np.array of shape (k,2)
+    """
     points = np.vstack([x, y]).T
-    edges = alpha_shape(points, alpha=1000, only_outer=True)
+    edges = alpha_shape(points, alpha=alpha, only_outer=True, tri=tri)
     boundary_lst = stitch_boundaries(edges)
+    return [points[[item[0] for item in boundary], :] for boundary in boundary_lst]
+
+
+def get_boundary_path(x, y, alpha=1000, tri=None):
+    """
+    获取由散点的所有边界组成的 matplotlib Path
 
-    real_edges = []
-    for item in boundary_lst[0]:
-      real_edges.append(points[item[0],:])
-    bbPath = mplPath.Path(real_edges)
+    Path.contains_points 对多个子路径取并集, 判断点是否在带孔洞的边界内时
+    应使用 contains_points(get_boundary_rings(x, y), points)
+    """
+    vertices = []
+    codes = []
+    for ring in get_boundary_rings(x, y, alpha, tri):
+        vertices.extend(ring)
+        vertices.append(ring[0])
+        codes.extend([mplPath.Path.MOVETO] + [mplPath.Path.LINETO] * (len(ring) - 1)
+                     + [mplPath.Path.CLOSEPOLY])
+    bbPath = mplPath.Path(vertices, codes)
     return bbPath
+
+
+def contains_points(rings, points):
+    """
+    判断点是否在边界内，按奇偶规则处理孔洞： 被奇数个边界包围的点在边界内
+
+    :param rings: get_boundary_rings 返回的边界列表
+    :param points: np.array of shape (n,2) points.
+    :return: bool 数组
+    """
+    inside = np.zeros(len(points), dtype=bool)
+    for ring in rings:
+        inside ^= mplPath.Path(ring).contains_points(points)
+    return inside
@@ -1,20 +1,63 @@
 """
 处理电机特定的试验
+
+pandas、matplotlib 和 scipy 只在需要时导入， 命令行的 --help 及格式转换能够快速启动
 """
 
-from file_operator import FileOperator
-from data_process import OCProcess, ASCProcess, EffProcess
+import argparse
+import cProfile
+import hashlib
+import importlib
+import json
 import os
+import sys
+
+from data_cache import DEFAULT_CACHE_SIZE, file_fingerprint
+from instrument import PROFILE_NAME, TRACE_NAME, Tracer
+
+# 试验工况与 data_process 中数据处理类的对应关系
+TEST_CONDITION = {"open_circuit": "OCProcess",
+                  "ASC": "ASCProcess",
+                  "efficiency": "EffProcess"}
+# 原始文件的格式名称与 (后缀, file_type) 的对应关系， 按自动识别时的优先级排序,
+# 定义在此处而不是 file_operator 中， 以免命令行启动时导入 pandas
+FILE_TYPES = {'erg': ('.erg', 2), 'dat': ('.dat', 3), 'csv': ('.csv', 0),
+              'excel': ('.xlsx', 1)}
+# 处理步骤，按运行顺序排列
+STAGES = ['data_process', 'plot', 'generator_markdown', 'save_data']
+# 记录各个处理步骤的输入及结果文件，用于增量运行
+STAGE_STATE_NAME = '.stages.json'
+RAW_FILES = {0: 'csv_files', 1: 'excel_files', 2: 'erg_files', 3: 'dat_files'}
+
 
-TEST_CONDITION = {"open_circuit": OCProcess,
-                  "ASC": ASCProcess,
-                  "efficiency": EffProcess}
+def get_process_class(test_condition):
+    """
+    获取试验工况对应的数据处理类， 在此时才导入 data_process
+    """
+    return getattr(importlib.import_module('data_process'), TEST_CONDITION[test_condition])
 
 
 class HandleSingleWorking():
-    def __init__(self, path, test_condition, file_type=0):
+    def __init__(self, path, test_condition, file_type=0, workers=None,
+                 cache_size=DEFAULT_CACHE_SIZE, rebuild_cache=False,
+                 draft=False, render_workers=None, average_window=None,
+                 trace=False, profile=False, out_of_core=None, trace_memory=False):
         """
         初始化相关参数
+
+        :param workers[int]: 并行读取原始数据文件的进程数， None 表示依次读取
+        :param cache_size[int]: 原始数据缓存的大小上限(字节), None 表示不使用缓存
+        :param rebuild_cache[bool]: True 则删除已有的缓存，重新解析原始数据
+        :param draft[bool]: True 则以较低的分辨率绘图， 并省略表格和等高线标注
+        :param render_workers[int]: 并行绘图的进程数， None 表示在当前进程中绘图
+        :param average_window[tuple]: 各个工况点参与求取均值的数据， 如 ('head', 200), ('steady', 50),
+                                      None 表示使用默认值
+        :param trace[bool]: True 则记录各个步骤的耗时及数据行数， 写入结果文件夹下的 trace.json
+        :param profile[bool]: True 则使用 cProfile 分析运行过程， 结果写入结果文件夹下的 profile.prof
+        :param out_of_core[dict]: 不为 None 时分块读取原始数据， 用于无法一次读入内存的数据,
+                                  如 {'memory_budget': 256 * 1024 ** 2, 'dtype': 'float32'}
+        :param trace_memory[bool]: trace 为 True 时同时用 tracemalloc 记录各个步骤的内存峰值,
+                                   会使记录的耗时偏大
         """
         # 判断输入的路径还是文件名，据此建立相应的结果文件夹
         if os.path.isdir(path):
@@ -24,28 +67,224 @@ class HandleSingleWorking():
         else:
             raise FileNotFoundError("[Errno 2] No such file or directory")
 
-        self.file_operator = FileOperator(path, result_dir)
+        from file_operator import FileOperator
+        self.file_operator = FileOperator(path, result_dir, workers, cache_size)
+        if rebuild_cache:
+            self.file_operator.clear_cache()
         self.test_condition = test_condition
-        self.test = TEST_CONDITION[test_condition](self.file_operator, file_type)
+        self.test = get_process_class(test_condition)(self.file_operator, file_type)
+        self.test.plot_paras['draft'] = draft
+        self.test.render_workers = render_workers
+        if average_window is not None:
+            self.test.data_paras['average_window'] = tuple(average_window)
+        if out_of_core is not None:
+            self.test.data_paras['out_of_core'] = dict(out_of_core)
+        self.trace = trace
+        self.profile = profile
+        if trace:
+            self.test.tracer = Tracer(memory=trace_memory)
 
-    def run(self):
+    def run(self, force=False, stages=None):
         """
         运行主程序
+
+        输入及参数未变化且结果文件存在的步骤直接使用上一次的结果
+
+        :param force[bool]: True 则不论输入是否变化，重新运行所有步骤
+        :param stages[list]: 需要运行的步骤， 其依赖的步骤也会运行， None 表示所有步骤;
+                             只运行 data_process 时不会导入 matplotlib
         """
-        self.test.data_process()
-        self.test.plot()
-        self.test.generator_markdown()
-        self.test.save_data()
+        state = {} if force else self._load_stage_state()
+        keys = self._stage_keys()
+        targets = STAGES if stages is None else [stage for stage in STAGES if stage in stages]
+        dirty = [stage for stage in targets if not self._stage_done(state, stage, keys[stage])]
+        if not dirty:
+            print("输入未变化，结果已是最新:\n {}".format(self.file_operator.result_dir))
+            return
+        # 需要重新运行的步骤及其依赖的步骤
+        todo = set()
+        pending = list(dirty)
+        while pending:
+            stage = pending.pop()
+            if stage not in todo:
+                todo.add(stage)
+                pending.extend(self.test.stage_depends[stage])
+
+        profiler = cProfile.Profile() if self.profile else None
+        if profiler is not None:
+            profiler.enable()
+        for stage in STAGES:
+            if stage not in todo:
+                continue
+            before = self._snapshot_results()
+            with self.test.tracer.stage(stage):
+                getattr(self.test, stage)()
+            after = self._snapshot_results()
+            outputs = [name for name, mtime in after.items() if before.get(name) != mtime]
+            if stage in state and state[stage]['key'] == keys[stage]:
+                outputs = sorted(set(outputs) | set(state[stage]['outputs']))
+            state[stage] = {'key': keys[stage], 'outputs': outputs}
+            self._save_stage_state(state)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(self.file_operator.result_dir, PROFILE_NAME))
+        if self.trace:
+            self.test.tracer.save(os.path.join(self.file_operator.result_dir, TRACE_NAME))
         print("运行完成，结果在文件夹:\n {}".format(self.file_operator.result_dir))
 
+    def _stage_keys(self):
+        """
+        计算各个步骤输入的哈希值，步骤的输入包括其依赖步骤的哈希值
+        """
+        file_names = getattr(self.file_operator, RAW_FILES[self.test.file_type])
+        raw_files = [file_fingerprint(file_name) for file_name in sorted(file_names)]
+        keys = {}
+        for stage in STAGES:
+            inputs = {'paras': self.test.stage_paras(stage),
+                      'depends': [keys[depend] for depend in self.test.stage_depends[stage]]}
+            if stage == 'data_process':
+                inputs['raw_files'] = raw_files
+            text = json.dumps(inputs, sort_keys=True, default=str)
+            keys[stage] = hashlib.sha1(text.encode('utf8')).hexdigest()
+        return keys
 
-if __name__ == "__main__":
+    def _stage_done(self, state, stage, key):
+        """
+        判断步骤的输入是否未变化，且其结果文件都存在
+        """
+        if stage not in state or state[stage]['key'] != key:
+            return False
+        return all(os.path.exists(os.path.join(self.file_operator.result_dir, name))
+                   for name in state[stage]['outputs'])
+
+    def _snapshot_results(self):
+        """
+        获取结果文件夹下各个文件的修改时间
+        """
+        result = {}
+        for entry in os.scandir(self.file_operator.result_dir):
+            if entry.is_file() and not entry.name.startswith('.'):
+                result[entry.name] = entry.stat().st_mtime_ns
+        return result
+
+    def _load_stage_state(self):
+        try:
+            with open(os.path.join(self.file_operator.result_dir, STAGE_STATE_NAME),
+                      encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_stage_state(self, state):
+        with open(os.path.join(self.file_operator.result_dir, STAGE_STATE_NAME),
+                  'w', encoding='utf8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def convert_to_csv(path, file_type='erg', merge=False, workers=None):
+    """
+    将文件夹下的原始文件转换为 csv 文件， 不进行数据处理
+
+    :param file_type[str]: 'erg', 'excel' 或 'dat'
+    :param merge[bool]: True 则合并为一个 csv 文件 (excel 文件不合并), False 则逐个转换
+    :param workers[int]: 并行读取的进程数
+    """
+    from file_operator import FileOperator
+    file_operator = FileOperator(path, workers=workers)
+    if file_type == 'erg':
+        file_operator.handle_ergs(merge=merge, save_to_file=True)
+    elif file_type == 'excel':
+        file_operator.excel2csv()
+    elif file_type == 'dat':
+        if merge:
+            file_operator.save_to_csv(
+                os.path.join(file_operator.path,
+                             os.path.split(file_operator.path)[-1] + "_merge_dats.csv"),
+                file_operator.handle_dats())
+        else:
+            for dat_file in file_operator.dat_files:
+                file_operator.save_to_csv(os.path.splitext(dat_file)[0] + ".csv",
+                                          FileOperator.read_dat(dat_file))
+    else:
+        raise ValueError("Unsupported file type {}".format(file_type))
+
+
+def parse_args(argv=None):
+    """
+    解析命令行参数
+    """
+    parser = argparse.ArgumentParser(description="处理电机特定的试验， 不带参数运行时以交互方式输入")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="处理一个工况")
+    run_parser.add_argument('path', help="数据所在的文件夹路径或数据文件的路径")
+    run_parser.add_argument('-t', '--test', required=True, choices=list(TEST_CONDITION),
+                            help="试验工况")
+    run_parser.add_argument('-f', '--file-type', choices=list(FILE_TYPES), default='csv',
+                            help="原始文件的格式， 默认为 csv")
+    run_parser.add_argument('-s', '--stages', nargs='+', choices=STAGES,
+                            help="只运行这些步骤及其依赖的步骤， 如 -s data_process 只处理数据不绘图")
+    run_parser.add_argument('--force', action='store_true', help="忽略上一次的结果， 重新运行所有步骤")
+    run_parser.add_argument('-d', '--draft', action='store_true',
+                            help="草稿模式， 以较低的分辨率绘图并省略表格和等高线标注")
+    run_parser.add_argument('-j', '--workers', type=int, help="并行读取原始文件的进程数， 0 表示所有 CPU")
+    run_parser.add_argument('--render-workers', type=int, help="并行绘图的进程数， 0 表示所有 CPU")
+    run_parser.add_argument('--no-cache', action='store_true', help="不使用原始数据缓存")
+    run_parser.add_argument('--rebuild-cache', action='store_true', help="删除已有的原始数据缓存")
+    run_parser.add_argument('--steady', type=int, metavar='LENGTH',
+                            help="按长度为 LENGTH 的滑动窗口选取稳态数据求均值， 默认取前 200 个点")
+    run_parser.add_argument('--out-of-core', type=int, metavar='MEMORY_MB',
+                            help="分块读取原始数据， 每一块的内存上限为 MEMORY_MB, "
+                                 "用于无法一次读入内存的数据， 不能与 --steady 同时使用")
+    run_parser.add_argument('--float32', action='store_true',
+                            help="分块读取时以单精度读取数据， 减少内存占用")
+    run_parser.add_argument('--trace', action='store_true',
+                            help="记录各个步骤的耗时， 写入结果文件夹下的 {}".format(TRACE_NAME))
+    run_parser.add_argument('--trace-memory', action='store_true',
+                            help="同 --trace, 并用 tracemalloc 记录各步骤的内存峰值， 会使耗时增加")
+    run_parser.add_argument('--profile', action='store_true',
+                            help="使用 cProfile 分析运行过程， 写入结果文件夹下的 {}".format(PROFILE_NAME))
+
+    convert_parser = subparsers.add_parser('convert', help="将原始文件转换为 csv 文件")
+    convert_parser.add_argument('path', help="原始文件所在的文件夹路径")
+    convert_parser.add_argument('-f', '--file-type', choices=['erg', 'excel', 'dat'], default='erg',
+                                help="原始文件的格式， 默认为 erg")
+    convert_parser.add_argument('--merge', action='store_true', help="合并为一个 csv 文件")
+    convert_parser.add_argument('-j', '--workers', type=int, help="并行读取的进程数， 0 表示所有 CPU")
+    return parser.parse_args(argv)
+
+
+def interactive():
+    """
+    以交互方式输入工况、路径及文件格式
+    """
     test_conditions = ["open_circuit", "ASC", "efficiency"]
     msg = "工况选择：\n1.\topen circuit\n2.\tASC\n3.\tefficiency\n请输入数字："
     test_choice = int(input(msg)) - 1
     test_condition = test_conditions[test_choice]
     path = input('请输入数据所在的文件夹路径或数据文件的文件名路径：').strip('"')
-    msg = "请选择原始文件的格式：\n1.\tcsv file\n2.\texcel file\n3.\terg file\n请输入数字："
+    msg = "请选择原始文件的格式：\n1.\tcsv file\n2.\texcel file\n3.\terg file\n4.\tdat file\n请输入数字："
     file_choice = int(input(msg)) - 1
     working = HandleSingleWorking(path, test_condition, file_choice)
     working.run()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        interactive()
+    else:
+        args = parse_args()
+        if args.command == 'convert':
+            convert_to_csv(args.path, args.file_type, args.merge, args.workers)
+        else:
+            working = HandleSingleWorking(
+                args.path, args.test, FILE_TYPES[args.file_type][1], args.workers,
+                None if args.no_cache else DEFAULT_CACHE_SIZE, args.rebuild_cache,
+                args.draft, args.render_workers,
+                None if args.steady is None else ('steady', args.steady),
+                args.trace or args.trace_memory, args.profile,
+                None if args.out_of_core is None else
+                {'memory_budget': args.out_of_core * 1024 ** 2,
+                 'dtype': 'float32' if args.float32 else 'float64'},
+                args.trace_memory)
+            working.run(args.force, args.stages)
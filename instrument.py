@@ -0,0 +1,112 @@
+"""
+记录各个处理步骤的耗时及内存占用
+"""
+
+from contextlib import contextmanager
+import json
+import time
+import tracemalloc
+
+
+# 结果文件夹下记录各个步骤耗时的文件及 cProfile 的结果文件
+TRACE_NAME = 'trace.json'
+PROFILE_NAME = 'profile.prof'
+
+
+class Tracer:
+    """
+    按步骤记录墙上时间、CPU 时间、输入输出的数据行数， 可选记录内存峰值
+
+    步骤可以嵌套， 子步骤的名称为 "父步骤/子步骤"
+    """
+    def __init__(self, memory=False):
+        """
+        :param memory[bool]: True 则使用 tracemalloc 记录内存峰值;
+                             tracemalloc 会使分配内存较多的步骤明显变慢， 此时记录的耗时偏大， 默认不记录
+        """
+        self.memory = memory
+        self.records = []
+        self._stack = []
+        self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        记录一个步骤， 返回的字典中可以写入 rows_out 等信息
+
+        :param name[str]: 步骤名称
+        :param rows_in[int]: 输入的数据行数
+        """
+        if self._stack:
+            name = self._stack[-1]['record']['name'] + '/' + name
+        record = {'name': name, 'rows_in': rows_in, 'rows_out': None}
+        self.records.append(record)
+        frame = {'record': record, 'peak': 0, 'memory': 0}
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            current, peak = tracemalloc.get_traced_memory()
+            # 重置峰值前先将其计入父步骤
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['memory'] = current
+        self._stack.append(frame)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall, 6)
+            record['cpu_s'] = round(time.process_time() - cpu, 6)
+            self._stack.pop()
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame['peak'])
+                record['peak_mb'] = round((peak - frame['memory']) / 1024 ** 2, 3)
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+                elif self._started_tracemalloc:
+                    tracemalloc.stop()
+                    self._started_tracemalloc = False
+
+    def save(self, file_name):
+        """
+        将记录写入 json 文件
+        """
+        with open(file_name, 'w', encoding='utf8') as f:
+            json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'memory': self.memory, 'stages': self.records},
+                      f, ensure_ascii=False, indent=2)
+
+
+class _NullRecord(dict):
+    """
+    不记录任何信息的步骤
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class NullTracer:
+    """
+    不记录任何信息， 未开启记录时使用， 开销可以忽略
+    """
+    memory = False
+    records = []
+    _record = _NullRecord()
+
+    def stage(self, name, rows_in=None):
+        return self._record
+
+    def save(self, file_name):
+        pass
+
+
+NULL_TRACER = NullTracer()
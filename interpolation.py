@@ -0,0 +1,185 @@
+"""
+效率 map 图的网格插值
+"""
+
+import numpy as np
+from scipy.spatial import Delaunay
+
+from get_boundary import alpha_simplices
+
+
+# 插值网格点数的默认上限
+DEFAULT_MAX_CELLS = 1000000
+# 每个网格点占用的内存估计(字节): 网格坐标、所在三角形、三个顶点及重心坐标， 以及三个变量的插值结果
+CELL_BYTES = 8 * 2 + 8 + 3 * 4 + 3 * 8 + 3 * 8
+
+
+def grid_steps(x, y, step_x, step_y, max_cells=None, memory_budget=None):
+    """
+    根据网格点数及内存的上限确定插值网格的间隔
+
+    :return step_x, step_y: 超出上限时两个方向的间隔按相同的比例增大
+    """
+    if memory_budget is not None:
+        budget_cells = memory_budget // CELL_BYTES
+        max_cells = budget_cells if max_cells is None else min(max_cells, budget_cells)
+    if max_cells is None:
+        return step_x, step_y
+    cells = (np.ptp(x) / step_x + 1) * (np.ptp(y) / step_y + 1)
+    if cells <= max_cells:
+        return step_x, step_y
+    # * 求解 (a / scale + 1) * (b / scale + 1) = max_cells， 使网格点数（含两端的点）不超出上限
+    a, b, limit = np.ptp(x) / step_x, np.ptp(y) / step_y, max(max_cells, 2)
+    if a * b > 0:
+        inverse = (np.sqrt((a + b) ** 2 + 4 * a * b * (limit - 1)) - (a + b)) / (2 * a * b)
+    else:
+        inverse = (limit - 1) / (a + b)
+    return step_x / inverse, step_y / inverse
+
+
+def locate(tri, points, simplex_mask=None):
+    """
+    找出各个点所在的三角形， 并计算其重心坐标
+
+    :param tri: Delaunay 三角剖分
+    :param points[ndarray]: shape (n, 2)
+    :param simplex_mask[ndarray]: 参与插值的三角形， 如 alpha shape 中的三角形, None 表示所有三角形
+    :return inside[ndarray]: bool 数组， True 表示点位于参与插值的三角形内
+            vertices[ndarray]: 位于三角形内的点所在三角形的顶点， shape (k, 3)
+            weights[ndarray]: 对应顶点的重心坐标， shape (k, 3)
+    """
+    simplex = tri.find_simplex(points)
+    inside = simplex >= 0
+    if simplex_mask is not None:
+        inside[inside] = simplex_mask[simplex[inside]]
+    simplex = simplex[inside]
+    transform = tri.transform[simplex]
+    bary = np.einsum('ijk,ik->ij', transform[:, :2], points[inside] - transform[:, 2])
+    return inside, tri.simplices[simplex], np.column_stack([bary, 1 - bary.sum(axis=1)])
+
+
+def split_at_zero(points, values):
+    """
+    沿 y = 0 将每个三角形切分为三个不跨越 y = 0 的三角形， 不跨越时其中两个三角形面积为 0
+
+    :param points[ndarray]: 三角形的顶点， shape (m, 3, 2)
+    :param values[ndarray]: 顶点上的变量值， shape (m, 3)
+    :return points, values: 切分后的三角形， shape 分别为 (3m, 3, 2) 和 (3m, 3)
+    """
+    # 按 y 由小到大排列顶点
+    order = np.argsort(points[:, :, 1], axis=1)
+    points = np.take_along_axis(points, order[:, :, None], axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    p1, p2, p3 = points[:, 0], points[:, 1], points[:, 2]
+    z1, z2, z3 = values[:, 0], values[:, 1], values[:, 2]
+
+    def cross(pa, pb, za, zb):
+        """线段与 y = 0 的交点， 不相交时取离 y = 0 最近的端点"""
+        dy = pb[:, 1] - pa[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.where(dy != 0, -pa[:, 1] / dy, 0), 0, 1)
+        return pa + t[:, None] * (pb - pa), za + t * (zb - za)
+
+    q13, r13 = cross(p1, p3, z1, z3)
+    q12, r12 = cross(p1, p2, z1, z2)
+    q23, r23 = cross(p2, p3, z2, z3)
+    # * 中间顶点在 y = 0 之上时， 下方为三角形 (p1, q12, q13)， 上方为四边形 (q12, p2, p3, q13)
+    # * 否则上方为三角形 (p3, q13, q23)， 下方为四边形 (p1, p2, q23, q13)
+    upper = (p2[:, 1] >= 0)[:, None, None]
+    tris = [np.where(upper, np.stack([p1, q12, q13], 1), np.stack([p3, q13, q23], 1)),
+            np.where(upper, np.stack([q12, p2, p3], 1), np.stack([p1, p2, q23], 1)),
+            np.where(upper, np.stack([q12, p3, q13], 1), np.stack([p1, q23, q13], 1))]
+    upper = upper[:, :, 0]
+    zs = [np.where(upper, np.stack([z1, r12, r13], 1), np.stack([z3, r13, r23], 1)),
+          np.where(upper, np.stack([r12, z2, z3], 1), np.stack([z1, z2, r23], 1)),
+          np.where(upper, np.stack([r12, z3, r13], 1), np.stack([z1, r23, r13], 1))]
+    return np.concatenate(tris), np.concatenate(zs)
+
+
+def area_above(points, values, levels):
+    """
+    计算变量在三角形上线性分布时， 各个三角形中变量不小于各个 level 的面积
+
+    :param points[ndarray]: 三角形的顶点， shape (m, 3, 2)
+    :param values[ndarray]: 顶点上的变量值， shape (m, 3)
+    :param levels[ndarray]: shape (k,)
+    :return area[ndarray]: 三角形的面积， shape (m,)
+            above[ndarray]: shape (m, k)
+    """
+    edge1 = points[:, 1] - points[:, 0]
+    edge2 = points[:, 2] - points[:, 0]
+    area = np.abs(edge1[:, 0] * edge2[:, 1] - edge1[:, 1] * edge2[:, 0]) / 2
+    z1, z2, z3 = (item[:, None] for item in np.sort(values, axis=1).T)
+    levels = np.asarray(levels, dtype=np.float64)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # level 位于 z1, z2 之间时， 下方为与 z1 顶点相似的三角形; 位于 z2, z3 之间时上方为与 z3 顶点相似的三角形
+        low = 1 - (levels - z1) ** 2 / ((z2 - z1) * (z3 - z1))
+        high = (z3 - levels) ** 2 / ((z3 - z1) * (z3 - z2))
+    fraction = np.where(levels <= z1, 1.0,
+                        np.where(levels <= z2, low, np.where(levels < z3, high, 0.0)))
+    return area, area[:, None] * fraction
+
+
+class InterpolationContext:
+    """
+    同一组工况点上多个变量的线性插值
+
+    三角剖分、插值网格、网格点所在的三角形及其重心坐标只计算一次， 所有变量共用
+    """
+    def __init__(self, x, y, step_x=50, step_y=1, alpha=1000, max_cells=DEFAULT_MAX_CELLS,
+                 memory_budget=None):
+        """
+        :param x, y[ndarray]: 工况点的转速和转矩
+        :param step_x, step_y: 插值网格的转速和转矩间隔
+        :param alpha: 求取边界时的 alpha 值
+        :param max_cells[int]: 插值网格点数的上限， 超出时按比例增大 step_x 和 step_y, None 表示不限制
+        :param memory_budget[int]: 插值网格占用内存的上限(字节), 按每个网格点 CELL_BYTES 字节估算,
+                                   None 表示不限制
+        """
+        self.points = np.vstack([x, y]).T
+        self.tri = Delaunay(self.points)
+        # alpha shape 中的三角形， 即边界内的区域
+        self.alpha_mask = alpha_simplices(self.points, self.tri, alpha)
+        self.simplices = self.tri.simplices[self.alpha_mask]
+
+        self.step_x, self.step_y = grid_steps(x, y, step_x, step_y, max_cells, memory_budget)
+        self.grid_x, self.grid_y = np.mgrid[x.min(): x.max(): self.step_x,
+                                            y.min(): y.max(): self.step_y]
+        grid_points = np.vstack([self.grid_x.ravel(), self.grid_y.ravel()]).T
+        # * 网格点所在的三角形属于 alpha shape 时才在边界内， 同时得到所在三角形的顶点及其重心坐标
+        inside, self._vertices, self._weights = locate(self.tri, grid_points, self.alpha_mask)
+        self.in_boundary = inside.reshape(self.grid_x.shape)
+
+    def interpolate(self, values):
+        """
+        对多个变量同时进行插值， 边界外的网格点为 nan
+
+        :param values[list]: 各个变量在工况点上的值
+        :return 各个变量的插值结果， 形状与 self.grid_x 相同
+        """
+        values = np.column_stack(values)
+        grid = np.full((self.in_boundary.size, values.shape[1]), np.nan)
+        grid[self.in_boundary.ravel()] = np.einsum('ij,ijk->ik', self._weights,
+                                                   values[self._vertices])
+        return [grid[:, index].reshape(self.grid_x.shape) for index in range(values.shape[1])]
+
+    def area_fractions(self, values, levels):
+        """
+        在三角剖分上精确计算变量不小于各个 level 的面积占比， 与插值网格的分辨率无关
+
+        跨越 y = 0 的三角形沿 y = 0 切分， 正负两侧分别统计, 顶点值为 nan 的三角形不参与统计
+
+        :param values[ndarray]: 变量在工况点上的值
+        :param levels: 需要统计的变量值
+        :return positive, negative[ndarray]: y > 0 和 y < 0 区域中变量不小于各个 level 的面积百分比
+        """
+        values = np.asarray(values, dtype=np.float64)[self.simplices]
+        valid = ~np.isnan(values).any(axis=1)
+        points, values = split_at_zero(self.points[self.simplices[valid]], values[valid])
+        area, above = area_above(points, values, levels)
+        side = points[:, :, 1].sum(axis=1)
+        result = []
+        for region in (side > 0, side < 0):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result.append(above[region].sum(axis=0) / area[region].sum() * 100)
+        return result
@@ -0,0 +1,124 @@
+"""
+二进制格式的处理结果
+
+每个工况的结果另存为 result 文件夹下未压缩的 npz 文件， 各数组可直接以内存映射的方式读取,
+无需解析 csv 文件， 便于同时打开大量结果进行比较
+"""
+
+import os
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+BUNDLE_NAME = 'result.npz'
+# zip 文件中每个文件的本地文件头的固定长度， 其后为文件名及扩展字段
+LOCAL_HEADER_SIZE = 30
+
+
+def frame_arrays(name, df):
+    """
+    将 DataFrame 中的数值变量转换为二维数组及变量名数组
+
+    :return dict, name 为 float64 的二维数组， name + '_columns' 为变量名
+    """
+    df = df.select_dtypes(include=['number', 'bool'])
+    return {name: df.to_numpy(dtype=np.float64),
+            name + '_columns': np.array([str(column) for column in df.columns])}
+
+
+def pivot_arrays(name, pivot):
+    """
+    将二维表转换为数组
+
+    :return dict, name 为二维表的值， name + '_index' 及 name + '_columns' 为行、列的取值
+    """
+    return {name: pivot.to_numpy(dtype=np.float64),
+            name + '_index': pivot.index.to_numpy(dtype=np.float64),
+            name + '_columns': pivot.columns.to_numpy(dtype=np.float64)}
+
+
+def record(values):
+    """
+    将标量及定长数组组成的字典转换为只有一个元素的结构化数组， 每个键为一个带类型的字段
+
+    :param values[dict]: 字段名与值的对应关系
+    """
+    values = {name: np.asarray(value) for name, value in values.items()}
+    result = np.zeros(1, dtype=[(name, value.dtype, value.shape) for name, value in values.items()])
+    for name, value in values.items():
+        result[name] = value
+    return result
+
+
+def save_bundle(file_name, arrays):
+    """
+    将各个数组保存为未压缩的 npz 文件
+
+    先写入临时文件再替换: POSIX 系统中已经以内存映射方式打开旧文件的程序不受影响;
+    Windows 中旧文件被映射或打开时无法替换， 删除临时文件并抛出 PermissionError
+
+    :param arrays[dict]: 数组名与数组的对应关系， 不能包含 object 类型的数组
+    """
+    temp_name = file_name + '.tmp'
+    with open(temp_name, 'wb') as f:
+        np.savez(f, **arrays)
+    try:
+        os.replace(temp_name, file_name)
+    except PermissionError as e:
+        os.remove(temp_name)
+        raise PermissionError("Cannot replace {}, it is memory-mapped or opened by another program; "
+                              "close it and run again".format(file_name)) from e
+
+
+def _member_offset(f, info):
+    """
+    获取 zip 文件中某个文件的数据部分的起始位置
+    """
+    f.seek(info.header_offset)
+    header = f.read(LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+
+
+def load_bundle(file_name, mmap=True):
+    """
+    读取 npz 文件中的所有数组
+
+    :param mmap[bool]: True 则未压缩的数组以只读的内存映射方式打开， 不读取数据;
+                       压缩的、object 类型的及空数组总是直接读取
+
+    :return dict, 数组名与数组的对应关系
+    """
+    arrays = {}
+    with zipfile.ZipFile(file_name) as archive, open(file_name, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                f.seek(_member_offset(f, info))
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                if not dtype.hasobject and np.prod(shape) > 0:
+                    arrays[name] = np.memmap(file_name, dtype=dtype, mode='r', offset=f.tell(),
+                                             shape=shape, order='F' if fortran_order else 'C')
+                    continue
+            with archive.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return arrays
+
+
+def to_frame(bundle, name):
+    """
+    由 load_bundle 的结果还原 DataFrame
+
+    :param name[str]: frame_arrays 或 pivot_arrays 中的 name
+    """
+    if name + '_index' in bundle:
+        return pd.DataFrame(bundle[name], index=bundle[name + '_index'],
+                            columns=bundle[name + '_columns'])
+    return pd.DataFrame(bundle[name], columns=bundle[name + '_columns'])
@@ -0,0 +1,103 @@
+"""
+按声明式的规则剔除异常数据
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _rule_name(rule):
+    """
+    生成规则的描述， 用于统计报告
+    """
+    if 'name' in rule:
+        return rule['name']
+    parts = []
+    if 'max' in rule:
+        parts.append("< {:g}".format(rule['max']))
+    if 'min' in rule:
+        parts.append("> {:g}".format(rule['min']))
+    if 'abs_max' in rule:
+        parts.append("abs < {:g}".format(rule['abs_max']))
+    if 'range' in rule:
+        parts.append("in [{:g}, {:g}]".format(*rule['range']))
+    if 'rescale' in rule:
+        parts.append("> {:g} then * {:g}".format(rule['rescale']['above'],
+                                                rule['rescale']['factor']))
+    return ", ".join(parts)
+
+
+def evaluate_rules(data, rules):
+    """
+    依次计算所有规则， 得到需要保留的行
+
+    规则为字典， channels 为规则作用的变量名列表， 其余的键为:
+        max: 保留小于 max 的行， 可用于剔除 1e30 一类的无效值
+        min: 保留大于 min 的行
+        abs_max: 保留绝对值小于 abs_max 的行
+        range: [下限, 上限], 保留位于区间内的行
+        rescale: {'above': 阈值, 'factor': 系数}, 大于阈值的值逐行乘以系数, 不剔除数据,
+                 其后的规则使用换算后的值
+        name: 可选， 规则在报告中的名称
+    值为 nan 的行不满足 max, min, abs_max 和 range 的条件
+
+    :param data[DataFrame]: 待处理的数据
+    :param rules[list]: 按顺序执行的规则列表
+
+    :return keep[ndarray]: bool 数组， True 表示保留该行
+            rescaled[dict]: 经过换算的变量名与换算后的值
+            report[list]: 每条规则对每个变量的统计， dropped 为该规则新剔除的行数,
+                          rescaled 为保留的行中经过换算的行数
+    """
+    keep = np.ones(len(data), dtype=bool)
+    values = {}
+    rescaled = {}
+    report = []
+    for rule in rules:
+        for channel in rule['channels']:
+            if channel not in values:
+                values[channel] = data[channel].to_numpy(dtype=np.float64)
+            value = values[channel]
+            record = {'channel': channel, 'rule': _rule_name(rule), 'dropped': 0, 'rescaled': 0}
+            valid = np.ones(len(data), dtype=bool)
+            with np.errstate(invalid='ignore'):
+                if 'max' in rule:
+                    valid &= value < rule['max']
+                if 'min' in rule:
+                    valid &= value > rule['min']
+                if 'abs_max' in rule:
+                    valid &= np.abs(value) < rule['abs_max']
+                if 'range' in rule:
+                    valid &= (value >= rule['range'][0]) & (value <= rule['range'][1])
+                if 'rescale' in rule:
+                    hit = value > rule['rescale']['above']
+                    value = values[channel] = rescaled[channel] = \
+                        np.where(hit, value * rule['rescale']['factor'], value)
+            record['dropped'] = int(np.count_nonzero(keep & ~valid))
+            keep &= valid
+            if 'rescale' in rule:
+                record['rescaled'] = int(np.count_nonzero(keep & hit))
+            report.append(record)
+    return keep, rescaled, report
+
+
+def sanitize(data, rules):
+    """
+    按规则剔除异常数据， 所有规则合并为一个掩膜， 只复制一次数据
+
+    :param data[DataFrame]: 待处理的数据, 不会被修改
+    :param rules[list]: 规则列表， 见 evaluate_rules
+
+    :return data[DataFrame]: 处理后的数据
+            report[DataFrame]: 每条规则剔除及换算的行数
+    """
+    keep, rescaled, report = evaluate_rules(data, rules)
+    report = pd.DataFrame(report, columns=['channel', 'rule', 'dropped', 'rescaled'])
+    if keep.all() and not rescaled:
+        return data, report
+    columns = [rescaled[column] if column in rescaled else data[column].to_numpy()
+               for column in data.columns]
+    result = pd.DataFrame({index: value[keep] for index, value in enumerate(columns)},
+                          index=data.index[keep])
+    result.columns = data.columns
+    return result, report
@@ -0,0 +1,8 @@
+"""
+测试时将仓库根目录加入模块搜索路径
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
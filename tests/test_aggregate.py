@@ -0,0 +1,103 @@
+"""
+aggregate 的测试， 分段统计与 pandas 的 groupby 对比， 分块累计与一次性统计对比
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregate import ChunkedAggregator, segment_reduce, steady_state_mask
+
+KEYS = ['speed', 'torque']
+STATS = ('mean', 'std', 'min', 'max', 'count')
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 20000
+    data = pd.DataFrame({'speed': rng.integers(0, 15, n) * 500.0,
+                         'torque': rng.choice([-50.0, 0.0, 50.0, 100.0], n),
+                         'a': rng.normal(1e6, 1, n),
+                         'b': rng.normal(0, 1, n),
+                         'order': rng.permutation(n) // 3})
+    data.loc[rng.random(n) < 0.01, 'a'] = np.nan
+    data.loc[rng.random(n) < 0.002, 'speed'] = np.nan
+    return data
+
+
+def chunked(data, window, stats, chunksize=3000, order=None, row_mask=None):
+    aggregator = ChunkedAggregator(KEYS, window, stats)
+    for start in range(0, len(data), chunksize):
+        part = slice(start, start + chunksize)
+        aggregator.add(data.iloc[part], None if order is None else order[part],
+                       None if row_mask is None else row_mask[part])
+    return aggregator.result()
+
+
+@pytest.mark.parametrize('window, head', [(None, None), (('head', 20), 20)])
+def test_segment_reduce_matches_groupby(data, window, head):
+    used = data if head is None else data.groupby(KEYS).head(head)
+    expected = used.groupby(KEYS).agg(list(STATS))
+    result = segment_reduce(data, KEYS, window, STATS)
+    assert result.index.equals(expected.index)
+    # pandas 的 std 在均值约为 1e6 时有约 1e-10 的相对误差
+    np.testing.assert_allclose(result.to_numpy(), expected[result.columns].to_numpy(),
+                               rtol=1e-9, atol=1e-12)
+
+
+def test_segment_reduce_single_stat_columns(data):
+    result = segment_reduce(data, KEYS, ('tail', 10))
+    expected = data.groupby(KEYS).tail(10).groupby(KEYS).mean()
+    assert list(result.columns) == ['a', 'b', 'order']
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+def test_steady_state_mask_picks_flat_run():
+    values = np.r_[np.linspace(0, 10, 30), np.full(50, 10.0), np.linspace(10, 0, 20)]
+    mask = steady_state_mask(values[:, None], np.zeros(len(values), dtype=np.int64), 10)
+    assert mask[30:80].all()
+    assert not mask[:25].any() and not mask[85:].any()
+
+
+@pytest.mark.parametrize('window', [('head', 50), ('tail', 37)])
+@pytest.mark.parametrize('use_order', [False, True])
+@pytest.mark.parametrize('use_mask', [False, True])
+def test_chunked_window_is_exact(data, window, use_order, use_mask):
+    rng = np.random.default_rng(1)
+    row_mask = rng.random(len(data)) < 0.9 if use_mask else None
+    order = data['order'].to_numpy() if use_order else None
+    # 排序键相同时按读入的先后排列， 与稳定排序后一次性统计相同
+    sort = np.argsort(order, kind='stable') if use_order else np.arange(len(data))
+    expected = segment_reduce(data.iloc[sort], KEYS, window, STATS,
+                              None if row_mask is None else row_mask[sort])
+    result = chunked(data, window, STATS, order=order, row_mask=row_mask)
+    assert result.index.equals(expected.index)
+    assert list(result.columns) == list(expected.columns)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+
+def test_chunked_without_window_matches(data):
+    expected = segment_reduce(data, KEYS, None, STATS)
+    result = chunked(data, None, STATS)
+    assert result.index.equals(expected.index)
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-13, atol=1e-13)
+    # 均值约为 1e6 时标准差仍保持精度
+    np.testing.assert_allclose(result[('a', 'std')], expected[('a', 'std')], rtol=1e-12)
+
+
+def test_chunked_columns_union_and_means(data):
+    first, second = data.iloc[:10000].drop(columns='b'), data.iloc[10000:]
+    expected = segment_reduce(pd.concat([first, second], sort=False), KEYS, ('head', 30))
+    aggregator = ChunkedAggregator(KEYS, ('head', 30))
+    aggregator.add(first)
+    aggregator.add(second)
+    result = aggregator.result()
+    assert list(result.columns) == list(expected.columns)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+    np.testing.assert_allclose(aggregator.column_means()['a'], data['a'].mean(), rtol=1e-14)
+
+
+def test_chunked_rejects_whole_segment_windows():
+    with pytest.raises(ValueError):
+        ChunkedAggregator(KEYS, ('steady', 50, ['a']))
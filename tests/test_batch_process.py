@@ -0,0 +1,73 @@
+"""
+batch_process 的测试
+"""
+
+import json
+import os
+
+import batch_process
+import benchmark
+
+
+def crash_or_finish(path, test_condition, file_type=None, force=False, draft=False):
+    """
+    代替 run_single, 处理名为 crash 的文件夹时子进程直接退出
+    """
+    if os.path.basename(path) == 'crash':
+        os._exit(1)
+    return {'path': path, 'test_condition': test_condition, 'file_type': file_type,
+            'status': 'ok', 'error': None, 'seconds': 0.0}
+
+
+def test_manifest_written_when_worker_dies(tmp_path, monkeypatch):
+    for name in ['a', 'crash']:
+        (tmp_path / 'Eff' / name).mkdir(parents=True)
+    monkeypatch.setattr(batch_process, 'run_single', crash_or_finish)
+    records = batch_process.run_campaign(str(tmp_path), workers=1)
+    with open(tmp_path / batch_process.MANIFEST_NAME, encoding='utf8') as f:
+        manifest = json.load(f)
+    statuses = {os.path.basename(record['path']): record['status'] for record in records}
+    assert statuses['crash'] == 'failed'
+    assert 'BrokenProcessPool' in next(record['error'] for record in records
+                                       if record['status'] == 'failed')
+    assert manifest['total'] == 2
+    assert manifest['failed'] == sum(status == 'failed' for status in statuses.values())
+
+
+def test_match_test_condition():
+    patterns = batch_process.DEFAULT_PATTERNS
+    assert batch_process.match_test_condition(os.path.join('03 Eff', '335V'), patterns) == 'efficiency'
+    assert batch_process.match_test_condition(os.path.join('02 asc', '65'), patterns) == 'ASC'
+    assert batch_process.match_test_condition('other', patterns) is None
+
+
+def test_detect_file_type(tmp_path):
+    assert batch_process.detect_file_type(str(tmp_path)) is None
+    (tmp_path / 'a.csv').touch()
+    assert batch_process.detect_file_type(str(tmp_path)) == 'csv'
+    # erg 优先于 csv, 后缀不区分大小写， 与 FileOperator 读取文件时一致
+    (tmp_path / 'b.ERG').touch()
+    assert batch_process.detect_file_type(str(tmp_path)) == 'erg'
+
+
+def test_find_leaf_folders(tmp_path):
+    for folder in ['01 open_circuit/20', '03 Eff/335V/result', '03 Eff/350V',
+                   '03 Eff/.hidden', 'misc/other']:
+        (tmp_path / folder).mkdir(parents=True)
+    folders = batch_process.find_leaf_folders(str(tmp_path))
+    assert [(os.path.relpath(path, str(tmp_path)), condition) for path, condition in folders] == [
+        (os.path.join('01 open_circuit', '20'), 'open_circuit'),
+        (os.path.join('03 Eff', '335V'), 'efficiency'),
+        (os.path.join('03 Eff', '350V'), 'efficiency')]
+
+
+def test_run_single_upper_case_suffix(tmp_path):
+    folder = tmp_path / 'Eff' / '335V'
+    file_names = benchmark.generate_dataset(str(folder), rows=20000, channels=20, files=2)
+    (folder / benchmark.DATASET_NAME).unlink()
+    for file_name in file_names:
+        os.rename(file_name, os.path.splitext(file_name)[0] + '.ERG')
+    record = batch_process.run_single(str(folder), 'efficiency', draft=True)
+    assert record['file_type'] == 'erg'
+    assert record['status'] == 'ok', record['error']
+    assert (folder / 'result' / 'result.csv').exists()
@@ -0,0 +1,77 @@
+"""
+data_process 中排序、合并及效率计算函数的测试
+"""
+
+import numpy as np
+import pandas as pd
+
+from data_process import TIME_COLUMNS, compute_efficiency, merge_by_time, sort_by_time, time_key
+
+
+def time_frame(seconds, minute=30, values=None):
+    """
+    生成 2023-05-14 10:minute:seconds 的时间数据
+    """
+    n = len(seconds)
+    data = pd.DataFrame({column: np.full(n, value, dtype=np.float64) for column, value in
+                         zip(TIME_COLUMNS[:-1], [2023, 5, 14, 10, minute])})
+    data[TIME_COLUMNS[-1]] = seconds
+    data['value'] = np.arange(n) if values is None else values
+    return data
+
+
+def test_time_key_millisecond_resolution():
+    key = time_key(time_frame([12.001, 12.002, 12.003, 12.004]))
+    assert key.dtype == np.int64
+    assert np.array_equal(np.diff(key), [1, 1, 1])
+    assert key[0] == 20230514103012001
+
+
+def test_time_key_missing_is_last():
+    data = time_frame([1.0, np.nan, 2.0])
+    key = time_key(data)
+    assert key[1] == np.iinfo(np.int64).max
+    assert key[0] < key[2]
+
+
+def test_sort_by_time_within_4ms():
+    data = time_frame([12.003, 12.001, 12.002, 12.000])
+    sort_by_time(data)
+    assert list(data['value']) == [3, 1, 2, 0]
+
+
+def test_merge_by_time_interleaved():
+    first = time_frame([0.001, 0.003, 0.005], values=[1, 3, 5])
+    second = time_frame([0.002, 0.004, 0.006], values=[2, 4, 6])
+    assert list(merge_by_time([first, second])['value']) == [1, 2, 3, 4, 5, 6]
+
+
+def test_merge_by_time_non_overlapping():
+    first = time_frame([0.0, 1.0], minute=31, values=[3, 4])
+    second = time_frame([0.0, 1.0], minute=30, values=[1, 2])
+    assert list(merge_by_time([first, second])['value']) == [1, 2, 3, 4]
+
+
+def test_compute_efficiency_motor_and_generator():
+    speed = np.array([955.0, 955.0, 955.0])
+    torque = np.array([10.0, -10.0, 10.0])
+    torque_set = np.array([10.0, -10.0, 10.0])
+    power_ac1 = np.array([600.0, -500.0, 0.0])
+    power_ac2 = np.array([500.0, -400.0, 0.0])
+    power_dc = np.array([1200.0, -850.0, 100.0])
+    power_m, motor_eff, peu_eff, sys_eff = compute_efficiency(
+        speed, torque, torque_set, power_ac1, power_ac2, power_dc)
+    np.testing.assert_allclose(power_m, [1000.0, -1000.0, 1000.0])
+    # 驱动状态为输出与输入之比， 发电状态取倒数
+    np.testing.assert_allclose(motor_eff[:2], [1000 / 1100 * 100, 900 / 1000 * 100])
+    np.testing.assert_allclose(peu_eff[:2], [1100 / 1200 * 100, 850 / 900 * 100])
+    np.testing.assert_allclose(sys_eff[:2], [1000 / 1200 * 100, 850 / 1000 * 100])
+    # 交流功率为 0 时效率为无穷大， 置为 0
+    assert motor_eff[2] == 0 and peu_eff[2] == 0
+
+
+def test_compute_efficiency_float32():
+    values = [np.array([1000.0, np.nan])] * 6
+    results = compute_efficiency(*values, dtype='float32')
+    assert all(result.dtype == np.float32 for result in results)
+    assert np.isnan(results[1][1])
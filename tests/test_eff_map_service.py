@@ -0,0 +1,71 @@
+"""
+eff_map_service 中插值结构缓存的测试
+"""
+
+import threading
+import time
+
+import pytest
+
+import eff_map_service
+from eff_map_service import EfficiencyMapIndex
+
+
+@pytest.fixture
+def slow_loads(monkeypatch):
+    """
+    代替 EfficiencyMap.from_pivot_csv, 记录调用次数， 以 fail 中的文件名调用时抛出异常
+    """
+    calls, fail = [], set()
+
+    def from_pivot_csv(file_name):
+        calls.append(file_name)
+        time.sleep(0.05)
+        if file_name in fail:
+            raise ValueError(file_name)
+        return object()
+    monkeypatch.setattr(eff_map_service.EfficiencyMap, 'from_pivot_csv', from_pivot_csv)
+    return calls, fail
+
+
+def concurrent_get(index, file_name, threads=8):
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = index.get_map(file_name)
+        except Exception as e:
+            results[i] = e
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return results
+
+
+def test_concurrent_requests_load_once(tmp_path, slow_loads):
+    calls, _ = slow_loads
+    file_name = tmp_path / 'motor_eff_pivot.csv'
+    file_name.write_text('')
+    index = EfficiencyMapIndex(str(tmp_path))
+    results = concurrent_get(index, str(file_name))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert index.get_map(str(file_name)) is results[0] and len(calls) == 1
+
+
+def test_failed_load_reaches_waiters_and_is_retried(tmp_path, slow_loads):
+    calls, fail = slow_loads
+    file_name = tmp_path / 'motor_eff_pivot.csv'
+    file_name.write_text('')
+    fail.add(str(file_name))
+    index = EfficiencyMapIndex(str(tmp_path))
+    results = concurrent_get(index, str(file_name))
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    fail.clear()
+    index.get_map(str(file_name))
+    assert len(calls) == 2
@@ -0,0 +1,30 @@
+"""
+file_operator 的测试
+"""
+
+import os
+
+import pytest
+
+from file_operator import GetInformationOfPath
+
+
+@pytest.mark.parametrize('names', [['x.dat'], ['x.DAT'], ['x.dat', 'y.DAT']])
+def test_dat_files_ignore_case(tmp_path, names):
+    for name in names + ['z.txt']:
+        (tmp_path / name).touch()
+    files = GetInformationOfPath(str(tmp_path)).dat_files
+    assert sorted(os.path.basename(name) for name in files) == sorted(names)
+
+
+def test_dat_files_of_single_file(tmp_path):
+    (tmp_path / 'x.dat').touch()
+    (tmp_path / 'y.dat').touch()
+    files = GetInformationOfPath(str(tmp_path / 'x.dat')).dat_files
+    assert files == [str(tmp_path / 'x.dat')]
+
+
+def test_dat_files_missing(tmp_path):
+    (tmp_path / 'z.txt').touch()
+    with pytest.raises(FileExistsError):
+        GetInformationOfPath(str(tmp_path)).dat_files
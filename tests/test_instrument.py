@@ -0,0 +1,28 @@
+"""
+instrument 中分步骤计时的测试
+"""
+
+import tracemalloc
+
+from instrument import Tracer
+
+
+def test_tracer_skips_memory_by_default():
+    tracer = Tracer()
+    with tracer.stage('read', rows_in=10) as record:
+        record['rows_out'] = 5
+    assert not tracemalloc.is_tracing()
+    assert tracer.records[0]['rows_out'] == 5 and 'peak_mb' not in tracer.records[0]
+    assert tracer.records[0]['wall_s'] >= 0 and tracer.records[0]['cpu_s'] >= 0
+
+
+def test_tracer_records_nested_peaks_when_asked():
+    tracer = Tracer(memory=True)
+    with tracer.stage('process'):
+        with tracer.stage('average'):
+            block = bytearray(8 * 1024 ** 2)
+        del block
+    assert not tracemalloc.is_tracing()
+    records = {record['name']: record for record in tracer.records}
+    assert records['process/average']['peak_mb'] >= 8
+    assert records['process']['peak_mb'] >= records['process/average']['peak_mb']
@@ -0,0 +1,67 @@
+"""
+interpolation 中插值及面积统计的测试
+"""
+
+import numpy as np
+import pytest
+
+from interpolation import InterpolationContext, area_above, grid_steps, split_at_zero
+
+
+def triangle_area(points):
+    edge1 = points[:, 1] - points[:, 0]
+    edge2 = points[:, 2] - points[:, 0]
+    return np.abs(edge1[:, 0] * edge2[:, 1] - edge1[:, 1] * edge2[:, 0]) / 2
+
+
+def test_split_at_zero_keeps_area_and_linear_values():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-1, 1, (200, 3, 2))
+    values = rng.uniform(0, 100, (200, 3))
+    tris, zs = split_at_zero(points, values)
+    assert tris.shape == (600, 3, 2) and zs.shape == (600, 3)
+    # 三个子三角形的面积之和等于原三角形的面积
+    np.testing.assert_allclose(triangle_area(tris).reshape(3, -1).sum(axis=0),
+                               triangle_area(points), rtol=1e-9, atol=1e-12)
+    # 面积不为 0 的子三角形不跨越 y = 0
+    y = tris[:, :, 1]
+    crossing = (y.min(axis=1) < -1e-12) & (y.max(axis=1) > 1e-12) & (triangle_area(tris) > 1e-12)
+    assert not crossing.any()
+    # 子三角形顶点上的值与原三角形上的线性分布一致
+    plane = np.linalg.solve(np.concatenate([points, np.ones((200, 3, 1))], axis=2), values)
+    expected = np.einsum('mij,mj->mi', np.concatenate([tris, np.ones((600, 3, 1))], axis=2),
+                         np.tile(plane, (3, 1)))
+    np.testing.assert_allclose(zs, expected, atol=1e-8)
+
+
+@pytest.mark.parametrize('level', [-1.0, 0.0, 0.25, 0.5, 0.9, 1.0, 2.0])
+def test_area_above_linear_triangle(level):
+    # z = x 的直角三角形中 x >= level 的面积为 (1 - level) ** 2 / 2
+    points = np.array([[[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]]])
+    values = np.array([[0.0, 1.0, 0.0]])
+    area, above = area_above(points, values, [level])
+    assert area[0] == pytest.approx(0.5)
+    assert above[0, 0] == pytest.approx(np.clip(1 - level, 0, 1) ** 2 / 2)
+
+
+def test_area_above_flat_triangle():
+    points = np.array([[[0.0, 0.0], [2.0, 0.0], [0.0, 2.0]]])
+    area, above = area_above(points, np.array([[80.0, 80.0, 80.0]]), [70, 80, 90])
+    np.testing.assert_allclose(above[0], [2.0, 2.0, 0.0])
+
+
+def test_area_fractions_of_plane():
+    x, y = np.meshgrid(np.linspace(0, 5000, 21), np.linspace(-100, 100, 21))
+    x, y = x.ravel(), y.ravel()
+    context = InterpolationContext(x, y)
+    positive, negative = context.area_fractions(100 * x / 5000, [90, 50, 0])
+    np.testing.assert_allclose(positive, [10, 50, 100], atol=1e-9)
+    np.testing.assert_allclose(negative, [10, 50, 100], atol=1e-9)
+
+
+def test_grid_steps_bounded():
+    x, y = np.array([0.0, 10000.0]), np.array([-300.0, 300.0])
+    assert grid_steps(x, y, 50, 1) == (50, 1)
+    step_x, step_y = grid_steps(x, y, 50, 1, max_cells=10000)
+    assert (10000 / step_x + 1) * (600 / step_y + 1) <= 10000 + 1e-6
+    assert step_x / step_y == pytest.approx(50)
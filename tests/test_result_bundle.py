@@ -0,0 +1,85 @@
+"""
+result_bundle 中二进制结果的保存及读取的测试
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import result_bundle
+from result_bundle import frame_arrays, load_bundle, pivot_arrays, record, save_bundle, to_frame
+
+
+@pytest.fixture
+def arrays():
+    df = pd.DataFrame({'speed': [1000.0, 2000.0, 3000.0], 'torque': [10, 20, 30],
+                       'label': ['a', 'b', 'c']})
+    pivot = pd.DataFrame([[80.0, np.nan], [85.5, 90.1]], index=[-50.0, 50.0],
+                         columns=[1000.0, 2000.0])
+    result = {'in_boundary': np.array([[True, False], [False, True]]),
+              'empty': np.zeros((0, 3)),
+              'kpis': record({'max_eff': 95.5, 'count': np.int64(12), 'levels': np.array([80.0, 90.0])})}
+    result.update(frame_arrays('data', df))
+    result.update(pivot_arrays('eff_pivot', pivot))
+    return result
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(tmp_path, arrays, mmap):
+    file_name = str(tmp_path / 'result.npz')
+    save_bundle(file_name, arrays)
+    bundle = load_bundle(file_name, mmap=mmap)
+    assert set(bundle) == set(arrays)
+    for name, value in arrays.items():
+        assert bundle[name].dtype == value.dtype
+        np.testing.assert_array_equal(bundle[name], value)
+    assert isinstance(bundle['eff_pivot'], np.memmap) == mmap
+    assert not isinstance(bundle['empty'], np.memmap)
+    assert bundle['kpis']['max_eff'][0] == 95.5
+    np.testing.assert_array_equal(bundle['kpis']['levels'][0], [80.0, 90.0])
+
+
+def test_to_frame(tmp_path, arrays):
+    file_name = str(tmp_path / 'result.npz')
+    save_bundle(file_name, arrays)
+    bundle = load_bundle(file_name)
+    data = to_frame(bundle, 'data')
+    assert list(data.columns) == ['speed', 'torque']
+    assert data['torque'].tolist() == [10.0, 20.0, 30.0]
+    pivot = to_frame(bundle, 'eff_pivot')
+    assert pivot.index.tolist() == [-50.0, 50.0] and pivot.columns.tolist() == [1000.0, 2000.0]
+    assert np.isnan(pivot.iloc[0, 1]) and pivot.iloc[1, 1] == 90.1
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="Windows 中无法替换已映射的文件")
+def test_replace_while_mapped(tmp_path):
+    file_name = str(tmp_path / 'result.npz')
+    save_bundle(file_name, {'values': np.arange(5.0)})
+    old = load_bundle(file_name)
+    save_bundle(file_name, {'values': np.arange(5.0) * 2})
+    # * 已打开的内存映射仍指向旧文件， 重新读取得到新结果
+    np.testing.assert_array_equal(old['values'], np.arange(5.0))
+    np.testing.assert_array_equal(load_bundle(file_name)['values'], np.arange(5.0) * 2)
+    assert not (tmp_path / 'result.npz.tmp').exists()
+
+
+
+def test_replace_refused(tmp_path, monkeypatch):
+    file_name = str(tmp_path / 'result.npz')
+
+    def refuse(src, dst):
+        raise PermissionError(13, 'Access is denied', dst)
+    monkeypatch.setattr(result_bundle.os, 'replace', refuse)
+    with pytest.raises(PermissionError, match='memory-mapped'):
+        save_bundle(file_name, {'values': np.arange(5.0)})
+    assert os.listdir(str(tmp_path)) == []
+
+def test_compressed_bundle_is_read(tmp_path):
+    file_name = str(tmp_path / 'result.npz')
+    np.savez_compressed(file_name, values=np.arange(4.0))
+    bundle = load_bundle(file_name)
+    assert not isinstance(bundle['values'], np.memmap)
+    np.testing.assert_array_equal(bundle['values'], np.arange(4.0))
@@ -0,0 +1,49 @@
+"""
+sanitize 中数据清洗规则的测试
+"""
+
+import numpy as np
+import pandas as pd
+
+from sanitize import evaluate_rules, sanitize
+
+
+def test_evaluate_rules_drops_and_reports():
+    data = pd.DataFrame({'u': [1.0, 2e30, 3.0, np.nan, 5.0],
+                         'i': [1.0, 2.0, -700.0, 4.0, 5.0]})
+    rules = [{'channels': ['u'], 'max': 1e30},
+             {'channels': ['i'], 'abs_max': 600, 'name': 'current'}]
+    keep, rescaled, report = evaluate_rules(data, rules)
+    # nan 不满足条件
+    assert keep.tolist() == [True, False, False, False, True]
+    assert rescaled == {}
+    assert [(item['rule'], item['dropped']) for item in report] == [('< 1e+30', 2), ('current', 1)]
+
+
+def test_rescale_applies_before_later_rules():
+    data = pd.DataFrame({'i': [100.0, 200000.0, 700000.0]})
+    rules = [{'channels': ['i'], 'rescale': {'above': 600, 'factor': 1e-3}},
+             {'channels': ['i'], 'range': [0, 600]}]
+    keep, rescaled, report = evaluate_rules(data, rules)
+    assert keep.tolist() == [True, True, False]
+    np.testing.assert_allclose(rescaled['i'], [100.0, 200.0, 700.0])
+    # 换算的行数只统计换算时仍保留的行
+    assert report[0]['rescaled'] == 2
+    assert report[1]['dropped'] == 1
+
+
+def test_sanitize_copies_once_and_keeps_input():
+    data = pd.DataFrame({'i': [100.0, 2000.0, np.nan], 'x': [1, 2, 3]}, index=[10, 11, 12])
+    rules = [{'channels': ['i'], 'rescale': {'above': 600, 'factor': 1e-3}},
+             {'channels': ['i'], 'min': 0}]
+    result, report = sanitize(data, rules)
+    assert result.index.tolist() == [10, 11]
+    assert result['i'].tolist() == [100.0, 2.0]
+    assert data['i'].tolist()[:2] == [100.0, 2000.0]
+    assert list(report.columns) == ['channel', 'rule', 'dropped', 'rescaled']
+
+
+def test_sanitize_without_changes_returns_input():
+    data = pd.DataFrame({'i': [1.0, 2.0]})
+    result, _ = sanitize(data, [{'channels': ['i'], 'max': 10}])
+    assert result is data